@@ -0,0 +1,58 @@
+"""Compare list_dict.changes with the digest_index/digest_changes fast path
+
+    PYTHONPATH=. python benchmarks/bench_list_dict.py --rows 500000 --columns 40
+"""
+import argparse
+import random
+import time
+
+from shareplum import list_dict
+
+
+def make_rows(rows, columns, seed):
+    rng = random.Random(seed)
+    return [dict({"ID": i, "Key": "k%d" % i}, **{"Col%d" % c: rng.randint(0, 9) for c in range(columns)})
+            for i in range(rows)]
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print("%-28s %8.3fs" % (label, elapsed))
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=40)
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of rows with a changed value")
+    args = parser.parse_args()
+
+    old = make_rows(args.rows, args.columns, 1)
+    new = [dict(row) for row in old]
+    rng = random.Random(2)
+    for row in rng.sample(new, int(args.rows * args.changed)):
+        row["Col%d" % rng.randrange(args.columns)] = 10
+    columns = ["Col%d" % c for c in range(args.columns)]
+    print("%d rows x %d columns, %d changed" % (args.rows, args.columns, int(args.rows * args.changed)))
+
+    (old_cmp, new_cmp), build = timed("full_dict (old + new)",
+                                      lambda: (list_dict.full_dict(old, "Key"), list_dict.full_dict(new, "Key")))
+    slow, compare = timed("changes", lambda: list_dict.changes(new_cmp, old_cmp, "ID", columns))
+    slow_total = build + compare
+
+    (old_index, new_index), build = timed("digest_index (old + new)",
+                                          lambda: (list_dict.digest_index(old, "Key", columns),
+                                                   list_dict.digest_index(new, "Key", columns)))
+    fast, compare = timed("digest_changes", lambda: list_dict.digest_changes(new_index, old_index, "ID", columns))
+    fast_total = build + compare
+
+    assert sorted(slow, key=lambda row: row["ID"]) == sorted(fast, key=lambda row: row["ID"])
+    print("%-28s %8.3fs" % ("total, changes", slow_total))
+    print("%-28s %8.3fs  (%.1fx)" % ("total, digest_changes", fast_total, slow_total / fast_total))
+
+
+if __name__ == "__main__":
+    main()
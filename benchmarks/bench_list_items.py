@@ -0,0 +1,49 @@
+"""Time decoding a GetListItems response into rows and columns
+
+    PYTHONPATH=. python benchmarks/bench_list_items.py --rows 100000
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+
+from lxml import etree
+
+from shareplum.list import _List2007
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "data")
+
+ROW = ('<z:row ows_ID="%d" ows_Title="Row %d" ows_Test="%d.50000000000000" ows_Test3="12.0" ows_Test10="1" '
+       'ows_Created="2020-01-02 03:04:05" ows_Modified="%d;#2021-05-06 07:08:09" />\n')
+
+
+def make_response(rows):
+    rows_xml = "".join(ROW % (i, i, i, i) for i in range(1, rows + 1))
+    return ('<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<soap:Body><GetListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><GetListItemsResult>'
+            '<listitems xmlns:rs="urn:schemas-microsoft-com:rowset" xmlns:z="#RowsetSchema"><rs:data ItemCount="%d">%s'
+            '</rs:data></listitems></GetListItemsResult></GetListItemsResponse></soap:Body></soap:Envelope>'
+            % (rows, rows_xml)).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    sp_list = _List2007(None, "Test List", None, True, None, False, None)
+    with open(os.path.join(DATA, "2010xml.xml"), "rb") as f:
+        sp_list._set_list_info(*_List2007.parse_list_envelope(etree.fromstring(f.read())))
+    viewfields = ["ID", "Title", "Test", "Test3", "Test10", "Created", "Modified"]
+    content = make_response(args.rows)
+
+    for label, read in (("rows", lambda: list(sp_list._iter_rows(BytesIO(content), viewfields))),
+                        ("columns", lambda: sp_list._read_columns(BytesIO(content), viewfields, "columns"))):
+        start = time.perf_counter()
+        read()
+        elapsed = time.perf_counter() - start
+        print("%-8s %8.3fs  %10.0f rows/s" % (label, elapsed, args.rows / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Time building and serializing UpdateListItems envelopes
+
+    PYTHONPATH=. python benchmarks/bench_soap.py --rows 50000
+
+Each case builds one Batch with the tree and the bytes writer and
+reports the best of --repeat runs per 10k rows.
+"""
+import argparse
+import time
+
+from shareplum.soap import Soap
+
+
+def narrow(i):
+    return {"Title": "Row %d" % i, "Status": "Open"}
+
+
+def wide(i):
+    return dict(("Column%d" % column, "Value %d.%d" % (i, column)) for column in range(30))
+
+
+def escaped(i):
+    return {"Title": "Row %d & <pending>" % i, "Comments": 'Some "quoted"\r\ntext on row %d' % i, "Amount": i * 1.5}
+
+
+def deletes(i):
+    return str(i)
+
+
+CASES = (("narrow", "New", narrow), ("wide", "Update", wide), ("escaped", "New", escaped), ("delete", "Delete", deletes))
+
+
+def build(rows, kind, writer):
+    soap_request = Soap("UpdateListItems", writer=writer)
+    soap_request.add_parameter("listName", "Test List")
+    soap_request.add_actions(rows, kind)
+    return soap_request
+
+
+def pretty_twice(soap_request):
+    # What every call used to do: str() for last_request and again for the body
+    str(soap_request)
+    return str(soap_request).encode("utf-8")
+
+
+def timed(repeat, rows, kind, writer, serialize):
+    build_time = serialize_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        soap_request = build(rows, kind, writer)
+        built = time.perf_counter()
+        serialize(soap_request)
+        done = time.perf_counter()
+        build_time = min(build_time, built - start)
+        serialize_time = min(serialize_time, done - built)
+    return build_time, serialize_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    per_10k = 10000.0 / args.rows
+
+    serializers = (("pretty x2", pretty_twice),
+                   ("data", lambda soap_request: soap_request.data),
+                   ("chunks", lambda soap_request: sum(len(chunk) for chunk in soap_request.chunks())))
+    for case, kind, make_row in CASES:
+        rows = [make_row(i) for i in range(args.rows)]
+        for writer in ("tree", "bytes"):
+            for label, serialize in serializers:
+                if writer == "bytes" and label == "pretty x2":
+                    continue
+                build_time, serialize_time = timed(args.repeat, rows, kind, writer, serialize)
+                print("%-8s %-6s %-10s per 10k rows: build %6.3fs  serialize %6.3fs  total %6.3fs"
+                      % (case, writer, label, build_time * per_10k, serialize_time * per_10k,
+                         (build_time + serialize_time) * per_10k))
+
+
+if __name__ == "__main__":
+    main()
@@ -37,4 +37,5 @@ setup(
     keywords=['SharePoint'],
     packages=['shareplum'],
     install_requires=['lxml', 'requests', 'requests-ntlm', 'requests-toolbelt'],
+    extras_require={'async': ['aiohttp'], 'pandas': ['pandas'], 'arrow': ['pyarrow'], 'brotli': ['brotli']},
 )
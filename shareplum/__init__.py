@@ -2,7 +2,11 @@
 # This library simplfies the code necessary
 # to automate interactions with a SharePoint
 # server using python
+from .aio import AsyncSite  # noqa: F401
+from .mirror import ListMirror  # noqa: F401
 from .office365 import Office365  # noqa: F401
+from .rate_limit import RateLimiter  # noqa: F401
+from .schema_cache import SchemaCache  # noqa: F401
 from .site import Site  # noqa: F401
 from .version import __version__  # noqa: F401
 
@@ -0,0 +1,631 @@
+import asyncio
+import json
+import time
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import cast
+
+from lxml import etree
+
+from .errors import ShareplumRequestError
+from .list import _List2007, _List365, BATCH_SIZE, MAX_BATCH_BYTES, RS_DATA, Z_ROW
+from .request_helper import DIGEST_EXPIRY_MARGIN
+from .site import _Site2007, SERVICES_URL, Version
+from .soap import Soap
+from .soap import soap_headers
+from .version import __version__
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # type: ignore
+
+# import defusedxml.ElementTree as etree
+
+# Size of the chunks fed to the incremental parser
+CHUNK_SIZE = 64 * 1024
+
+
+async def _request(session, method, url, **kwargs):
+    try:
+        response = await session.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+    except aiohttp.ClientError as err:
+        raise ShareplumRequestError("Shareplum HTTP %s Failed" % method.title(), err)
+
+
+def _digest_rejected(text):
+    # type: (str) -> bool
+    # -2130575251: The security validation for this page is invalid
+    return "-2130575251" in text or "security validation" in text.lower()
+
+
+class _AsyncSite2007:
+    """asyncio version of Site built on aiohttp, created with AsyncSite()"""
+
+    def __init__(self,
+                 site_url,  # type: str
+                 auth=None,  # type: Optional[Any]
+                 authcookie=None,  # type: Optional[Any]
+                 verify_ssl=True,  # type: bool
+                 huge_tree=False,  # type: bool
+                 timeout=None,  # type: Optional[int]
+                 connection_limit=100,  # type: int
+                 ):
+        # type: (...) -> None
+        if aiohttp is None:
+            raise ImportError("AsyncSite requires aiohttp: pip install shareplum[async]")
+        self.site_url = site_url
+        self._auth = auth
+        self._cookies = {cookie.name: cookie.value for cookie in authcookie} if authcookie is not None else None
+        self._verify_ssl = verify_ssl
+        self._connection_limit = connection_limit
+        self.huge_tree = huge_tree
+        self.timeout = timeout
+        self._services_url = dict(SERVICES_URL)  # type: Dict[str, str]
+        self._client = None  # type: Optional[aiohttp.ClientSession]
+        self._client_headers = {"user-agent": "shareplum/%s" % __version__}  # type: Dict[str, str]
+        self._last_request = None  # type: Optional[Soap]
+        self.site_info = None  # type: Optional[str]
+        self.users = None  # type: Optional[Dict[str, Dict[str, str]]]
+        self.version = "2007"
+
+    @property
+    def last_request(self):
+        # type: () -> Optional[str]
+        """The last SOAP request sent, pretty printed on access"""
+        return None if self._last_request is None else str(self._last_request)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        # type: () -> None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    @property
+    def _session(self):
+        # type: () -> aiohttp.ClientSession
+        # aiohttp sessions have to be created inside the running event loop
+        if self._client is None:
+            self._client = aiohttp.ClientSession(
+                auth=self._auth,
+                cookies=self._cookies,
+                headers=self._client_headers,
+                # Like requests, timeout limits connecting and each read, not the whole download
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self._connection_limit, ssl=self._verify_ssl),
+            )
+        return self._client
+
+    def _url(self, service):
+        # type: (str) -> str
+        """Full SharePoint Service URL"""
+        return "".join([self.site_url, self._services_url[service]])
+
+    def _headers(self, soap_action):
+        # type: (str) -> Dict[str, str]
+        return soap_headers(soap_action)
+
+    async def _post(self, url, **kwargs):
+        return await _request(self._session, "POST", url, **kwargs)
+
+    async def _get(self, url, **kwargs):
+        return await _request(self._session, "GET", url, **kwargs)
+
+    async def _soap(self, service, soap_action, soap_request):
+        # type: (str, str, Soap) -> etree.ElementTree
+        """Send soap_request and parse the whole response"""
+        self._last_request = soap_request
+        response = await self._post(self._url(service),
+                                    headers=self._headers(soap_action),
+                                    data=soap_request.data)
+        async with response:
+            content = await response.read()
+        return etree.fromstring(content, parser=etree.XMLParser(huge_tree=self.huge_tree, recover=True))
+
+    async def get_site(self):
+        # type: () -> Optional[str]
+        soap_request = Soap("GetSite")
+        soap_request.add_parameter("SiteUrl", self.site_url)
+        envelope = await self._soap("Sites", "GetSite", soap_request)
+
+        # TODO: Not sure what to do with this, so just return the text
+        self.site_info = envelope[0][0][0].text
+        return self.site_info
+
+    async def get_users(self, rowlimit=0):
+        # type: (int) -> Dict[str, Dict[str, str]]
+        """Get the UserInfo list, lists opened afterwards use it to resolve User columns"""
+        soap_request = Soap("GetListItems")
+        soap_request.add_parameter("listName", "UserInfo")
+        soap_request.add_parameter("rowLimit", str(rowlimit))
+        envelope = await self._soap("Lists", "GetListItems", soap_request)
+        self.users = _Site2007.parse_users_envelope(envelope)
+        return self.users
+
+    async def list(self, list_name, exclude_hidden_fields=False):
+        # type: (str, bool) -> AsyncList
+        """Open a list, its schema and views are fetched concurrently"""
+        sp_list = AsyncList(self, list_name, exclude_hidden_fields=exclude_hidden_fields)
+        await sp_list.load()
+        return sp_list
+
+    # Legacy API
+    List = list
+    GetUsers = get_users
+
+
+class _AsyncSite365(_AsyncSite2007):
+    """asyncio version of the 2013 and later Site, adds the REST API (folders)"""
+
+    def __init__(self, *args, **kwargs):
+        # type: (Any, Any) -> None
+        super().__init__(*args, **kwargs)
+        self._client_headers.update({"Accept": "application/json",
+                                     "Content-Type": "application/json;odata=nometadata"})
+        self._digest = None  # type: Optional[str]
+        self._digest_expires = 0.0
+        self._digest_lock = None  # type: Optional[asyncio.Lock]
+        self.version = "v365"
+
+    async def contextinfo(self):
+        # type: () -> Dict[str, Any]
+        response = await self._post(self.site_url + "/_api/contextinfo", headers={"Accept": "application/json"})
+        async with response:
+            return await response.json(content_type=None)
+
+    async def form_digest(self):
+        # type: () -> str
+        """The form digest, contextinfo is only requested when there is none yet or it is about to expire"""
+        if self._digest_lock is None:
+            self._digest_lock = asyncio.Lock()
+        async with self._digest_lock:
+            if self._digest is None or time.monotonic() >= self._digest_expires:
+                data = await self.contextinfo()
+                # odata=verbose wraps the result
+                info = data.get("d", {}).get("GetContextWebInformation", data)
+                lifetime = int(info.get("FormDigestTimeoutSeconds", 1800))
+                self._digest = info["FormDigestValue"]
+                self._digest_expires = time.monotonic() + max(lifetime - DIGEST_EXPIRY_MARGIN, lifetime / 2)
+            return self._digest
+
+    async def _post_with_digest(self, url, headers=None, **kwargs):
+        """POST with an X-RequestDigest header
+           If SharePoint rejects the digest it is refreshed and the
+           request is sent once more, unless its body was a stream.
+        """
+        headers = dict(headers or {})
+        headers["X-RequestDigest"] = await self.form_digest()
+        try:
+            response = await self._session.post(url, headers=headers, **kwargs)
+        except aiohttp.ClientError as err:
+            raise ShareplumRequestError("Shareplum HTTP Post Failed", err)
+        data = kwargs.get("data")
+        if response.status == 403 and (data is None or isinstance(data, (bytes, str))):
+            if _digest_rejected(await response.text()):
+                response.release()
+                self._digest = None
+                headers["X-RequestDigest"] = await self.form_digest()
+                return await self._post(url, headers=headers, **kwargs)
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientError as err:
+            raise ShareplumRequestError("Shareplum HTTP Post Failed", err)
+        return response
+
+    async def list(self, list_name, exclude_hidden_fields=False):
+        # type: (str, bool) -> AsyncList365
+        """Open a list, its schema, views and RenderListDataAsStream schema are fetched concurrently"""
+        sp_list = AsyncList365(self, list_name, exclude_hidden_fields=exclude_hidden_fields)
+        await sp_list.load()
+        return sp_list
+
+    async def folder(self, folder_name):
+        # type: (str) -> AsyncFolder
+        """Open (and create if needed) a folder, REST API only"""
+        folder = AsyncFolder(self, folder_name)
+        await folder.load()
+        return folder
+
+    # Legacy API
+    List = list
+    Folder = folder
+
+
+def AsyncSite(site_url,  # type: str
+              version=Version.v2007,
+              auth=None,  # type: Optional[Any]
+              authcookie=None,  # type: Optional[Any]
+              verify_ssl=True,  # type: bool
+              huge_tree=False,  # type: bool
+              timeout=None,  # type: Optional[int]
+              connection_limit=100,  # type: int
+              ):
+    """asyncio version of Site built on aiohttp
+       Uses the same Soap builder and response parsers as Site,
+       so a single event loop can drive many list reads and uploads.
+
+           async with AsyncSite(url, version=Version.v365, authcookie=authcookie) as site:
+               sp_list = await site.list("My List")
+               rows = await sp_list.get_list_items()
+
+       Folders need version 2013 or later, like Site.
+       Only cookie (Office365) and basic auth are supported, aiohttp can't do NTLM.
+    """
+    if version in (Version.v2007, Version.v2010):
+        site_class = _AsyncSite2007
+    elif version in (Version.v2013, Version.v2016, Version.v2019, Version.v365):
+        site_class = _AsyncSite365
+    else:
+        return None
+
+    return site_class(site_url,
+                      auth,
+                      authcookie,
+                      verify_ssl,
+                      huge_tree,
+                      timeout,
+                      connection_limit=connection_limit)
+
+
+class AsyncList:
+    """asyncio version of the Lists Web Service
+       Created with AsyncSite.list(), which loads the schema. Only the
+       coroutines below are available, the requests are built and the
+       rows parsed by a List that never sends anything itself.
+    """
+
+    _list_class = _List2007  # type: Type[_List2007]
+
+    def __init__(self, site, list_name, exclude_hidden_fields=False):
+        # type: (_AsyncSite2007, str, bool) -> None
+        self._site = site
+        # The List builds the requests and parses the responses, it has no session
+        self._list = self._list_class(None,  # type: ignore[arg-type]
+                                      list_name,
+                                      site._url,
+                                      site._verify_ssl,
+                                      lambda: site.users,
+                                      site.huge_tree,
+                                      site.timeout,
+                                      exclude_hidden_fields=exclude_hidden_fields,
+                                      site_url=site.site_url)
+        self.list_name = list_name
+        self.site_url = site.site_url
+
+    @property
+    def version(self):
+        # type: () -> str
+        return self._list.version
+
+    @property
+    def last_request(self):
+        # type: () -> Optional[str]
+        """The last SOAP request sent, pretty printed on access"""
+        return self._list.last_request
+
+    @property
+    def fields(self):
+        # type: () -> Optional[List[Dict[str, str]]]
+        return self._list._fields
+
+    @property
+    def regional_settings(self):
+        # type: () -> Optional[Dict[str, str]]
+        return self._list._regional_settings
+
+    @property
+    def server_settings(self):
+        # type: () -> Optional[Dict[str, str]]
+        return self._list._server_settings
+
+    @property
+    def views(self):
+        # type: () -> Optional[Dict[str, Dict[str, str]]]
+        return self._list._views
+
+    @property
+    def users(self):
+        # type: () -> Optional[Dict]
+        return self._list.users
+
+    async def _soap(self, service, soap_action, soap_request):
+        # type: (str, str, Soap) -> etree.ElementTree
+        self._list._last_request = soap_request
+        return await self._site._soap(service, soap_action, soap_request)
+
+    async def load(self):
+        # type: () -> None
+        """GetList and GetViewCollection in one round-trip"""
+        await asyncio.gather(self.get_list(), self.get_view_collection())
+
+    async def get_list(self):
+        # type: () -> None
+        soap_request = Soap("GetList")
+        soap_request.add_parameter("listName", self.list_name)
+        envelope = await self._soap("Lists", "GetList", soap_request)
+        (fields, regional_settings, server_settings) = self._list.parse_list_envelope(envelope)
+        self._list._set_list_info(fields, regional_settings, server_settings)
+
+    async def get_view_collection(self):
+        # type: () -> Dict[str, Dict[str, str]]
+        soap_request = Soap("GetViewCollection")
+        soap_request.add_parameter("listName", self.list_name)
+        envelope = await self._soap("Views", "GetViewCollection", soap_request)
+        self._list.views = self._list.parse_view_collection_envelope(envelope)
+        return self._list.views
+
+    async def get_view(self, view_name):
+        # type: (str) -> Dict[str, Any]
+        if not view_name:
+            for name, view in self._list.views.items():
+                if view.get("DefaultView") == "TRUE":
+                    view_name = name
+                    break
+        envelope = await self._soap("Views", "GetView", self._list._view_request(view_name))
+        return self._list.parse_view_envelope(envelope)
+
+    async def get_list_items(self, view_name=None, fields=None, query=None, row_limit=0):
+        # type: (Optional[str], Optional[List[str]], Optional[Dict], int) -> List[Dict[str, Any]]
+        """Get Items from current list
+           row_limit defaulted to 0 (unlimited)
+        """
+        return [row async for row in self._iter_pages(view_name, fields, query, row_limit, paged=False)]
+
+    def iter_list_items(self, view_name=None, fields=None, query=None, page_size=1000):
+        # type: (Optional[str], Optional[List[str]], Optional[Dict], int) -> AsyncIterator[Dict[str, Any]]
+        """Async iterator over Items from current list, page_size rows per request
+           Run several with asyncio.gather to read a list in parallel.
+
+               async for row in sp_list.iter_list_items():
+                   ...
+        """
+        return self._iter_pages(view_name, fields, query, page_size, paged=True)
+
+    async def _iter_pages(self, view_name, fields, query, row_limit, paged):
+        view_fields = None
+        if view_name and not fields:
+            if view_name not in self._list._view_fields:
+                self._list._view_fields[view_name] = (await self.get_view(view_name))["fields"]
+            view_fields = self._list._view_fields[view_name]
+
+        position = None  # type: Optional[str]
+        while True:
+            soap_request, viewfields = self._list._list_items_request(view_name, fields, query, row_limit, position,
+                                                                      view_fields=view_fields)
+            self._list._last_request = soap_request
+
+            # Parse the response as it downloads
+            parser = etree.XMLPullParser(events=("start", "end"),
+                                         tag=(RS_DATA, Z_ROW),
+                                         huge_tree=self._site.huge_tree,
+                                         recover=True)
+            position = None
+            response = await self._site._post(self._site._url("Lists"),
+                                              headers=self._list._headers("GetListItems"),
+                                              data=soap_request.data)
+            async with response:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    parser.feed(chunk)
+                    rows = self._list._rows_from_events(parser.read_events(), viewfields)
+                    while True:
+                        try:
+                            row = next(rows)
+                        except StopIteration as stop:
+                            position = stop.value or position
+                            break
+                        yield row
+            parser.close()
+
+            if not paged or not position:
+                break
+
+    async def update_list_items(self, data, kind, mutate_data=False, batch_size=BATCH_SIZE,
+                                max_batch_bytes=MAX_BATCH_BYTES):
+        # type: (List[Any], str, bool, Optional[int], Optional[int]) -> Dict[str, Any]
+        """Update List Items
+           kind = 'New', 'Update', or 'Delete', see List.update_list_items
+           The batches are sent concurrently.
+        """
+        if type(data) != list:
+            raise Exception("data must be a list of dictionaries")
+        return await self.apply_list_items([(kind, row) for row in data], mutate_data, batch_size,
+                                           max_batch_bytes)
+
+    async def apply_list_items(self, operations, mutate_data=False, batch_size=BATCH_SIZE,
+                               max_batch_bytes=MAX_BATCH_BYTES):
+        # type: (List[Tuple[str, Any]], bool, Optional[int], Optional[int]) -> Dict[str, Any]
+        """New, Update and Delete rows in one Batch, see List.apply_list_items"""
+        batches = self._list._update_requests(operations, mutate_data, batch_size, max_batch_bytes)
+        envelopes = await asyncio.gather(*[self._soap("Lists", "UpdateListItems", soap_request)
+                                           for soap_request in batches])
+        results = {}  # type: Dict[str, Any]
+        for envelope in envelopes:
+            results.update(self._list.parse_update_envelope(envelope))
+        return results
+
+    async def get_attachment_collection(self, _id):
+        # type: (str) -> List[str]
+        """Get Attachments for given List Item ID"""
+        soap_request = Soap("GetAttachmentCollection")
+        soap_request.add_parameter("listName", self.list_name)
+        soap_request.add_parameter("listItemID", _id)
+        envelope = await self._soap("Lists", "GetAttachmentCollection", soap_request)
+        return [attachment.text for attachment in envelope[0][0][0][0]]
+
+    # Legacy API
+    GetList = get_list
+    GetListItems = get_list_items
+    GetView = get_view
+    GetViewCollection = get_view_collection
+    GetAttachmentCollection = get_attachment_collection
+    UpdateListItems = update_list_items
+
+
+class AsyncList365(AsyncList):
+    """asyncio version of the 2013 and later List, created with AsyncSite.list()"""
+
+    _list_class = _List365
+
+    @property
+    def schema(self):
+        # type: () -> Optional[Dict[str, Any]]
+        return cast(_List365, self._list)._schema
+
+    async def load(self):
+        # type: () -> None
+        """GetList, GetViewCollection and RenderListDataAsStream in one round-trip"""
+        await asyncio.gather(self.get_list(), self.get_view_collection(), self.get_schema())
+
+    async def _rest(self, url, update_data):
+        # type: (str, Dict[str, Any]) -> Dict[str, Any]
+        headers = {'Accept': 'application/json;odata=verbose',
+                   'Content-Type': 'application/json;odata=verbose'}
+        site = cast(_AsyncSite365, self._site)
+        response = await site._post_with_digest(url, headers=headers, data=json.dumps(update_data))
+        async with response:
+            return await response.json(content_type=None)
+
+    async def get_schema(self):
+        # type: () -> Dict[str, Any]
+        url = self.site_url + f"/_api/lists/getbytitle('{self.list_name}')/RenderListDataAsStream"
+        schema = await self._rest(url, {"parameters": {"RenderOptions": 4}})
+        cast(_List365, self._list)._schema = schema
+        return schema
+
+    async def create_field(self, title, field_type=2, required="false", unique="false", static_name=None):
+        update_data = {}
+        update_data['__metadata'] = {'type': 'SP.Field'}
+        update_data['Title'] = title
+        update_data['FieldTypeKind'] = field_type
+        update_data['Required'] = required
+        update_data['EnforceUniqueValues'] = unique
+        update_data['StaticName'] = static_name
+
+        url = self.site_url + f"/_api/lists/getbytitle('{self.list_name}')/Fields"
+        return await self._rest(url, update_data)
+
+
+class AsyncFolder:
+    """asyncio version of Folder, created with AsyncSite.folder()
+       Writes share the site's cached form digest.
+    """
+
+    def __init__(self, site, folder_name):
+        # type: (_AsyncSite365, str) -> None
+        self._site = site
+        self.folder_name = folder_name
+        self._escaped_folder_name = self._escape_name(self.folder_name)
+        self.site_url = site.site_url
+        self.timeout = site.timeout
+        self.info = None  # type: Optional[Dict[str, Any]]
+        self._escaped_relative_url = None  # type: Optional[str]
+
+    async def load(self):
+        # type: () -> None
+        self.info = await self._create_folder()
+        self._escaped_relative_url = self._escape_name(self.info['d']['ServerRelativeUrl'])
+
+    def _escape_name(self, name):
+        return name.replace("'", "''")
+
+    async def _json(self, method, url, **kwargs):
+        response = await _request(self._site._session, method, url, **kwargs)
+        async with response:
+            return await response.json(content_type=None)
+
+    async def _create_folder(self):
+        update_data = {}
+        update_data['__metadata'] = {'type': 'SP.Folder'}
+        update_data['ServerRelativeUrl'] = self.folder_name
+        body = json.dumps(update_data)
+
+        url = self.site_url + "/_api/web/folders"
+
+        headers = {'Accept': 'application/json;odata=verbose',
+                   'Content-Type': 'application/json;odata=verbose'}
+
+        response = await self._site._post_with_digest(url, headers=headers, data=body)
+        async with response:
+            return await response.json(content_type=None)
+
+    async def contextinfo(self):
+        return await self._site.contextinfo()
+
+    async def items(self):
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')/ListItemAllFields"
+        return await self._json("GET", url, headers={'Accept': 'application/json'})
+
+    async def files(self):
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')/files"
+        return (await self._json("GET", url, headers={'Accept': 'application/json'}))['value']
+
+    async def folders(self):
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')/folders"
+        return [entry['Name'] for entry in (await self._json("GET", url, headers={'Accept': 'application/json'}))['value']]
+
+    async def upload_file(self, content, file_name):
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')/Files/add(url='{escaped_file_name}',overwrite=true)"
+
+        response = await self._site._post_with_digest(url, data=content)
+        response.release()
+
+    async def get_file(self, file_name):
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/$value"
+        response = await self._site._get(url)
+        async with response:
+            return await response.read()
+
+    async def delete_file(self, file_name):
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')"
+
+        headers = {'Accept': 'application/json;odata=verbose',
+                   'If-Match': '*',
+                   'X-HTTP-Method': 'DELETE',
+                   'Content-Type': 'application/json;odata=verbose'}
+
+        response = await self._site._post_with_digest(url, headers=headers)
+        response.release()
+
+    async def delete_folder(self, relative_url):
+        if relative_url == self.folder_name:
+            url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')"
+
+            headers = {'Accept': 'application/json;odata=verbose',
+                       'If-Match': '*',
+                       'X-HTTP-Method': 'DELETE',
+                       'Content-Type': 'application/json;odata=verbose'}
+
+            response = await self._site._post_with_digest(url, headers=headers)
+            response.release()
+        else:
+            raise ValueError('You must pass the relative folder url to delete a folder')
+
+    async def check_out(self, file_name):
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/CheckOut()"
+
+        response = await self._site._post_with_digest(url)
+        response.release()
+
+    async def check_in(self, file_name, comment):
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/CheckIn(comment='{comment}',checkintype=0)"
+
+        response = await self._site._post_with_digest(url)
+        response.release()
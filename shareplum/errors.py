@@ -1,5 +1,6 @@
 class ShareplumError(Exception):
     def __init__(self, msg, details=None):
+        self.details = details
         if details:
             super().__init__(f"{msg} : {details}")
         else:
@@ -8,3 +9,14 @@ class ShareplumError(Exception):
 
 class ShareplumRequestError(ShareplumError):
     pass
+
+
+class ShareplumUploadError(ShareplumRequestError):
+    """A chunked upload failed, pass upload_id and offset
+       back to upload_file_chunked to resume it.
+    """
+
+    def __init__(self, msg, details=None, upload_id=None, offset=0):
+        super().__init__(msg, details)
+        self.upload_id = upload_id
+        self.offset = offset
@@ -1,5 +1,19 @@
-from .request_helper import get, post
+from .errors import ShareplumRequestError, ShareplumUploadError
+from .request_helper import get, post, post_with_digest, record_transfer
 import json
+import mmap
+import os
+import re
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+# Default chunk size of upload_file_chunked, 10 MiB
+CHUNK_SIZE = 10 * 1024 * 1024
+
+# Seconds before sending a failed chunk again, doubled on every attempt
+CHUNK_RETRY_BACKOFF = 1.0
 
 
 class _Folder():
@@ -22,19 +36,19 @@ class _Folder():
     def _escape_name(self, name):
         return name.replace("'", "''")
 
-    def _create_folder(self):
+    def _create_folder(self, folder_name=None):
         update_data = {}
         update_data['__metadata'] = {'type': 'SP.Folder'}
-        update_data['ServerRelativeUrl'] = self.folder_name
+        update_data['ServerRelativeUrl'] = folder_name or self.folder_name
         body = json.dumps(update_data)
 
         url = self.site_url + f"/_api/web/folders"
 
         headers = {'Accept': 'application/json;odata=verbose',
-                   'Content-Type': 'application/json;odata=verbose',
-                   'X-RequestDigest': self.contextinfo['FormDigestValue']}
+                   'Content-Type': 'application/json;odata=verbose'}
 
-        response = post(self._session, url=url, headers=headers, data=body, timeout=self.timeout)
+        response = post_with_digest(self._session, self.site_url, url=url, headers=headers, data=body,
+                                    timeout=self.timeout)
 
         return response.json()
 
@@ -45,10 +59,9 @@ class _Folder():
             headers = {'Accept': 'application/json;odata=verbose',
                        'If-Match': '*',
                        'X-HTTP-Method': 'DELETE',
-                       'Content-Type': 'application/json;odata=verbose',
-                       'X-RequestDigest': self.contextinfo['FormDigestValue']}
+                       'Content-Type': 'application/json;odata=verbose'}
 
-            post(self._session, url=url, headers=headers)
+            post_with_digest(self._session, self.site_url, url=url, headers=headers)
         else:
             print('You must pass the relative folder url to delete a folder')
 
@@ -59,10 +72,9 @@ class _Folder():
         headers = {'Accept': 'application/json;odata=verbose',
                    'If-Match': '*',
                    'X-HTTP-Method': 'DELETE',
-                   'Content-Type': 'application/json;odata=verbose',
-                   'X-RequestDigest': self.contextinfo['FormDigestValue']}
+                   'Content-Type': 'application/json;odata=verbose'}
 
-        post(self._session, url=url, headers=headers)
+        post_with_digest(self._session, self.site_url, url=url, headers=headers)
 
     @property
     def items(self):
@@ -80,30 +92,342 @@ class _Folder():
         return [entry['Name'] for entry in response.json()['value']]
 
     def upload_file(self, content, file_name):
+        # file_name can include a subfolder, 'sub/file.txt'
+        sub_folder, _, file_name = file_name.rpartition('/')
+        escaped_folder_name = self._escaped_folder_name + ('/' + self._escape_name(sub_folder) if sub_folder else '')
+        escaped_file_name = self._escape_name(file_name)
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{escaped_folder_name}')/Files/add(url='{escaped_file_name}',overwrite=true)"
+        post_with_digest(self._session, self.site_url, url=url, data=content, timeout=self.timeout)
+
+    def upload_file_chunked(self, content, file_name, chunk_size=CHUNK_SIZE, progress=None,
+                            upload_id=None, offset=0, retries=3):
+        """Upload a large file in chunks with StartUpload/ContinueUpload/FinishUpload
+
+           content is a path or a binary file-like object. Paths are memory-mapped
+           so only one chunk is held in memory. A failed chunk is resent from the
+           last offset SharePoint acknowledged, up to retries times with a
+           doubling wait, client errors other than 429 aren't retried. When that
+           isn't enough ShareplumUploadError is raised, pass its upload_id and
+           offset back in to resume. progress(offset, total) is called after
+           every chunk, total is None when the size is unknown.
+        """
+        if isinstance(content, (str, bytes, os.PathLike)):
+            with open(content, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return self.upload_file(b'', file_name)
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self._upload_chunks(data, file_name, chunk_size, progress, upload_id, offset, retries)
+        return self._upload_chunks(content, file_name, chunk_size, progress, upload_id, offset, retries)
+
+    def _upload_chunks(self, data, file_name, chunk_size, progress, upload_id, offset, retries):
+        total = _stream_size(data)
+        chunk = _read_chunk(data, offset, chunk_size)
+        # Read ahead from streams of unknown size, so the last chunk is known
+        next_chunk = None
+        if upload_id is None:
+            if offset:
+                raise ValueError('offset needs the upload_id of the upload to resume')
+            if total is None:
+                next_chunk = _read_chunk(data, len(chunk), chunk_size)
+                small = not next_chunk
+            else:
+                small = total <= chunk_size
+            if small:
+                # Small enough for a single request
+                self.upload_file(chunk, file_name)
+                if progress:
+                    progress(len(chunk), total)
+                return
+            upload_id = str(uuid.uuid4())
+            # StartUpload needs an existing file to write to
+            self.upload_file(b'', file_name)
+
         escaped_file_name = self._escape_name(file_name)
-        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{self._escaped_folder_name}')/Files/add(url='{escaped_file_name}',overwrite=true)"
-        headers = {'X-RequestDigest': self.contextinfo['FormDigestValue']}
+        file_url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')"
+
+        while True:
+            if total is None:
+                # Unknown size, peek ahead so the last chunk goes to FinishUpload
+                if next_chunk is None:
+                    next_chunk = _read_chunk(data, offset + len(chunk), chunk_size)
+                last = not next_chunk
+            else:
+                last = offset + len(chunk) >= total
+
+            if offset == 0:
+                # Every upload starts with StartUpload, even if that is its last chunk
+                action, method = 'StartUpload', f"StartUpload(uploadId=guid'{upload_id}')"
+            elif last:
+                action, method = 'FinishUpload', f"FinishUpload(uploadId=guid'{upload_id}',fileOffset={offset})"
+            else:
+                action, method = 'ContinueUpload', f"ContinueUpload(uploadId=guid'{upload_id}',fileOffset={offset})"
+
+            response = self._post_chunk(f"{file_url}/{method}", chunk, retries, upload_id, offset)
+            if action == 'FinishUpload':
+                if progress:
+                    progress(offset + len(chunk), total)
+                return response.json()
+
+            offset = int(response.json()['d'][action])
+            if progress:
+                progress(offset, total)
+            if last:
+                # Started with the only chunk, finish with nothing left to send
+                chunk = b''
+            elif next_chunk is not None:
+                chunk, next_chunk = next_chunk, None
+            else:
+                chunk = _read_chunk(data, offset, chunk_size)
+
+    def _post_chunk(self, url, chunk, retries, upload_id, offset):
+        headers = {'Accept': 'application/json;odata=verbose'}
+        for attempt in range(retries + 1):
+            try:
+                return post_with_digest(self._session, self.site_url, url=url, headers=headers, data=chunk,
+                                        timeout=self.timeout)
+            except ShareplumRequestError as err:
+                status = getattr(getattr(err.details, 'response', None), 'status_code', None)
+                # Client errors won't go away by sending the chunk again, throttling will
+                if attempt == retries or (status is not None and 400 <= status < 500 and status != 429):
+                    raise ShareplumUploadError('Shareplum chunked upload failed', err.details,
+                                               upload_id=upload_id, offset=offset)
+                time.sleep(CHUNK_RETRY_BACKOFF * 2 ** attempt)
+
+    def sync_up(self, local_dir, max_workers=8, chunk_size=CHUNK_SIZE):
+        """Upload the files under local_dir that are missing here or differ
+           in size, or were modified locally after TimeLastModified.
+           Returns the relative paths that were uploaded.
+        """
+        remote_files, remote_folders = self.walk(max_workers)
+        local_files, local_folders = _walk_local(local_dir)
+
+        for folder in sorted(local_folders - remote_folders):
+            # Sorted, so parents are created before their children
+            self._create_folder(f"{self.folder_name}/{folder}")
+
+        changed = sorted(path for path, (size, mtime) in local_files.items()
+                         if path not in remote_files
+                         or remote_files[path][0] != size
+                         or remote_files[path][1] < mtime)
+
+        def upload(path):
+            self.upload_file_chunked(os.path.join(local_dir, *path.split('/')), path, chunk_size)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(upload, changed))
+        return changed
+
+    def sync_down(self, local_dir, max_workers=8, chunk_size=CHUNK_SIZE):
+        """Download the files under this folder that are missing in local_dir
+           or differ in size, or were modified after the local copy.
+           Returns the relative paths that were downloaded.
+        """
+        remote_files, remote_folders = self.walk(max_workers)
+        local_files, _ = _walk_local(local_dir)
+
+        for folder in remote_folders:
+            os.makedirs(os.path.join(local_dir, *folder.split('/')), exist_ok=True)
+
+        changed = sorted(path for path, (size, mtime) in remote_files.items()
+                         if path not in local_files
+                         or local_files[path][0] != size
+                         or local_files[path][1] < mtime)
+
+        def download(path):
+            local_path = os.path.join(local_dir, *path.split('/'))
+            self.download_file(path, local_path, chunk_size)
+            # Keep the server time so the next sync sees the file as unchanged
+            mtime = remote_files[path][1]
+            os.utime(local_path, (mtime, mtime))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(download, changed))
+        return changed
+
+    def walk(self, max_workers=8):
+        """All files and subfolders under this folder
 
-        post(self._session, url=url, headers=headers, data=content, timeout=self.timeout)
+           Returns ({relative path: (size, modified timestamp)}, {relative folder paths}).
+           Folders are listed concurrently.
+        """
+        files = {}
+        folders = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(self._list_folder, ''): ''}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    prefix = pending.pop(future)
+                    level_files, level_folders = future.result()
+                    for entry in level_files:
+                        files[prefix + entry['Name']] = (int(entry['Length']), _timestamp(entry['TimeLastModified']))
+                    for name in level_folders:
+                        # Every library has a hidden Forms folder at its root
+                        if prefix == '' and name == 'Forms':
+                            continue
+                        folders.add(prefix + name)
+                        pending[executor.submit(self._list_folder, prefix + name)] = prefix + name + '/'
+        return files, folders
+
+    def _list_folder(self, sub_folder):
+        escaped_folder_name = self._escaped_folder_name + ('/' + self._escape_name(sub_folder) if sub_folder else '')
+        url = self.site_url + f"/_api/web/GetFolderByServerRelativeUrl('{escaped_folder_name}')"
+        files = get(self._session, url + "/files", timeout=self.timeout).json()['value']
+        folders = get(self._session, url + "/folders", timeout=self.timeout).json()['value']
+        return files, [entry['Name'] for entry in folders]
 
     def check_out(self, file_name):
         escaped_file_name = self._escape_name(file_name)
         url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/CheckOut()"
-        headers = {'X-RequestDigest': self.contextinfo['FormDigestValue']}
-
-        post(self._session, url=url, headers=headers)
+        post_with_digest(self._session, self.site_url, url=url)
 
     def check_in(self, file_name, comment):
         escaped_file_name = self._escape_name(file_name)
         url = self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/CheckIn(comment='{comment}',checkintype=0)"
-        headers = {'X-RequestDigest': self.contextinfo['FormDigestValue']}
-        post(self._session, url=url, headers=headers)
+        post_with_digest(self._session, self.site_url, url=url)
 
     def get_file(self, file_name):
         escaped_file_name = self._escape_name(file_name)
         response = get(self._session, self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')/$value")
         return response.content
     
+    def download_file(self, file_name, destination, chunk_size=CHUNK_SIZE, resume=False, max_workers=1,
+                      progress=None):
+        """Stream a file to a path or a binary file-like object
+
+           Only chunk_size bytes are held in memory at a time. With resume a
+           partial file at destination is continued with a Range request.
+           With max_workers > 1 the file is split into byte ranges that are
+           fetched in parallel, destination must be a path then.
+           progress(done, total) is called after every chunk.
+        """
+        url = self._file_url(file_name) + "/$value"
+        if max_workers > 1:
+            if not isinstance(destination, (str, bytes, os.PathLike)):
+                raise ValueError('Parallel downloads need a path to write to')
+            return self._download_ranges(url, file_name, destination, chunk_size, max_workers, progress)
+
+        if not isinstance(destination, (str, bytes, os.PathLike)):
+            return self._download_range(url, destination, 0, None, chunk_size, progress)
+
+        start = os.path.getsize(destination) if resume and os.path.exists(destination) else 0
+        with open(destination, 'r+b' if start else 'wb') as f:
+            f.seek(start)
+            self._download_range(url, f, start, None, chunk_size, progress)
+
+    def _file_url(self, file_name):
+        escaped_file_name = self._escape_name(file_name)
+        return self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self._escaped_relative_url}/{escaped_file_name}')"
+
+    def _download_range(self, url, f, start, end, chunk_size, progress, total=None):
+        # Write bytes start..end (inclusive, None for the rest of the file) to f at its current position
+        headers = {}
+        if start or end is not None:
+            headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = get(self._session, url, headers=headers, stream=True, timeout=self.timeout)
+        except ShareplumRequestError as err:
+            status = getattr(getattr(err.details, 'response', None), 'status_code', None)
+            if status == 416 and end is None:
+                # Nothing left to resume
+                return start
+            raise
+        with response:
+            if headers and response.status_code != 206:
+                if start and end is None and f.seekable():
+                    # Range was ignored, start over
+                    f.seek(0)
+                    f.truncate()
+                    start = 0
+                else:
+                    raise ShareplumRequestError('Shareplum HTTP Range request not honoured')
+            if total is None:
+                total = _content_total(response, start)
+            done = start
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, total)
+            record_transfer(self._session, response, done - start)
+        return total
+
+    def _download_ranges(self, url, file_name, destination, chunk_size, max_workers, progress):
+        response = get(self._session, self._file_url(file_name) + "?$select=Length",
+                       headers={'Accept': 'application/json;odata=verbose'}, timeout=self.timeout)
+        total = int(response.json()['d']['Length'])
+        with open(destination, 'wb') as f:
+            f.truncate(total)
+        if total == 0:
+            return total
+
+        range_size = max(chunk_size, -(-total // max_workers))
+        ranges = [(start, min(start + range_size, total) - 1) for start in range(0, total, range_size)]
+
+        def fetch(start, end):
+            with open(destination, 'r+b') as f:
+                f.seek(start)
+                self._download_range(url, f, start, end, chunk_size, None, total)
+            return end - start + 1
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for size in executor.map(lambda r: fetch(*r), ranges):
+                done += size
+                if progress:
+                    progress(done, total)
+        return total
+
     def get_file_properties(self, file_name):
         file_properties= get(self._session, self.site_url + f"/_api/web/GetFileByServerRelativeUrl('{self.info['d']['ServerRelativeUrl']}/{file_name}')?/$expand=ListItemAllFields")
         return file_properties.json()
+
+
+def _stream_size(data):
+    if isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)):
+        return len(data)
+    try:
+        return os.fstat(data.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        pass
+    if data.seekable():
+        position = data.tell()
+        size = data.seek(0, os.SEEK_END)
+        data.seek(position)
+        return size
+    return None
+
+
+def _timestamp(value):
+    # TimeLastModified is UTC, '2021-03-04T05:06:07Z'
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+def _walk_local(local_dir):
+    files = {}
+    folders = set()
+    for root, dir_names, file_names in os.walk(local_dir):
+        prefix = os.path.relpath(root, local_dir).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else prefix + '/'
+        folders.update(prefix + name for name in dir_names)
+        for name in file_names:
+            stat = os.stat(os.path.join(root, name))
+            files[prefix + name] = (stat.st_size, stat.st_mtime)
+    return files, folders
+
+
+def _content_total(response, start):
+    # Content-Range: bytes 100-199/1000
+    match = re.search(r"/(\d+)$", response.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    length = response.headers.get('Content-Length')
+    return start + int(length) if length is not None else None
+
+
+def _read_chunk(data, offset, chunk_size):
+    if isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)):
+        return bytes(data[offset:offset + chunk_size])
+    if data.seekable():
+        data.seek(offset)
+    return data.read(chunk_size)
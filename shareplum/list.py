@@ -1,80 +1,382 @@
 import re
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
 from typing import Any
 from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
+from typing import Union
+from typing import cast
 
-from .request_helper import post
+from .request_helper import post, post_with_digest, StreamReader, transfer_stats, TransferStats
 import requests
 import json
 from lxml import etree
 
+from . import list_dict
+from .mirror import ListMirror
+from .schema_cache import SchemaCache
 from .soap import Soap
+from .soap import soap_headers
 
 # import defusedxml.ElementTree as etree
 
+# GetListItems response elements
+RS_DATA = "{urn:schemas-microsoft-com:rowset}data"
+Z_ROW = "{#RowsetSchema}row"
+# GetListItemChangesSinceToken response elements
+CHANGES = "{http://schemas.microsoft.com/sharepoint/soap/}Changes"
+CHANGE_ID = "{http://schemas.microsoft.com/sharepoint/soap/}Id"
+
+# Default limits of one UpdateListItems Batch
+BATCH_SIZE = 1000
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+
+# Boolean fields are '1' or '0'
+_BOOLEANS = {"1": "Yes", "0": "No"}
+
+
+def _identity(value):
+    # type: (Any) -> Any
+    return value
+
+
+def _parse_boolean(value):
+    # type: (str) -> str
+    return _BOOLEANS.get(value, "")
+
 
 class _List2007:
     """Sharepoint Lists Web Service
        Microsoft Developer Network:
        The Lists Web service provides methods for working
        with SharePoint lists, content types, list items, and files.
+
+       The list schema (fields, views, ...) is downloaded the first
+       time it is needed, call prefetch() to load it all at once.
     """
 
+    # List Info, loaded on first access
+    _fields = None  # type: Optional[List[Dict[str, str]]]
+    _regional_settings = None  # type: Optional[Dict[str, str]]
+    _server_settings = None  # type: Optional[Dict[str, str]]
+    _views = None  # type: Optional[Dict[str, Dict[str, str]]]
+    _sp_columns = None  # type: Optional[Dict[str, Dict[str, str]]]
+    _disp_columns = None  # type: Optional[Dict[str, Dict[str, str]]]
+    _converter_table = None  # type: Optional[Dict[str, Tuple[str, Callable[[str], Any]]]]
+    # The users, or a function that fetches them
+    _users = None  # type: Union[Optional[Dict], Callable[[], Optional[Dict]]]
+    _schema_cache = None  # type: Optional[SchemaCache]
+    _schema_cache_checked = False
+    # Where the last get_list_item_changes stopped
+    _change_token = None  # type: Optional[str]
+
     def __init__(
         self,
         session,  # type: requests.Session
         list_name,  # type: str
         url,  # type: Callable[[str], str]
         verify_ssl,  # type: bool
-        users,  # type: Optional[Dict]
+        users,  # type: Union[Optional[Dict], Callable[[], Optional[Dict]]]
         huge_tree,  # type: bool
         timeout,  # type: Optional[int]
         exclude_hidden_fields=False,  # type: bool
         site_url=None,
+        schema_cache=None,  # type: Optional[SchemaCache]
     ):
         # type: (...) -> None
         self._session = session
         self.list_name = list_name
         self._url = url
         self._verify_ssl = verify_ssl
+        # users can be a function so they are only fetched when needed
         self.users = users
         self.huge_tree = huge_tree
         self.timeout = timeout
         self._exclude_hidden_fields = exclude_hidden_fields
-        # List Info
-        self.fields = []  # type: List[Dict[str, str]]
-        self.regional_settings = {}  # type: Dict[str, str]
-        self.server_settings = {}  # type: Dict[str, str]
-        self.get_list()
-        self.views = self.get_view_collection()
+        self.site_url = site_url
+        self._schema_cache = schema_cache
+        self._view_fields = {}  # type: Dict[str, List[str]]
         self.version = "2007"
+        self._last_request = None  # type: Optional[Soap]
+        self.date_format = re.compile("[0-9]+-[0-9]+-[0-9]+ [0-9]+:[0-9]+:[0-9]+")
+
+    def prefetch(self):
+        # type: () -> None
+        """Load all of the list schema now, the requests are sent concurrently"""
+        self._use_schema_cache()
+        loaders = self._metadata_loaders()
+        if not loaders:
+            return
+        with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+            for future in [executor.submit(loader) for loader in loaders]:
+                future.result()
+
+    def _metadata_loaders(self):
+        # type: () -> List[Callable[[], Any]]
+        """Independent requests that make up the list schema"""
+        loaders = []  # type: List[Callable[[], Any]]
+        if self._fields is None:
+            loaders.append(self.get_list)
+        if self._views is None:
+            loaders.append(self._load_views)
+        return loaders
+
+    @property
+    def transfer(self):
+        # type: () -> TransferStats
+        """Bytes received on this List's session, compressed and uncompressed"""
+        return transfer_stats(self._session)
+
+    @property
+    def last_request(self):
+        # type: () -> Optional[str]
+        """The last SOAP request sent, pretty printed on access"""
+        return None if self._last_request is None else str(self._last_request)
+
+    @property
+    def fields(self):
+        # type: () -> List[Dict[str, str]]
+        if self._fields is None:
+            self._use_schema_cache()
+        if self._fields is None:
+            self.get_list()
+        return cast(List[Dict[str, str]], self._fields)
+
+    @fields.setter
+    def fields(self, fields):
+        # type: (List[Dict[str, str]]) -> None
+        self._fields = fields
+        self._sp_columns = None
+        self._disp_columns = None
+        self._converter_table = None
+
+    @property
+    def regional_settings(self):
+        # type: () -> Dict[str, str]
+        if self._regional_settings is None:
+            self._use_schema_cache()
+        if self._regional_settings is None:
+            self.get_list()
+        return cast(Dict[str, str], self._regional_settings)
+
+    @property
+    def server_settings(self):
+        # type: () -> Dict[str, str]
+        if self._server_settings is None:
+            self._use_schema_cache()
+        if self._server_settings is None:
+            self.get_list()
+        return cast(Dict[str, str], self._server_settings)
+
+    @property
+    def views(self):
+        # type: () -> Dict[str, Dict[str, str]]
+        if self._views is None:
+            self._use_schema_cache()
+        if self._views is None:
+            self._load_views()
+        return cast(Dict[str, Dict[str, str]], self._views)
+
+    @views.setter
+    def views(self, views):
+        # type: (Dict[str, Dict[str, str]]) -> None
+        self._views = views
+
+    def _load_views(self):
+        # type: () -> None
+        self._views = self.get_view_collection()
+        self._save_schema({"views": self._views})
+
+    def _get_view_fields(self, view_name):
+        # type: (str) -> List[str]
+        """Fields of view_name, from the schema cache if possible"""
+        self._use_schema_cache()
+        if view_name not in self._view_fields:
+            self._view_fields[view_name] = self.get_view(view_name)["fields"]
+            self._save_schema({"view_fields": {view_name: self._view_fields[view_name]}})
+        return self._view_fields[view_name]
+
+    def _schema_cache_key(self):
+        # type: () -> str
+        return self.site_url or self._url("Lists")
+
+    def _use_schema_cache(self):
+        # type: () -> None
+        """Load whatever the schema cache has, as long as the list Version is unchanged"""
+        if self._schema_cache is None or self._schema_cache_checked:
+            return
+        self._schema_cache_checked = True
+        entry = self._schema_cache.get(self._schema_cache_key(), self.list_name)
+        if entry is None or "version" not in entry:
+            return
+        if not self._schema_cache.is_fresh(entry):
+            if self.get_list_version().get("Version") != entry["version"]:
+                self._schema_cache.delete(self._schema_cache_key(), self.list_name)
+                return
+            self._schema_cache.touch(self._schema_cache_key(), self.list_name)
+
+        if self._fields is None and "fields" in entry:
+            self._set_list_info(entry["fields"], entry["regional_settings"], entry["server_settings"])
+        if self._views is None and "views" in entry:
+            self._views = entry["views"]
+        for view_name, fields in entry.get("view_fields", {}).items():
+            self._view_fields.setdefault(view_name, fields)
+
+    def _save_schema(self, parts):
+        # type: (Dict[str, Any]) -> None
+        if self._schema_cache is not None:
+            self._schema_cache.update(self._schema_cache_key(), self.list_name, parts)
+
+    def get_list_version(self):
+        # type: () -> Dict[str, str]
+        """Attributes (Version, Modified, ...) of the current List
+           from GetListCollection, which is much smaller than GetList
+        """
+        # Build Request
+        soap_request = Soap("GetListCollection")
+        self._last_request = soap_request
 
+        # Send Request
+        response = post(self._session,
+                        url=self._url("Lists"),
+                        headers=self._headers("GetListCollection"),
+                        data=soap_request.data,
+                        verify=self._verify_ssl,
+                        timeout=self.timeout)
+
+        # Parse Response
+        envelope = etree.fromstring(response.content,
+                                    parser=etree.XMLParser(huge_tree=self.huge_tree,
+                                    recover=True))
+        name = self.list_name.lower()
+        for _list in envelope[0][0][0][0]:
+            if name in (_list.get("Title", "").lower(), _list.get("Name", "").lower()):
+                return dict(_list.items())
+        return {}
+
+    def _set_list_info(self, fields, regional_settings, server_settings):
+        # type: (List[Dict[str, str]], Dict[str, str], Dict[str, str]) -> None
         # fields sometimes share the same displayname
         # filtering fields to only contain visible fields
         # minimizes the chance of a one field hiding another
-        if exclude_hidden_fields:
-            self.fields = [field for field in self.fields if field.get("Hidden", "FALSE") == "FALSE"]
+        if self._exclude_hidden_fields:
+            fields = [field for field in fields if field.get("Hidden", "FALSE") == "FALSE"]
+        self.fields = fields
+        self._regional_settings = regional_settings
+        self._server_settings = server_settings
 
-        self._sp_cols = {i["Name"]: {"name": i["DisplayName"], "type": i["Type"]} for i in self.fields}
-        self._disp_cols = {i["DisplayName"]: {"name": i["Name"], "type": i["Type"]} for i in self.fields}
+    @property
+    def _sp_cols(self):
+        # type: () -> Dict[str, Dict[str, str]]
+        if self._sp_columns is None:
+            self._index_fields()
+        return cast(Dict[str, Dict[str, str]], self._sp_columns)
 
-        title_col = self._sp_cols["Title"]["name"]
-        title_type = self._sp_cols["Title"]["type"]
-        self._disp_cols[title_col] = {"name": "Title", "type": title_type}
-        self.last_request = None  # type: Optional[str]
-        self.date_format = re.compile("[0-9]+-[0-9]+-[0-9]+ [0-9]+:[0-9]+:[0-9]+")
+    @property
+    def _disp_cols(self):
+        # type: () -> Dict[str, Dict[str, str]]
+        if self._disp_columns is None:
+            self._index_fields()
+        return cast(Dict[str, Dict[str, str]], self._disp_columns)
+
+    def _index_fields(self):
+        # type: () -> None
+        """Build the column name lookups from self.fields"""
+        sp_cols = {i["Name"]: {"name": i["DisplayName"], "type": i["Type"]} for i in self.fields}
+        disp_cols = {i["DisplayName"]: {"name": i["Name"], "type": i["Type"]} for i in self.fields}
+
+        title_col = sp_cols["Title"]["name"]
+        title_type = sp_cols["Title"]["type"]
+        disp_cols[title_col] = {"name": "Title", "type": title_type}
+        self._sp_columns = sp_cols
+        self._disp_columns = disp_cols
+        self._converter_table = None
+
+    @property
+    def _converters(self):
+        # type: () -> Dict[str, Tuple[str, Callable[[str], Any]]]
+        """{internal name: (display name, converter)} built once from fields"""
+        if self._converter_table is None:
+            self._converter_table = {name: (column["name"], self._converter(column["type"]))
+                                     for name, column in self._sp_cols.items()}
+        return self._converter_table
+
+    def _converter(self, field_type):
+        # type: (str) -> Callable[[str], Any]
+        """The function that turns a raw value of field_type into its Python value"""
+        if field_type in ("Number", "Currency"):
+            return float
+        elif field_type == "DateTime":
+            return self._parse_datetime
+        elif field_type == "Boolean":
+            return _parse_boolean
+        elif field_type in ("User", "UserMulti"):
+            return self._parse_user
+        else:
+            return _identity
+
+    def _parse_datetime(self, value):
+        # type: (str) -> datetime
+        # Dates are '2020-01-02 03:04:05', sometimes after a '123;#'
+        date = value[-19:]
+        try:
+            return datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                            int(date[11:13]), int(date[14:16]), int(date[17:19]))
+        except ValueError:
+            pass
+        match = self.date_format.search(value)
+        if match:
+            value = match.group(0)
+
+        # NOTE: I used to round this just date (7/28/2018)
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+    def _parse_user(self, value):
+        # type: (str) -> Any
+        # Sometimes the User no longer exists or
+        # has a diffrent ID number so we just remove the "123;#"
+        # from the beginning of their name
+        if self.users and value in self.users["sp"]:
+            return self.users["sp"][value]
+        elif "#" in value:
+            users = []
+            for i, value in enumerate(value.split(';#')):
+                if i % 2 == 0:
+                    user = '#%s' % value
+                else:
+                    user += ';#%s' % value
+                    users.append(user)
+            return users
+        else:
+            return value
+
+    @property
+    def users(self):
+        # type: () -> Optional[Dict]
+        if callable(self._users):
+            self._users = self._users()
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        # type: (Union[Optional[Dict], Callable[[], Optional[Dict]]]) -> None
+        self._users = users
 
     def _headers(self, soapaction):
         # type: (str) -> Dict[str,str]
-        headers = {
-            "Content-Type": "text/xml; charset=UTF-8",
-            "SOAPAction": "http://schemas.microsoft.com/sharepoint/soap/" + soapaction,
-        }
-        return headers
+        return soap_headers(soapaction)
 
     def _mutate_to_internal(self, data):
         # type: (List[Dict]) -> None
@@ -104,56 +406,22 @@ class _List2007:
     def _convert_to_display(self, data):
         # type: (List[Dict]) -> None
         """From 'Column_x0020_Title' to  'Column Title'"""
+        converters = self._converters
         for _dict in data:
-            keys = list(_dict.keys())[:]
-            for key in keys:
-                if key not in self._sp_cols:
+            converted = {}
+            for key, value in _dict.items():
+                if key not in converters:
                     raise Exception(key + " not a column in current List.")
-                _dict[self._sp_cols[key]["name"]] = self._python_type(key, _dict.pop(key))
+                display_name, converter = converters[key]
+                converted[display_name] = converter(value)
+            _dict.clear()
+            _dict.update(converted)
 
     def _python_type(self, key, value):
         # type: (str, Any) -> Any
         """Returns proper type from the schema"""
         try:
-            field_type = self._sp_cols[key]["type"]
-            if field_type in ["Number", "Currency"]:
-                return float(value)
-            elif field_type == "DateTime":
-
-                # Need to remove the '123;#' from created dates, but we will do it for all dates
-                # self.date_format = re.compile('\d+-\d+-\d+ \d+:\d+:\d+')
-                match = self.date_format.search(value)
-                if match:
-                    value = match.group(0)
-
-                # NOTE: I used to round this just date (7/28/2018)
-                return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-            elif field_type == "Boolean":
-                if value == "1":
-                    return "Yes"
-                elif value == "0":
-                    return "No"
-                else:
-                    return ""
-            elif field_type in ("User", "UserMulti"):
-                # Sometimes the User no longer exists or
-                # has a diffrent ID number so we just remove the "123;#"
-                # from the beginning of their name
-                if self.users and value in self.users["sp"]:
-                    return self.users["sp"][value]
-                elif "#" in value:
-                    users = []
-                    for i, value in enumerate(value.split(';#')):
-                        if i % 2 == 0:
-                            user = '#%s' % value
-                        else:
-                            user += ';#%s' % value
-                            users.append(user)
-                    return users
-                else:
-                    return value
-            else:
-                return value
+            return self._converters[key][1](value)
         except AttributeError:
             # TODO: log me
             return value
@@ -161,6 +429,9 @@ class _List2007:
     def _sp_type(self, key, value):
         # type: (str, Any) -> Any
         """Returns proper type from the schema"""
+        if value is None:
+            # Clears the field
+            return ""
         try:
             field_type = self._disp_cols[key]["type"]
             if field_type in ["Number", "Currency"]:
@@ -189,14 +460,372 @@ class _List2007:
         query=None,  # type: Optional[Dict]
         row_limit=0,  # type: int
         debug=False,  # type: bool
+        output="rows",  # type: str
     ):
         # type: (...) -> Optional[Any]
         """Get Items from current list
            row_limit defaulted to 0 (unlimited)
+
+           output picks the shape of the result:
+               'rows'    - a list of dicts, one per row
+               'columns' - a dict of column name to list of values
+               'pandas'  - a pandas DataFrame
+               'arrow'   - a pyarrow Table
+           The columnar outputs convert types a column at a time
+           and use None for empty cells.
         """
+        if output not in ("rows", "columns", "pandas", "arrow"):
+            raise ValueError("output must be 'rows', 'columns', 'pandas' or 'arrow'")
 
         # Build Request
-        soap_request = Soap("GetListItems")
+        soap_request, viewfields = self._list_items_request(view_name, fields, query, row_limit)
+        self._last_request = soap_request
+
+        # Send Request
+        response = post(self._session,
+                        url=self._url("Lists"),
+                        headers=self._headers("GetListItems"),
+                        data=soap_request.data,
+                        verify=self._verify_ssl,
+                        timeout=self.timeout,
+                        stream=not debug)
+
+        # Parse Response
+        # TODO: Verify if this works with Sharepoint lists with validation
+        source = BytesIO(response.content) if debug else self._raw_stream(response)
+        try:
+            if output == "rows":
+                data = list(self._iter_rows(source, viewfields))
+            else:
+                data = self._read_columns(source, viewfields, output)
+        finally:
+            source.close()
+            response.close()
+
+        if debug:
+            return response
+        else:
+            return data
+
+    def _read_columns(self, source, viewfields, output):
+        # type: (Any, List[str], str) -> Any
+        """Collect the raw strings of each column, then convert whole columns"""
+        names = [name for name in viewfields if name in self._sp_cols]
+        columns = {name: [] for name in names}  # type: Dict[str, List[Any]]
+        for row in self._iter_rows(source, viewfields, convert=False):
+            for name in names:
+                columns[name].append(row.get(name))
+
+        # Some display names are used by more than one column,
+        # keep the one that has values
+        display = {}  # type: Dict[str, str]
+        for name in names:
+            title = self._sp_cols[name]["name"]
+            if title not in display or all(value is None for value in columns[display[title]]):
+                display[title] = name
+        columns = {name: columns[name] for name in display.values()}
+
+        if output == "pandas":
+            return self._pandas_frame(columns)
+        if output == "arrow":
+            return self._arrow_table(columns)
+        return {self._sp_cols[name]["name"]: self._convert_column(name, values) for name, values in columns.items()}
+
+    def _convert_column(self, key, values):
+        # type: (str, List[Optional[str]]) -> List[Any]
+        """_python_type for a whole column, None stays None"""
+        converter = self._converters[key][1]
+        return [None if value is None else converter(value) for value in values]
+
+    def _pandas_frame(self, columns):
+        # type: (Dict[str, List[Optional[str]]]) -> Any
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("output='pandas' needs pandas, pip install shareplum[pandas]")
+
+        frame = {}
+        for name, values in columns.items():
+            field_type = self._sp_cols[name]["type"]
+            series = pd.Series(values, dtype=object)
+            if field_type in ("Number", "Currency"):
+                series = pd.to_numeric(series)
+            elif field_type == "DateTime":
+                # Drop the '123;#' in front of some dates
+                series = pd.to_datetime(series.str.extract("(" + self.date_format.pattern + ")", expand=False),
+                                        format="%Y-%m-%d %H:%M:%S")
+            elif field_type == "Boolean":
+                series = series.map({"1": "Yes", "0": "No"}).where(series.isna() | series.isin(["1", "0"]), "")
+            else:
+                series = pd.Series(self._convert_column(name, values), dtype=object)
+            frame[self._sp_cols[name]["name"]] = series
+        return pd.DataFrame(frame)
+
+    def _arrow_table(self, columns):
+        # type: (Dict[str, List[Optional[str]]]) -> Any
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError:
+            raise ImportError("output='arrow' needs pyarrow, pip install shareplum[arrow]")
+
+        arrays = {}
+        for name, values in columns.items():
+            field_type = self._sp_cols[name]["type"]
+            if field_type in ("Number", "Currency"):
+                array = pc.cast(pa.array(values, pa.string()), pa.float64())
+            elif field_type == "DateTime":
+                # Drop the '123;#' in front of some dates
+                array = pc.replace_substring_regex(pa.array(values, pa.string()),
+                                                   "^.*?(" + self.date_format.pattern + ").*$", "\\1")
+                array = pc.strptime(array, format="%Y-%m-%d %H:%M:%S", unit="s")
+            else:
+                converted = self._convert_column(name, values)
+                try:
+                    array = pa.array(converted)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    array = pa.array([None if value is None else str(value) for value in converted], pa.string())
+            arrays[self._sp_cols[name]["name"]] = array
+        return pa.table(arrays)
+
+    def iter_list_items(
+        self,
+        view_name=None,  # type: Optional[str]
+        fields=None,  # type: Optional[List[str]]
+        query=None,  # type: Optional[Dict]
+        page_size=1000,  # type: int
+    ):
+        # type: (...) -> Iterator[Dict[str, Any]]
+        """Iterate over Items from current list one page at a time
+           Follows the ListItemCollectionPositionNext paging token
+           and parses each page as it downloads, so rows can be
+           processed before the list has been fully read.
+        """
+        position = None  # type: Optional[str]
+        while True:
+            # Build Request
+            soap_request, viewfields = self._list_items_request(view_name, fields, query, page_size, position)
+            self._last_request = soap_request
+
+            # Send Request
+            response = post(self._session,
+                            url=self._url("Lists"),
+                            headers=self._headers("GetListItems"),
+                            data=soap_request.data,
+                            verify=self._verify_ssl,
+                            timeout=self.timeout,
+                            stream=True)
+
+            # Parse Response while it downloads
+            source = self._raw_stream(response)
+            try:
+                position = yield from self._iter_rows(source, viewfields)
+            finally:
+                source.close()
+
+            if not position:
+                break
+
+    @property
+    def change_token(self):
+        # type: () -> Optional[str]
+        if self._change_token is None and self._schema_cache is not None:
+            entry = self._schema_cache.get(self._schema_cache_key(), self.list_name) or {}
+            self._change_token = entry.get("change_token")
+        return self._change_token
+
+    @change_token.setter
+    def change_token(self, change_token):
+        # type: (Optional[str]) -> None
+        self._change_token = change_token
+        self._save_schema({"change_token": change_token})
+
+    def mirror(self, path, fields=None, max_age=None):
+        # type: (str, Optional[List[str]], Optional[float]) -> ListMirror
+        """A SQLite copy of this list at path, see ListMirror"""
+        return ListMirror(self, path, fields, max_age)
+
+    def get_list_item_changes(self, fields=None, query=None, change_token=None, row_limit=0, save_token=True):
+        # type: (Optional[List[str]], Optional[Dict], Optional[str], int, bool) -> Dict[str, Any]
+        """Items changed since the last call, from GetListItemChangesSinceToken
+
+           The change token is kept in self.change_token, and in the schema
+           cache when there is one, so the next call continues from here.
+           Pass change_token and save_token=False to keep it yourself.
+           Without a token, or when SharePoint no longer knows the token,
+           every item is returned as added and 'full' is True, the caller
+           should then replace its copy of the list.
+
+               {'added': [...], 'updated': [...], 'deleted': [IDs],
+                'full': False, 'token': '1;3;...'}
+
+           Added and updated are told apart by the item version,
+           an item that is still at version 1 was added.
+        """
+        if change_token is None:
+            change_token = self.change_token
+        if fields:
+            fields = list(dict.fromkeys(list(fields) + ["ID"]))
+
+        result = {"added": [], "updated": [], "deleted": [], "full": not change_token,
+                  "token": change_token}  # type: Dict[str, Any]
+        while True:
+            changes = self._list_item_changes(fields, query, change_token, row_limit)
+            if changes["invalid"]:
+                # The token expired, start over with every item
+                change_token = None
+                result = {"added": [], "updated": [], "deleted": [], "full": True, "token": None}
+                continue
+
+            result["deleted"].extend(changes["deleted"])
+            for row, version in zip(changes["rows"], changes["versions"]):
+                added = result["full"] or version == "1"
+                result["added" if added else "updated"].append(row)
+
+            change_token = changes["token"]
+            if not changes["more"]:
+                break
+
+        result["token"] = change_token
+        if save_token:
+            self.change_token = change_token
+        return result
+
+    def _list_item_changes(self, fields, query, change_token, row_limit):
+        # type: (Optional[List[str]], Optional[Dict], Optional[str], int) -> Dict[str, Any]
+        """One GetListItemChangesSinceToken call"""
+        # Build Request, GetListItemChangesSinceToken takes the GetListItems parameters
+        # The item version tells added from updated items, it is a hidden field
+        # so it is asked for by its internal name
+        soap_request, viewfields = self._list_items_request(None, fields, query, row_limit,
+                                                            command="GetListItemChangesSinceToken",
+                                                            extra_view_fields=["owshiddenversion"])
+        if change_token:
+            soap_request.add_parameter("changeToken", change_token)
+        self._last_request = soap_request
+
+        # Send Request
+        response = post(self._session,
+                        url=self._url("Lists"),
+                        headers=self._headers("GetListItemChangesSinceToken"),
+                        data=soap_request.data,
+                        verify=self._verify_ssl,
+                        timeout=self.timeout,
+                        stream=True)
+
+        # Parse Response
+        changes = {"token": change_token, "more": False, "invalid": False, "deleted": [],
+                   "versions": []}  # type: Dict[str, Any]
+
+        def split(events):
+            # type: (Iterable[Tuple[str, etree.Element]]) -> Iterator[Tuple[str, etree.Element]]
+            """Take the Changes out of the events, pass the rows on"""
+            for event, element in events:
+                if element.tag == CHANGES:
+                    if event == "start":
+                        changes["token"] = element.get("LastChangeToken", changes["token"])
+                        changes["more"] = element.get("MoreChanges", "").upper() == "TRUE"
+                elif element.tag == CHANGE_ID:
+                    if event == "end":
+                        change_type = element.get("ChangeType")
+                        if change_type == "Delete":
+                            changes["deleted"].append(element.text)
+                        elif change_type == "InvalidToken":
+                            changes["invalid"] = True
+                else:
+                    if event == "end" and element.tag == Z_ROW:
+                        changes["versions"].append(element.get("ows_owshiddenversion"))
+                    yield event, element
+
+        source = self._raw_stream(response)
+        try:
+            events = etree.iterparse(source,
+                                     events=("start", "end"),
+                                     tag=(CHANGES, CHANGE_ID, RS_DATA, Z_ROW),
+                                     huge_tree=self.huge_tree,
+                                     recover=True)
+            changes["rows"] = list(self._rows_from_events(split(events), viewfields))
+        finally:
+            source.close()
+        return changes
+
+    def iter_list_items_parallel(
+        self,
+        fields=None,  # type: Optional[List[str]]
+        query=None,  # type: Optional[Dict]
+        id_range=5000,  # type: int
+        max_workers=8,  # type: int
+    ):
+        # type: (...) -> Iterator[Dict[str, Any]]
+        """Iterate over Items from current list fetching ID ranges in parallel
+           The list is split into ranges of id_range IDs which are
+           requested by up to max_workers threads. Rows are yielded
+           in ID order and at most 2 * max_workers ranges are held
+           in memory at once.
+        """
+        max_id = self._max_id()
+        if not max_id:
+            return
+
+        range_query = dict(query or {})
+        range_query.setdefault("OrderBy", ["ID"])
+
+        pending = deque()  # type: Deque[Future]
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for start in range(1, max_id + 1, id_range):
+                pending.append(executor.submit(self._get_id_range, fields, range_query, (start, start + id_range)))
+                if len(pending) >= 2 * max_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Stop early if the caller doesn't consume every row
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _max_id(self):
+        # type: () -> int
+        """Highest item ID in the current list, 0 if it is empty"""
+        rows = self.get_list_items(fields=["ID"], query={"OrderBy": [("ID", "DESCENDING")]}, row_limit=1)
+        if not rows:
+            return 0
+        return int(rows[0]["ID"])
+
+    def _get_id_range(self, fields, query, id_range):
+        # type: (Optional[List[str]], Dict, Tuple[int, int]) -> List[Dict[str, Any]]
+        """All rows with an ID in id_range"""
+        soap_request, viewfields = self._list_items_request(None, fields, query, id_range[1] - id_range[0],
+                                                            id_range=id_range)
+        self._last_request = soap_request
+
+        # Send Request
+        response = post(self._session,
+                        url=self._url("Lists"),
+                        headers=self._headers("GetListItems"),
+                        data=soap_request.data,
+                        verify=self._verify_ssl,
+                        timeout=self.timeout,
+                        stream=True)
+
+        # Parse Response
+        source = self._raw_stream(response)
+        try:
+            return list(self._iter_rows(source, viewfields))
+        finally:
+            source.close()
+
+    def _list_items_request(self, view_name, fields, query, row_limit, position=None, id_range=None, view_fields=None,
+                            command="GetListItems", extra_view_fields=None):
+        # type: (Optional[str], Optional[List[str]], Optional[Dict], int, Optional[str], Optional[Tuple[int, int]], Optional[List[str]], str, Optional[List[str]]) -> Tuple[Soap, List[str]]
+        """Build the GetListItems request and the list of fields to keep
+           view_fields saves a GetView call when the fields of view_name are already known
+           extra_view_fields are internal names added to the ViewFields sent,
+           they are requested but not part of the fields to keep
+        """
+        extra_view_fields = extra_view_fields or []
+        soap_request = Soap(command)
         soap_request.add_parameter("listName", self.list_name)
         # Convert Displayed View Name to View ID
         if view_name:
@@ -205,99 +834,154 @@ class _List2007:
         # Add viewFields
         if fields:
             # Convert to SharePoint Style Column Names
-            for i, val in enumerate(fields):
-                fields[i] = self._disp_cols[val]["name"]
-            viewfields = fields
-            soap_request.add_view_fields(fields)
+            viewfields = [self._disp_cols[val]["name"] for val in fields]
+            soap_request.add_view_fields(viewfields + [name for name in extra_view_fields if name not in viewfields])
             # Check for viewname and query
             if [view_name, query] == [None, None]:
                 # Add a query if the viewname and query are not provided
                 # We sort by 'ID' here Ascending is the default
                 soap_request.add_query({"OrderBy": ["ID"]})
 
+        elif view_fields:
+            viewfields = view_fields
         elif view_name:
-            viewfields = self.get_view(view_name)["fields"]
+            viewfields = self._get_view_fields(view_name)
         else:
             # No fields or views provided so get everything
+            # No ViewFields so the server returns the default view's columns,
+            # hidden ones are dropped from the rows when excluded
             viewfields = [x for x in self._sp_cols]
 
         # Add query
         if query:
-            modified_query = dict()
-            where = etree.Element('Where')
-
-            parents = [where]
+            modified_query = {key: value for (key, value) in query.items() if key != "Where"}
             if "Where" in query:
-                where = etree.Element("Where")
-
-                parents = [where]
-                for _i, field in enumerate(query["Where"]):
-                    if field == "And":
-                        parents.append(etree.SubElement(parents[-1], "And"))
-                    elif field == "Or":
-                        if parents[-1].tag == "Or":
-                            parents.pop()
-                        parents.append(etree.SubElement(parents[-1], "Or"))
-                    else:
-                        _type = etree.SubElement(parents[-1], field[0])
-                        field_ref = etree.SubElement(_type, "FieldRef")
-                        field_ref.set("Name", self._disp_cols[field[1]]["name"])
-                        value = etree.SubElement(_type, "Value")
-                        value.set("Type", self._disp_cols[field[1]]["type"])
-                        value.text = self._sp_type(field[1], field[2])
-
-                # query["Where"] = where
-                modified_query["Where"] = where
+                modified_query["Where"] = self._where(query["Where"])
+
+            # Restrict to IDs from id_range[0] up to but not including id_range[1]
+            if id_range:
+                id_where = self._where(["And", ("Geq", "ID", str(id_range[0])), ("Lt", "ID", str(id_range[1]))])
+                if "Where" in modified_query:
+                    where = etree.Element("Where")
+                    both = etree.SubElement(where, "And")
+                    both.extend(modified_query["Where"])
+                    both.extend(id_where)
+                    modified_query["Where"] = where
+                else:
+                    modified_query["Where"] = id_where
 
             soap_request.add_query(modified_query)
 
+        # Continue from the previous page
+        if position:
+            soap_request.add_query_options({"Paging": {"ListItemCollectionPositionNext": position}})
+
         # Set Row Limit
         soap_request.add_parameter("rowLimit", str(row_limit))
-        self.last_request = str(soap_request)
-
-        # Send Request
-        response = post(self._session,
-                        url=self._url("Lists"),
-                        headers=self._headers("GetListItems"),
-                        data=str(soap_request).encode("utf-8"),
-                        verify=self._verify_ssl,
-                        timeout=self.timeout)
-
-        # Parse Response
-        # TODO: Verify if this works with Sharepoint lists with validation
-        envelope = etree.fromstring(response.text.encode("utf-8"),
-                                    parser=etree.XMLParser(huge_tree=self.huge_tree,
-                                    recover=True))
-        listitems = envelope[0][0][0][0][0]
-        data = []
-        for row in listitems:
-            # Strip the 'ows_' from the beginning with key[4:]
-            data.append({key[4:]: value for (key, value) in row.items() if key[4:] in viewfields})
+        return soap_request, viewfields
+
+    def _where(self, conditions):
+        # type: (List[Any]) -> etree.Element
+        """Build a CAML Where element from query['Where']"""
+        where = etree.Element("Where")
+
+        parents = [where]
+        for field in conditions:
+            if field == "And":
+                parents.append(etree.SubElement(parents[-1], "And"))
+            elif field == "Or":
+                if parents[-1].tag == "Or":
+                    parents.pop()
+                parents.append(etree.SubElement(parents[-1], "Or"))
+            else:
+                _type = etree.SubElement(parents[-1], field[0])
+                field_ref = etree.SubElement(_type, "FieldRef")
+                field_ref.set("Name", self._disp_cols[field[1]]["name"])
+                # IsNull and IsNotNull don't take a value
+                if len(field) > 2:
+                    value = etree.SubElement(_type, "Value")
+                    value.set("Type", self._disp_cols[field[1]]["type"])
+                    value.text = self._sp_type(field[1], field[2])
+
+        return where
+
+    def _raw_stream(self, response):
+        # type: (requests.Response) -> StreamReader
+        """File-like body of a streamed response, decompressed as it is read
+           Closing it closes the response and records the bytes received.
+        """
+        return StreamReader(self._session, response)
+
+    def _iter_rows(self, source, viewfields, convert=True):
+        # type: (Any, List[str], bool) -> Generator[Dict[str, Any], None, Optional[str]]
+        """Yields the rows of a GetListItems response as they are parsed
+           Each z:row is dropped from the tree once converted so memory
+           stays flat no matter how large the response is.
+           Returns the next paging token.
+        """
+        events = etree.iterparse(source,
+                                 events=("start", "end"),
+                                 tag=(RS_DATA, Z_ROW),
+                                 huge_tree=self.huge_tree,
+                                 recover=True)
+        return (yield from self._rows_from_events(events, viewfields, convert))
+
+    def _rows_from_events(self, events, viewfields, convert=True):
+        # type: (Iterable[Tuple[str, etree.Element]], List[str], bool) -> Generator[Dict[str, Any], None, Optional[str]]
+        """Shared by iterparse and XMLPullParser readers, see _iter_rows
+           Without convert the rows keep their internal names and raw strings.
+        """
+        # Look up attributes by their 'ows_' name, so each row is built in one pass
+        converters = self._converters if convert else {}
+        columns = {"ows_" + name: converters[name] for name in viewfields if name in converters}
+        unknown = {"ows_" + name for name in viewfields if name not in converters}
+        wanted = set(viewfields)
+        position = None
+        for event, element in events:
+            if element.tag == RS_DATA:
+                if event == "start":
+                    position = element.get("ListItemCollectionPositionNext")
+                continue
+            if event != "end":
+                continue
+
+            if convert:
+                row = {}
+                for key, value in element.items():
+                    column = columns.get(key)
+                    if column is not None:
+                        row[column[0]] = column[1](value)
+                    elif key in unknown:
+                        raise Exception(key[4:] + " not a column in current List.")
+            else:
+                # Strip the 'ows_' from the beginning with key[4:]
+                row = {key[4:]: value for (key, value) in element.items() if key[4:] in wanted}
+            yield row
 
-        self._convert_to_display(data)
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
-        if debug:
-            return response
-        else:
-            return data
+        return position
 
     def get_list(self):  # type: () -> None
         """Get Info on Current List
-           This is run in __init__ so you don't
-           have to run it again.
-           Access from self.schema
+           This is run the first time the list info
+           is used so you don't have to run it again.
+           Access from self.fields, self.regional_settings
+           and self.server_settings
         """
 
         # Build Request
         soap_request = Soap("GetList")
         soap_request.add_parameter("listName", self.list_name)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("GetList"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -306,9 +990,21 @@ class _List2007:
                                     parser=etree.XMLParser(huge_tree=self.huge_tree,
                                     recover=True))  # type: etree.ElementTree
         (fields, regional_settings, server_settings) = self.parse_list_envelope(envelope)
-        self.fields += fields
-        self.regional_settings.update(regional_settings)
-        self.server_settings.update(server_settings)
+        self._set_list_info(fields, regional_settings, server_settings)
+        info = self.parse_list_info(envelope)
+        self._save_schema({
+            "version": info.get("Version"),
+            "modified": info.get("Modified"),
+            "fields": fields,
+            "regional_settings": regional_settings,
+            "server_settings": server_settings,
+        })
+
+    @staticmethod
+    def parse_list_info(envelope):
+        # type: (etree.ElementTree) -> Dict[str, str]
+        """Attributes of the List element (ID, Title, Version, Modified, ...)"""
+        return dict(envelope[0][0][0][0].items())
 
     @staticmethod
     def parse_list_envelope(envelope):
@@ -342,10 +1038,6 @@ class _List2007:
         """Get Info on View Name
         """
 
-        # Build Request
-        soap_request = Soap("GetView")
-        soap_request.add_parameter("listName", self.list_name)
-
         if not view_name:
             views = self.get_view_collection()
             if views:
@@ -355,17 +1047,15 @@ class _List2007:
                             view_name = v
                             break
 
-        if self.list_name not in ["UserInfo", "User Information List"] and self.views:
-            soap_request.add_parameter("viewName", self.views[view_name]["Name"][1:-1])
-        else:
-            soap_request.add_parameter("viewName", view_name)
-        self.last_request = str(soap_request)
+        # Build Request
+        soap_request = self._view_request(view_name)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Views"),
                         headers=self._headers("GetView"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -373,6 +1063,21 @@ class _List2007:
         envelope = etree.fromstring(response.text.encode("utf-8"),
                                     parser=etree.XMLParser(huge_tree=self.huge_tree,
                                     recover=True))  # type: etree.ElementTree
+        return self.parse_view_envelope(envelope)
+
+    def _view_request(self, view_name):
+        # type: (str) -> Soap
+        soap_request = Soap("GetView")
+        soap_request.add_parameter("listName", self.list_name)
+        if self.list_name not in ["UserInfo", "User Information List"] and self.views:
+            soap_request.add_parameter("viewName", self.views[view_name]["Name"][1:-1])
+        else:
+            soap_request.add_parameter("viewName", view_name)
+        return soap_request
+
+    @staticmethod
+    def parse_view_envelope(envelope):
+        # type: (etree.ElementTree) -> Dict[str, Any]
         # TODO: Fix me? Should this use XPath too?
         view = envelope[0][0][0][0]
         info = {key: value for (key, value) in view.items()}
@@ -381,27 +1086,32 @@ class _List2007:
 
     def get_view_collection(self):  # type: () -> Optional[Dict[str, Dict[str, str]]]
         """Get Views for Current List
-           This is run in __init__ so you don't
-           have to run it again.
+           This is run the first time self.views
+           is used so you don't have to run it again.
            Access from self.views
         """
 
         # Build Request
         soap_request = Soap("GetViewCollection")
         soap_request.add_parameter("listName", self.list_name)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Views"),
                         headers=self._headers("GetViewCollection"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
         envelope = etree.fromstring(response.text.encode("utf-8"),
                                     parser=etree.XMLParser(huge_tree=self.huge_tree,
                                     recover=True))
+        return self.parse_view_collection_envelope(envelope)
+
+    @staticmethod
+    def parse_view_collection_envelope(envelope):
+        # type: (etree.ElementTree) -> Dict[str, Dict[str, str]]
         views = envelope[0][0][0][0]
         data = []
         for row in views.getchildren():
@@ -418,13 +1128,13 @@ class _List2007:
         soap_request.add_parameter("strlistID", list_id)
         soap_request.add_parameter("strlistItemID", item_id)
         soap_request.add_parameter("strFieldName", field_name)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("GetVersionCollection"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -447,7 +1157,9 @@ class _List2007:
                 'editor': row.attrib['Editor']})
         return data
 
-    def update_list_items(self, data, kind, mutate_data=False):  # type: (List[Dict[str, str]], str) -> Any
+    def update_list_items(self, data, kind, mutate_data=False, batch_size=BATCH_SIZE,
+                          max_batch_bytes=MAX_BATCH_BYTES, max_workers=1, stream=False):
+        # type: (List[Any], str, bool, Optional[int], Optional[int], int, bool) -> Dict[str, Any]
         """Update List Items
            kind = 'New', 'Update', or 'Delete'
 
@@ -463,29 +1175,136 @@ class _List2007:
            Delete:
            Just provided a list of ID's
                data = [23, 28]
+
+           Rows are sent in batches of at most batch_size rows and
+           max_batch_bytes of XML, max_workers batches at a time.
+           The results are keyed by '<row position>,<kind>' with
+           positions counting from 1 over all of data.
+
+           With stream the request bodies are sent with chunked transfer
+           encoding as they are serialized, for very large batches.
         """
         if type(data) != list:
             raise Exception("data must be a list of dictionaries")
-        # Build Request
-        soap_request = Soap("UpdateListItems")
-        soap_request.add_parameter("listName", self.list_name)
-        if kind != "Delete":
-            if mutate_data:
-                spdata = data
-                self._mutate_to_internal(spdata)
-            else:
-                spdata = self._convert_to_internal(data)
+        return self.apply_list_items([(kind, row) for row in data], mutate_data, batch_size, max_batch_bytes,
+                                     max_workers, stream)
+
+    def apply_list_items(self, operations, mutate_data=False, batch_size=BATCH_SIZE,
+                         max_batch_bytes=MAX_BATCH_BYTES, max_workers=1, stream=False):
+        # type: (List[Tuple[str, Any]], bool, Optional[int], Optional[int], int, bool) -> Dict[str, Any]
+        """New, Update and Delete rows in one UpdateListItems Batch
+
+               operations = [('New', {'Title': 'New Title'}),
+                             ('Update', {'ID': 23, 'Title': 'Updated Title'}),
+                             ('Delete', 28)]
+
+           Batching works as in update_list_items. The results are keyed by
+           '<position>,<kind>' with positions counting from 1 over operations.
+        """
+        # Build Requests
+        batches = self._update_requests(operations, mutate_data, batch_size, max_batch_bytes)
+
+        results = {}  # type: Dict[str, Any]
+        if max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                for result in executor.map(self._send_update, batches, [stream] * len(batches)):
+                    results.update(result)
         else:
-            spdata = data
+            for soap_request in batches:
+                results.update(self._send_update(soap_request, stream))
+        return results
+
+    def sync(
+        self,
+        records,  # type: List[Dict[str, Any]]
+        key,  # type: Union[str, List[str]]
+        columns=None,  # type: Optional[List[str]]
+        delete=True,  # type: bool
+        query=None,  # type: Optional[Dict]
+        dry_run=False,  # type: bool
+        batch_size=BATCH_SIZE,  # type: Optional[int]
+        max_batch_bytes=MAX_BATCH_BYTES,  # type: Optional[int]
+        max_workers=1,  # type: int
+    ):
+        # type: (...) -> Dict[str, Any]
+        """Make the list match records
+
+           key is the column, or list of columns, that identifies a row.
+           Only ID, key and columns (default: every column in records) are
+           read from the list. Rows are matched on key and their values of
+           columns compared in one go, only changed rows are diffed column
+           by column.
+           Records missing from the list are added, changed rows get an Update
+           with just the changed columns and, with delete, list rows that are
+           not in records are deleted. query limits the rows that are synced.
+           Columns a record leaves out are not changed, None clears a column.
+           Two records with the same key raise ValueError. List rows whose
+           key repeats an earlier row are left alone and listed under
+           'duplicates', even with delete.
+
+           Returns a report:
+               {'new': [...], 'updated': [...], 'deleted': [IDs],
+                'duplicates': [IDs], 'unchanged': 3, 'results': {...}}
+        """
+        keys = [key] if isinstance(key, str) else list(key)
+        if columns is None:
+            columns = sorted({column for record in records for column in record} - set(keys) - {"ID"})
+
+        # Index the list on key, keep the values of the compared columns
+        existing = {}  # type: Dict[Tuple, Tuple[Any, Tuple, Dict[str, Any]]]
+        duplicates = []  # type: List[Any]
+        for row in self.iter_list_items(fields=["ID"] + keys + columns, query=query):
+            row_key = tuple(list_dict.normal(row.get(column)) for column in keys)
+            if row_key in existing:
+                duplicates.append(row["ID"])
+                continue
+            existing[row_key] = (row["ID"], tuple(map(row.get, columns)), row)
+
+        report = {"new": [], "updated": [], "deleted": [], "duplicates": duplicates, "unchanged": 0,
+                  "results": {}}  # type: Dict[str, Any]
+        operations = []  # type: List[Tuple[str, Any]]
+        seen = set()  # type: Set[Tuple]
+        for record in records:
+            row_key = tuple(list_dict.normal(record.get(column)) for column in keys)
+            if row_key in seen:
+                raise ValueError("More than one record with key %r" % (row_key,))
+            seen.add(row_key)
+            if row_key not in existing:
+                new_row = {column: record[column] for column in keys + columns if column in record}
+                operations.append(("New", new_row))
+                report["new"].append(new_row)
+                continue
+
+            _id, row_values, row = existing.pop(row_key)
+            if tuple(map(record.get, columns)) == row_values:
+                report["unchanged"] += 1
+                continue
+            update = {column: record[column] for column in columns
+                      if column in record and list_dict.normal(record[column]) != list_dict.normal(row.get(column))}
+            if update:
+                update["ID"] = _id
+                operations.append(("Update", update))
+                report["updated"].append(update)
+            else:
+                report["unchanged"] += 1
 
-        soap_request.add_actions(spdata, kind)
-        self.last_request = str(soap_request)
+        if delete:
+            report["deleted"] = [_id for _id, row_values, row in existing.values()]
+            operations.extend(("Delete", _id) for _id in report["deleted"])
+
+        if operations and not dry_run:
+            report["results"] = self.apply_list_items(operations, False, batch_size, max_batch_bytes, max_workers)
+        return report
+
+    def _send_update(self, soap_request, stream=False):
+        # type: (Soap, bool) -> Dict[str, Any]
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("UpdateListItems"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.chunks() if stream else soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -493,6 +1312,42 @@ class _List2007:
         envelope = etree.fromstring(response.text.encode("utf-8"),
                                     parser=etree.XMLParser(huge_tree=self.huge_tree,
                                     recover=True))
+        return self.parse_update_envelope(envelope)
+
+    def _update_requests(self, operations, mutate_data=False, batch_size=None, max_batch_bytes=None):
+        # type: (List[Tuple[str, Any]], bool, Optional[int], Optional[int]) -> List[Soap]
+        """UpdateListItems requests for operations, a new one is started when a
+           Batch reaches batch_size Methods or max_batch_bytes. Method IDs are the
+           positions in operations so results can be merged.
+        """
+        if mutate_data:
+            self._mutate_to_internal([row for kind, row in operations if kind != "Delete"])
+            spdata = operations
+        else:
+            spdata = [(kind, row if kind == "Delete" else self._convert_to_internal([row])[0])
+                      for kind, row in operations]
+
+        batches = []  # type: List[Soap]
+        soap_request = None  # type: Optional[Soap]
+        rows = size = 0
+        for index, (kind, row) in enumerate(spdata, 1):
+            method = Soap.method_bytes(index, kind, row)
+            method_size = len(method)
+            if (soap_request is None
+                    or (batch_size and rows >= batch_size)
+                    or (max_batch_bytes and rows and size + method_size > max_batch_bytes)):
+                soap_request = Soap("UpdateListItems", writer="bytes")
+                soap_request.add_parameter("listName", self.list_name)
+                batches.append(soap_request)
+                rows = size = 0
+            soap_request.add_method(method)
+            rows += 1
+            size += method_size
+        return batches
+
+    @staticmethod
+    def parse_update_envelope(envelope):
+        # type: (etree.ElementTree) -> Dict[str, Any]
         # TODO: Fix me
         results = envelope[0][0][0][0]
         data_out = {}  # type: Dict
@@ -510,13 +1365,13 @@ class _List2007:
         soap_request = Soap("GetAttachmentCollection")
         soap_request.add_parameter("listName", self.list_name)
         soap_request.add_parameter("listItemID", _id)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("GetAttachmentCollection"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=False,
                         timeout=self.timeout)
 
@@ -546,26 +1401,45 @@ class _List365(_List2007):
                  list_name,  # type: str
                  url,  # type: Callable[[str], str]
                  verify_ssl,  # type: bool
-                 users,  # type: Optional[Dict]
+                 users,  # type: Union[Optional[Dict], Callable[[], Optional[Dict]]]
                  huge_tree,  # type: bool
                  timeout,  # type: Optional[int]
                  exclude_hidden_fields=False,  # type: bool
-                 site_url=None):
-        super().__init__(session, list_name, url, verify_ssl, users, huge_tree, timeout, exclude_hidden_fields, site_url)
-        self.site_url = site_url
-        self.schema = self._get_schema()
+                 site_url=None,
+                 schema_cache=None):  # type: Optional[SchemaCache]
+        super().__init__(session, list_name, url, verify_ssl, users, huge_tree, timeout, exclude_hidden_fields, site_url,
+                         schema_cache)
+        self._schema = None  # type: Optional[Dict[str, Any]]
         self.version = "v365"
 
+    def _metadata_loaders(self):
+        # type: () -> List[Callable[[], Any]]
+        loaders = super()._metadata_loaders()
+        if self._schema is None:
+            loaders.append(self._load_schema)
+        return loaders
+
+    @property
+    def schema(self):
+        # type: () -> Dict[str, Any]
+        if self._schema is None:
+            self._load_schema()
+        return cast(Dict[str, Any], self._schema)
+
+    def _load_schema(self):
+        # type: () -> None
+        self._schema = self._get_schema()
+
     def _get_schema(self):
         url = self.site_url + f"/_api/lists/getbytitle('{self.list_name}')/RenderListDataAsStream"
 
         body = json.dumps({"parameters": {"RenderOptions": 4}})
 
         headers = {'Accept': 'application/json;odata=verbose',
-                   'Content-Type': 'application/json;odata=verbose',
-                   'X-RequestDigest': self.contextinfo['FormDigestValue']}
+                   'Content-Type': 'application/json;odata=verbose'}
 
-        response = post(self._session, url=url, headers=headers, data=body, timeout=self.timeout)
+        response = post_with_digest(self._session, self.site_url, url=url, headers=headers, data=body,
+                                    timeout=self.timeout)
         return response.json()
 
     @property
@@ -595,8 +1469,8 @@ class _List365(_List2007):
         url = self.site_url + f"/_api/lists/getbytitle('{self.list_name}')/Fields"
 
         headers = {'Accept': 'application/json;odata=verbose',
-                   'Content-Type': 'application/json;odata=verbose',
-                   'X-RequestDigest': self.contextinfo['FormDigestValue']}
+                   'Content-Type': 'application/json;odata=verbose'}
 
-        response = post(self._session, url=url, headers=headers, data=body, timeout=self.timeout)
+        response = post_with_digest(self._session, self.site_url, url=url, headers=headers, data=body,
+                                    timeout=self.timeout)
         return response.json()
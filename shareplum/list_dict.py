@@ -1,8 +1,13 @@
 # This is a group of small functions
 # used to work with a list of dictionaries
+from hashlib import blake2b
+from operator import itemgetter
 from typing import Any
 from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Sequence
+from typing import Tuple
 
 
 def changes(new_cmp_dict, old_cmp_dict, id_column, columns):
@@ -27,10 +32,9 @@ def changes(new_cmp_dict, old_cmp_dict, id_column, columns):
             new_val = new_dict.get(dict_key, "NaN")
             if old_val != new_val and new_val != "NaN":
                 if id_column:
-                    try:
-                        update_dict[id_column] = old_dict[id_column]
-                    except KeyError as e:
-                        print("Input Dictionary 'old_cmp_dict' must have ID column: " + str(e))
+                    if id_column not in old_dict:
+                        raise KeyError("Input Dictionary 'old_cmp_dict' must have ID column: " + id_column)
+                    update_dict[id_column] = old_dict[id_column]
                 update_dict[dict_key] = new_val
         if update_dict:
             update_ldict.append(update_dict)
@@ -72,3 +76,90 @@ def full_dict(ldict, keys):
         cmp_dict[index_str] = line
 
     return cmp_dict
+
+
+def normal(value):
+    # type: (Any) -> Any
+    """Comparable form of a value, empty values are None
+       and numbers are floats like the ones read from a List
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def row_digest(row, columns):
+    # type: (Dict, Sequence[str]) -> bytes
+    """16 byte digest of the values of columns in row, values
+       that are equal after normal() have equal digests
+    """
+    values = tuple(normal(row.get(column)) for column in columns)
+    return blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+
+
+def digest_index(ldict, keys, columns):
+    # type: (List[Dict], Any, Sequence[str]) -> Dict[Tuple, Tuple[Tuple, Dict]]
+    """Like full_dict, but keyed by tuples of the key values, so
+       ('a-b', 'c') and ('a', 'b-c') stay apart, and holding the
+       values of columns next to each row:
+           {key tuple: (values tuple, row)}
+       The values are kept rather than a hash of them, which could
+       match for different values (hash(-1) == hash(-2)).
+    """
+    if type(keys) == str:
+        keys = [keys]
+    ldict = list(ldict)
+
+    try:
+        # Rows with every key and column are indexed
+        # without a Python level loop
+        return dict(zip(_tuples(ldict, keys), zip(_tuples(ldict, columns), ldict)))
+    except (KeyError, TypeError):
+        pass
+
+    index = {}
+    for line in ldict:
+        index[tuple(map(line.get, keys))] = (tuple(map(line.get, columns)), line)
+    return index
+
+
+def _tuples(ldict, columns):
+    # type: (List[Dict], Sequence[str]) -> Iterator[Tuple]
+    if len(columns) == 1:
+        return zip(map(itemgetter(columns[0]), ldict))
+    if columns:
+        return map(itemgetter(*columns), ldict)
+    return (() for line in ldict)
+
+
+def digest_changes(new_index, old_index, id_column, columns):
+    # type: (Dict[Tuple, Tuple[Tuple, Dict]], Dict[Tuple, Tuple[Tuple, Dict]], str, List[str]) -> List[Dict]
+    """changes() for two digest_index results built on the same columns
+       Rows with equal values are skipped in one tuple comparison,
+       only the others are compared column by column.
+    """
+    update_ldict = []
+    for key, (new_values, new_dict) in new_index.items():
+        old = old_index.get(key)
+        if old is None or old[0] == new_values:
+            continue
+        old_dict = old[1]
+
+        update_dict = {}
+        for dict_key in columns:
+            if dict_key not in new_dict:
+                continue
+            new_val = new_dict[dict_key]
+            if normal(new_val) != normal(old_dict.get(dict_key)):
+                update_dict[dict_key] = new_val
+        if update_dict:
+            if id_column:
+                if id_column not in old_dict:
+                    raise KeyError("Input Dictionary 'old_cmp_dict' must have ID column: " + id_column)
+                update_dict[id_column] = old_dict[id_column]
+            update_ldict.append(update_dict)
+    return update_ldict
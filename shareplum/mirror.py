@@ -0,0 +1,258 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+# SQLite column types of SharePoint field types, anything else is TEXT
+SQL_TYPES = {
+    "Counter": "INTEGER",
+    "Integer": "INTEGER",
+    "Number": "REAL",
+    "Currency": "REAL",
+}
+
+# CAML comparisons that have a SQL equivalent
+SQL_OPERATORS = {
+    "Eq": "=",
+    "Neq": "<>",
+    "Gt": ">",
+    "Geq": ">=",
+    "Lt": "<",
+    "Leq": "<=",
+}
+
+# Stored as '1;#Name' or JSON lists, so the server has to compare their values
+SERVER_ONLY_TYPES = {"Lookup", "LookupMulti", "User", "UserMulti", "MultiChoice"}
+
+
+class UnsupportedQuery(Exception):
+    """The query can't be run against the mirror"""
+
+
+class ListMirror:
+    """Local SQLite copy of a List
+
+       The items are stored in a table with one typed column per field
+       and kept up to date with GetListItemChangesSinceToken. query()
+       runs the Where and OrderBy parts of a get_list_items query
+       locally, queries the mirror can't handle go to SharePoint.
+
+           mirror = sp_list.mirror("my_list.db", fields=["Title", "Status"], max_age=60)
+           rows = mirror.query({"Where": [("Eq", "Status", "Open")]})
+    """
+
+    def __init__(self, sp_list, path, fields=None, max_age=None):
+        # type: (Any, str, Optional[List[str]], Optional[float]) -> None
+        self._list = sp_list
+        self.path = path
+        self.max_age = max_age
+        if fields is None:
+            fields = list(sp_list._disp_cols)
+        self.fields = list(dict.fromkeys(["ID"] + list(fields)))
+        # Columns are named after the internal field names
+        self._columns = [sp_list._disp_cols[field]["name"] for field in self.fields]
+        self._types = {column: sp_list._sp_cols[column]["type"] for column in self._columns}
+        self._lock = threading.Lock()
+        self._indexes = set()  # type: Set[str]
+        self._refreshed = 0.0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        # type: () -> None
+        schema = json.dumps([[column, self._types[column]] for column in self._columns])
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row and row[0] != schema:
+                # Different fields, start over
+                self._db.execute("DROP TABLE IF EXISTS items")
+                self._db.execute("DELETE FROM meta")
+            columns = ", ".join("%s %s" % (_quote(column), SQL_TYPES.get(self._types[column], "TEXT"))
+                                for column in self._columns if column != "ID")
+            self._db.execute("CREATE TABLE IF NOT EXISTS items (ID INTEGER PRIMARY KEY, %s)" % columns)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (schema,))
+
+    @property
+    def change_token(self):
+        # type: () -> Optional[str]
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'change_token'").fetchone()
+        return row[0] if row else None
+
+    def refresh(self):
+        # type: () -> Dict[str, Any]
+        """Apply the changes since the last refresh, the first one reads the whole list"""
+        # An empty token makes get_list_item_changes read every item
+        changes = self._list.get_list_item_changes(fields=self.fields, change_token=self.change_token or "",
+                                                   save_token=False)
+        placeholders = ", ".join("?" for column in self._columns)
+        insert = "INSERT OR REPLACE INTO items (%s) VALUES (%s)" % (
+            ", ".join(_quote(column) for column in self._columns), placeholders)
+
+        with self._lock, self._db:
+            if changes["full"]:
+                self._db.execute("DELETE FROM items")
+            self._db.executemany(insert, (self._sql_row(row) for row in changes["added"] + changes["updated"]))
+            self._db.executemany("DELETE FROM items WHERE ID = ?", ((int(_id),) for _id in changes["deleted"]))
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('change_token', ?)", (changes["token"],))
+        self._refreshed = time.monotonic()
+        return changes
+
+    def query(self, query=None, fields=None, row_limit=0):
+        # type: (Optional[Dict], Optional[List[str]], int) -> List[Dict[str, Any]]
+        """Rows like get_list_items(fields=fields, query=query, row_limit=row_limit)
+
+           The mirror is refreshed first when it is older than max_age.
+           Where and OrderBy run in SQLite, with an index on every column
+           they use. Anything else is sent to SharePoint.
+        """
+        if not self._refreshed:
+            self.refresh()
+        elif self.max_age is not None and time.monotonic() - self._refreshed >= self.max_age:
+            self.refresh()
+
+        fields = fields or self.fields
+        try:
+            sql, parameters, used = self._select(query or {}, fields, row_limit)
+        except UnsupportedQuery:
+            return self._list.get_list_items(fields=fields, query=query, row_limit=row_limit)
+
+        with self._lock:
+            for column in used - self._indexes:
+                self._db.execute("CREATE INDEX IF NOT EXISTS %s ON items (%s)"
+                                 % (_quote("ix_" + column), _quote(column)))
+                self._indexes.add(column)
+            cursor = self._db.execute(sql, parameters)
+            columns = self._field_columns(fields)
+            return [self._python_row(columns, values) for values in cursor.fetchall()]
+
+    def _field_columns(self, fields):
+        # type: (List[str]) -> List[str]
+        columns = []
+        for field in fields:
+            column = self._list._disp_cols[field]["name"]
+            if column not in self._types:
+                raise UnsupportedQuery(field + " is not in the mirror")
+            columns.append(column)
+        return columns
+
+    def _select(self, query, fields, row_limit):
+        # type: (Dict, List[str], int) -> Tuple[str, List[Any], Set[str]]
+        if set(query) - {"Where", "OrderBy"}:
+            raise UnsupportedQuery("Only Where and OrderBy run locally")
+
+        sql = "SELECT %s FROM items" % ", ".join(_quote(column) for column in self._field_columns(fields))
+        parameters = []  # type: List[Any]
+        used = set()  # type: Set[str]
+        if query.get("Where"):
+            # Translate the same CAML that would be sent to SharePoint
+            where = self._list._where(query["Where"])
+            sql += " WHERE " + " AND ".join(self._condition(element, parameters, used) for element in where)
+
+        order = []
+        for field in query.get("OrderBy", []):
+            name, descending = (field[0], field[1] == "DESCENDING") if type(field) == tuple else (field, False)
+            column = self._field_columns([name])[0]
+            used.add(column)
+            order.append(_quote(column) + (" DESC" if descending else ""))
+        if order:
+            sql += " ORDER BY " + ", ".join(order)
+        if row_limit:
+            sql += " LIMIT %d" % row_limit
+        return sql, parameters, used
+
+    def _condition(self, element, parameters, used):
+        # type: (Any, List[Any], Set[str]) -> str
+        if element.tag in ("And", "Or"):
+            return "(" + (" %s " % element.tag.upper()).join(
+                self._condition(child, parameters, used) for child in element) + ")"
+
+        column = element.find("FieldRef").get("Name")
+        if column not in self._types:
+            raise UnsupportedQuery(column + " is not in the mirror")
+        used.add(column)
+        if element.tag == "IsNull":
+            return _quote(column) + " IS NULL"
+        if element.tag == "IsNotNull":
+            return _quote(column) + " IS NOT NULL"
+        if self._types[column] in SERVER_ONLY_TYPES:
+            raise UnsupportedQuery(column + " values can't be compared locally")
+
+        value = self._sql_value(column, element.find("Value").text)
+        if element.tag in SQL_OPERATORS:
+            parameters.append(value)
+            return "%s %s ?" % (_quote(column), SQL_OPERATORS[element.tag])
+        if element.tag == "BeginsWith":
+            parameters.append(_like(value) + "%")
+            return "%s LIKE ? ESCAPE '\\'" % _quote(column)
+        if element.tag == "Contains":
+            parameters.append("%" + _like(value) + "%")
+            return "%s LIKE ? ESCAPE '\\'" % _quote(column)
+        raise UnsupportedQuery(element.tag + " can't run locally")
+
+    def _sql_value(self, column, value):
+        # type: (str, Optional[str]) -> Any
+        """A CAML Value as it is stored in the mirror"""
+        field_type = self._types[column]
+        if value is None:
+            return None
+        if field_type in ("Counter", "Integer"):
+            return int(value)
+        if field_type in ("Number", "Currency"):
+            return float(value)
+        if field_type == "Boolean":
+            return {"1": "Yes", "0": "No"}.get(value, value)
+        return value
+
+    def _sql_row(self, row):
+        # type: (Dict[str, Any]) -> List[Any]
+        values = []
+        for field, column in zip(self.fields, self._columns):
+            value = row.get(field)
+            if isinstance(value, datetime):
+                value = value.strftime("%Y-%m-%d %H:%M:%S")
+            elif isinstance(value, list):
+                value = json.dumps(value)
+            elif value is not None and column == "ID":
+                value = int(value)
+            values.append(value)
+        return values
+
+    def _python_row(self, columns, values):
+        # type: (List[str], Tuple) -> Dict[str, Any]
+        """Back to the values get_list_items returns, empty cells are left out"""
+        row = {}
+        for column, value in zip(columns, values):
+            if value is None:
+                continue
+            field_type = self._types[column]
+            if field_type == "DateTime":
+                value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+            elif field_type in ("User", "UserMulti") and value.startswith("["):
+                value = json.loads(value)
+            elif field_type in ("Counter", "Integer"):
+                value = str(value)
+            row[self._list._sp_cols[column]["name"]] = value
+        return row
+
+    def close(self):
+        # type: () -> None
+        self._db.close()
+
+
+def _quote(name):
+    # type: (str) -> str
+    return '"%s"' % name.replace('"', '""')
+
+
+def _like(value):
+    # type: (str) -> str
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
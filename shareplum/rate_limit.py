@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+
+# Responses SharePoint Online throttles with
+THROTTLE_STATUS = (429, 503)
+
+# Seconds of requests used to measure the rate that got throttled
+WINDOW = 10.0
+
+
+class _Bucket:
+    """Token bucket of one host"""
+
+    def __init__(self, rate, burst, now):
+        # type: (Optional[float], float, float) -> None
+        self.rate = rate
+        self.tokens = burst
+        self.updated = now
+        self.blocked_until = 0.0
+        self.throttles = 0
+        self.sent = deque()  # type: Deque[float]
+
+
+class RateLimiter:
+    """Client side rate limit per SharePoint host, shared by every session using it
+
+       Each host (a tenant on SharePoint Online) gets a token bucket.
+       Without a rate requests aren't held back until the host throttles
+       one with 429 or 503. Then every request to the host waits out
+       Retry-After and the rate drops to decrease times what was being
+       sent. Each successful request adds increase / rate back, so the
+       rate climbs by about increase requests per second every second
+       until the host pushes back again.
+
+           limiter = RateLimiter(max_rate=20)
+           site = Site(url, authcookie=authcookie, rate_limiter=limiter)
+
+       Throttled requests are sent again up to retries times.
+    """
+
+    def __init__(self,
+                 rate=None,  # type: Optional[float]
+                 burst=1.0,  # type: float
+                 min_rate=0.5,  # type: float
+                 max_rate=None,  # type: Optional[float]
+                 increase=1.0,  # type: float
+                 decrease=0.5,  # type: float
+                 retries=5,  # type: int
+                 backoff=2.0,  # type: float
+                 clock=time.monotonic,  # type: Callable[[], float]
+                 sleep=time.sleep,  # type: Callable[[float], Any]
+                 ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.retries = retries
+        self.backoff = backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}  # type: Dict[str, _Bucket]
+
+    def _bucket(self, host, now):
+        # type: (str, float) -> _Bucket
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(self.rate, self.burst, now)
+        return bucket
+
+    def rate_of(self, host):
+        # type: (str) -> Optional[float]
+        """Requests per second allowed to host, None when it isn't limited"""
+        with self._lock:
+            bucket = self._buckets.get(host.lower())
+            return bucket.rate if bucket else self.rate
+
+    def acquire(self, host):
+        # type: (str) -> None
+        """Wait until a request may be sent to host"""
+        host = host.lower()
+        while True:
+            with self._lock:
+                now = self._clock()
+                bucket = self._bucket(host, now)
+                if now < bucket.blocked_until:
+                    wait = bucket.blocked_until - now
+                elif bucket.rate is None:
+                    wait = 0.0
+                else:
+                    bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+                    bucket.updated = now
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        wait = 0.0
+                    else:
+                        wait = (1 - bucket.tokens) / bucket.rate
+                if not wait:
+                    bucket.sent.append(now)
+                    while bucket.sent[0] < now - WINDOW:
+                        bucket.sent.popleft()
+                    return
+            self._sleep(wait)
+
+    def throttled(self, host, retry_after=None):
+        # type: (str, Optional[float]) -> float
+        """host answered 429 or 503, returns the seconds requests are held back"""
+        host = host.lower()
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            # Throttles of requests sent before the last one don't count twice
+            if now >= bucket.blocked_until:
+                bucket.throttles += 1
+                sent = len(bucket.sent) / WINDOW
+                rate = bucket.rate if bucket.rate is not None else max(sent, self.min_rate)
+                bucket.rate = max(self.min_rate, rate * self.decrease)
+                # One request goes as soon as the wait is over
+                bucket.tokens = min(1.0, self.burst)
+            if retry_after is None:
+                retry_after = self.backoff * 2 ** (bucket.throttles - 1)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            bucket.updated = max(bucket.updated, bucket.blocked_until)
+            return retry_after
+
+    def succeeded(self, host):
+        # type: (str) -> None
+        """host answered a request without throttling it"""
+        host = host.lower()
+        with self._lock:
+            bucket = self._bucket(host, self._clock())
+            bucket.throttles = 0
+            if bucket.rate is not None:
+                rate = bucket.rate + self.increase / bucket.rate
+                bucket.rate = min(rate, self.max_rate) if self.max_rate else rate
+
+    def send(self, send, request, **kwargs):
+        # type: (Callable[..., requests.Response], requests.PreparedRequest, Any) -> requests.Response
+        """Send request with send, waiting for the host's bucket and retrying throttled requests"""
+        host = urlsplit(request.url or "").netloc
+        attempt = 0
+        while True:
+            self.acquire(host)
+            response = send(request, **kwargs)
+            if response.status_code not in THROTTLE_STATUS:
+                self.succeeded(host)
+                return response
+            self.throttled(host, retry_after(response))
+            # A streamed body can't be sent twice
+            if attempt >= self.retries or not (request.body is None or isinstance(request.body, (bytes, str))):
+                return response
+            attempt += 1
+            response.close()
+
+
+def retry_after(response):
+    # type: (requests.Response) -> Optional[float]
+    """Seconds from the Retry-After header, which is a number or an HTTP date"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared by every session new_session creates
+default_rate_limiter = RateLimiter()
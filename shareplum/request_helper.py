@@ -1,20 +1,292 @@
+import threading
+import time
+import weakref
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
 import requests
+from requests.packages.urllib3.util.request import ACCEPT_ENCODING
+from requests.packages.urllib3.util.retry import Retry
+from requests_toolbelt import SSLAdapter
 from .errors import ShareplumRequestError
+from .rate_limit import default_rate_limiter, RateLimiter
+from .version import __version__
+
+# Refresh the form digest this many seconds before SharePoint expires it
+DIGEST_EXPIRY_MARGIN = 60
+
+# Connection pools of new_session, hosts pooled and connections kept per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+
+class _Session(requests.Session):
+    """A Session whose requests go through a RateLimiter"""
+
+    def __init__(self, rate_limiter):
+        # type: (RateLimiter) -> None
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    def send(self, request, **kwargs):
+        return self.rate_limiter.send(super().send, request, **kwargs)
+
+
+def new_session(auth=None,  # type: Optional[Any]
+                authcookie=None,  # type: Optional[requests.cookies.RequestsCookieJar]
+                ssl_version=None,  # type: Optional[float]
+                retry=None,  # type: Optional[Retry]
+                pool_connections=POOL_CONNECTIONS,  # type: int
+                pool_maxsize=POOL_MAXSIZE,  # type: int
+                pool_block=False,  # type: bool
+                keep_alive=True,  # type: bool
+                rate_limiter=default_rate_limiter,  # type: Optional[RateLimiter]
+                ):
+    # type: (...) -> requests.Session
+    """A requests Session set up for SharePoint, it can be shared by many Sites
+
+       pool_maxsize connections are kept open per host, make it at least
+       the number of threads using the session. With pool_block threads
+       wait for a free connection instead of opening extra ones that are
+       closed after one request. keep_alive=False closes every connection
+       after its request.
+
+       Requests wait for rate_limiter, which is shared by every session
+       by default, and it retries 429 and 503 responses. Pass None to
+       leave 503 to retry and to send requests as fast as they come.
+
+       The session can be used from several threads at once as long as
+       its headers, cookies and auth aren't changed while it is in use.
+    """
+    if retry is None:
+        # Throttling is left to the rate limiter, which shares it between threads
+        retry = Retry(total=5,
+                      read=5,
+                      connect=5,
+                      backoff_factor=0.3,
+                      status_forcelist=[500, 502, 504] if rate_limiter else [500, 502, 503, 504])
+
+    pool = {"pool_connections": pool_connections, "pool_maxsize": pool_maxsize,
+            "pool_block": pool_block}  # type: Dict[str, Any]
+    http_adaptor = requests.adapters.HTTPAdapter(max_retries=retry, **pool)
+    https_adaptor = http_adaptor
+    if ssl_version is not None:
+        https_adaptor = SSLAdapter(ssl_version, max_retries=retry, **pool)
+
+    session = requests.Session() if rate_limiter is None else _Session(rate_limiter)
+    session.mount("https://", https_adaptor)
+    session.mount("http://", http_adaptor)
+    # Every encoding urllib3 can decode, br when brotli is installed
+    session.headers.update({"user-agent": "shareplum/%s" % __version__, "Accept-Encoding": ACCEPT_ENCODING})
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    if authcookie is not None:
+        session.cookies = authcookie
+    else:
+        session.auth = auth
+    return session
 
 
 def get(session, url, **kwargs):
     try:
         response = session.get(url, **kwargs)
         response.raise_for_status()
-        return response
     except requests.exceptions.RequestException as err:
         raise ShareplumRequestError("Shareplum HTTP Get Failed", err)
+    if not kwargs.get("stream"):
+        record_transfer(session, response)
+    return response
 
 
 def post(session, url, **kwargs):
     try:
         response = session.post(url, **kwargs)
         response.raise_for_status()
-        return response
     except requests.exceptions.RequestException as err:
         raise ShareplumRequestError("Shareplum HTTP Post Failed", err)
+    if not kwargs.get("stream"):
+        record_transfer(session, response)
+    return response
+
+
+class TransferStats:
+    """Response bytes received on one session, as sent and once decompressed
+
+       last is the most recent call of the current thread:
+           {'url': ..., 'encoding': 'gzip', 'compressed': 5120, 'uncompressed': 81920}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.calls = 0
+        self.compressed = 0
+        self.uncompressed = 0
+
+    def add(self, url, encoding, compressed, uncompressed):
+        # type: (str, Optional[str], int, int) -> None
+        with self._lock:
+            self.calls += 1
+            self.compressed += compressed
+            self.uncompressed += uncompressed
+        self._local.last = {"url": url, "encoding": encoding, "compressed": compressed, "uncompressed": uncompressed}
+
+    @property
+    def last(self):
+        # type: () -> Optional[Dict[str, Any]]
+        return getattr(self._local, "last", None)
+
+    @property
+    def ratio(self):
+        # type: () -> float
+        """How many times smaller the responses were on the wire"""
+        return self.uncompressed / self.compressed if self.compressed else 1.0
+
+
+_transfer_stats = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+_transfer_stats_lock = threading.Lock()
+
+
+def transfer_stats(session):
+    # type: (requests.Session) -> TransferStats
+    """The TransferStats of session, shared by every object using it"""
+    with _transfer_stats_lock:
+        stats = _transfer_stats.get(session)
+        if stats is None:
+            stats = _transfer_stats[session] = TransferStats()
+        return stats
+
+
+def record_transfer(session, response, uncompressed=None):
+    # type: (requests.Session, requests.Response, Optional[int]) -> None
+    """Add a response that has been read, uncompressed is its decoded size
+       and defaults to the length of response.content
+    """
+    try:
+        # Bytes urllib3 read from the connection, before decoding
+        compressed = response.raw.tell()
+        if uncompressed is None:
+            uncompressed = len(response.content)
+        url, encoding = response.url, response.headers.get("Content-Encoding")
+    except (AttributeError, TypeError):
+        # Not a urllib3 response
+        return
+    transfer_stats(session).add(url, encoding, compressed, uncompressed)
+
+
+class StreamReader:
+    """File-like body of a streamed response, decompressed as it is read
+
+       gzip, deflate and br are undone chunk by chunk, so the parser
+       reading it never holds the inflated body. close() closes the
+       response and records its sizes in transfer_stats.
+    """
+
+    def __init__(self, session, response):
+        # type: (requests.Session, requests.Response) -> None
+        self._session = session
+        self._response = response
+        self._closed = False
+        self.size = 0
+        response.raw.decode_content = True
+
+    def read(self, size=-1):
+        # type: (int) -> bytes
+        data = self._response.raw.read(size)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        # type: () -> None
+        if not self._closed:
+            self._closed = True
+            record_transfer(self._session, self._response, self.size)
+        self._response.close()
+
+
+class _FormDigestCache:
+    """X-RequestDigest values of one session, keyed by site url"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._digests = {}  # type: Dict[str, Tuple[str, float]]
+
+    def get(self, session, site_url, timeout=None):
+        # type: (requests.Session, str, Any) -> str
+        with self._lock:
+            value, expires = self._digests.get(site_url, (None, 0))
+            if value is None or time.monotonic() >= expires:
+                response = post(session, site_url + "/_api/contextinfo", timeout=timeout)
+                data = response.json()
+                # odata=verbose wraps the result
+                info = data.get("d", {}).get("GetContextWebInformation", data)
+                value = info["FormDigestValue"]
+                lifetime = int(info.get("FormDigestTimeoutSeconds", 1800))
+                expires = time.monotonic() + max(lifetime - DIGEST_EXPIRY_MARGIN, lifetime / 2)
+                self._digests[site_url] = (value, expires)
+            return value
+
+    def expire(self, site_url):
+        # type: (str) -> None
+        with self._lock:
+            self._digests.pop(site_url, None)
+
+
+_digest_caches = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+_digest_caches_lock = threading.Lock()
+
+
+def _digest_cache(session):
+    # type: (requests.Session) -> _FormDigestCache
+    with _digest_caches_lock:
+        cache = _digest_caches.get(session)
+        if cache is None:
+            cache = _digest_caches[session] = _FormDigestCache()
+        return cache
+
+
+def form_digest(session, site_url, timeout=None):
+    # type: (requests.Session, str, Any) -> str
+    """The form digest for site_url, only POSTs to /_api/contextinfo
+       when there is none yet or it is about to expire.
+       Shared by every object using the same session.
+    """
+    return _digest_cache(session).get(session, site_url, timeout)
+
+
+def expire_form_digest(session, site_url):
+    # type: (requests.Session, str) -> None
+    _digest_cache(session).expire(site_url)
+
+
+def _digest_rejected(err):
+    # type: (ShareplumRequestError) -> bool
+    response = getattr(err.details, "response", None)
+    if response is None or response.status_code != 403:
+        return False
+    # -2130575251: The security validation for this page is invalid
+    return "-2130575251" in response.text or "security validation" in response.text.lower()
+
+
+def post_with_digest(session, site_url, url, headers=None, **kwargs):
+    """post with an X-RequestDigest header from the digest cache
+       If SharePoint rejects the digest it is refreshed and the
+       request is sent once more, unless its data was a stream
+       that has been read already.
+    """
+    headers = dict(headers or {})
+    headers["X-RequestDigest"] = form_digest(session, site_url, kwargs.get("timeout"))
+    try:
+        return post(session, url, headers=headers, **kwargs)
+    except ShareplumRequestError as err:
+        if not _digest_rejected(err):
+            raise
+        expire_form_digest(session, site_url)
+        data = kwargs.get("data")
+        if not (data is None or isinstance(data, (bytes, str))):
+            raise
+    headers["X-RequestDigest"] = form_digest(session, site_url, kwargs.get("timeout"))
+    return post(session, url, headers=headers, **kwargs)
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+
+class SchemaCache:
+    """On-disk cache of list schemas, one JSON file per list
+
+       Holds the fields, regional_settings, server_settings, views and
+       view fields of a list keyed by site URL and list name. Entries are
+       revalidated against the list Version before they are used, unless
+       they are younger than max_age seconds.
+
+           cache = SchemaCache("~/.cache/shareplum")
+           site = Site(url, authcookie=authcookie, schema_cache=cache)
+    """
+
+    def __init__(self, path, max_age=None):
+        # type: (str, Optional[float]) -> None
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, site_url, list_name):
+        # type: (str, str) -> str
+        key = "%s\n%s" % (site_url.rstrip("/").lower(), list_name.lower())
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, site_url, list_name):
+        # type: (str, str) -> Optional[Dict[str, Any]]
+        """The cached entry or None"""
+        try:
+            with open(self._file(site_url, list_name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        # type: (Dict[str, Any]) -> bool
+        """True if the entry can be used without revalidating"""
+        return self.max_age is not None and time.time() - entry.get("checked", 0) < self.max_age
+
+    def update(self, site_url, list_name, parts):
+        # type: (str, str, Dict[str, Any]) -> None
+        """Merge parts into the entry, a new list Version starts a new entry"""
+        with self._lock:
+            entry = self.get(site_url, list_name) or {}
+            if "version" in parts and entry.get("version", parts["version"]) != parts["version"]:
+                entry = {}
+            view_fields = dict(entry.get("view_fields", {}))
+            view_fields.update(parts.get("view_fields", {}))
+            entry.update(parts)
+            entry["view_fields"] = view_fields
+            entry["site_url"] = site_url
+            entry["list_name"] = list_name
+            entry["checked"] = time.time()
+            self._write(self._file(site_url, list_name), entry)
+
+    def touch(self, site_url, list_name):
+        # type: (str, str) -> None
+        """Record that the entry was just revalidated"""
+        self.update(site_url, list_name, {})
+
+    def delete(self, site_url, list_name):
+        # type: (str, str) -> None
+        try:
+            os.remove(self._file(site_url, list_name))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, file_name, entry):
+        # type: (str, Dict[str, Any]) -> None
+        # Write to a temporary file first so readers never see half an entry
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_name, file_name)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
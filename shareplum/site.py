@@ -4,16 +4,17 @@ from typing import List
 from typing import Optional
 
 import requests
-from requests.packages.urllib3.util.retry import Retry
-from requests_toolbelt import SSLAdapter
 from lxml import etree
 # import defusedxml.ElementTree as etree
 
-from .request_helper import get, post
+from .request_helper import form_digest, get, new_session, post, POOL_CONNECTIONS, POOL_MAXSIZE
+from .request_helper import transfer_stats, TransferStats
+from .rate_limit import default_rate_limiter, RateLimiter
 from .list import _List2007, _List365
 from .folder import _Folder
+from .schema_cache import SchemaCache
 from .soap import Soap
-from .version import __version__
+from .soap import soap_headers
 
 from enum import Enum
 
@@ -28,6 +29,34 @@ class Version(Enum):
     v365 = 6
 
 
+# SOAP Services
+SERVICES_URL = {
+    "Alerts": "/_vti_bin/Alerts.asmx",
+    "Authentication": "/_vti_bin/Authentication.asmx",
+    "Copy": "/_vti_bin/Copy.asmx",
+    "Dws": "/_vti_bin/Dws.asmx",
+    "Forms": "/_vti_bin/Forms.asmx",
+    "Imaging": "/_vti_bin/Imaging.asmx",
+    "DspSts": "/_vti_bin/DspSts.asmx",
+    "Lists": "/_vti_bin/lists.asmx",
+    "Meetings": "/_vti_bin/Meetings.asmx",
+    "People": "/_vti_bin/People.asmx",
+    "Permissions": "/_vti_bin/Permissions.asmx",
+    "SiteData": "/_vti_bin/SiteData.asmx",
+    "Sites": "/_vti_bin/Sites.asmx",
+    "Search": "/_vti_bin/Search.asmx",
+    "UserGroup": "/_vti_bin/usergroup.asmx",
+    "Versions": "/_vti_bin/Versions.asmx",
+    "Views": "/_vti_bin/Views.asmx",
+    "WebPartPages": "/_vti_bin/WebPartPages.asmx",
+    "Webs": "/_vti_bin/Webs.asmx",
+}  # type: Dict[str, str]
+
+
+# Marks lazily loaded attributes that haven't been fetched
+_NOT_LOADED = object()
+
+
 class _Site2007:
 
     def __init__(self,
@@ -38,65 +67,85 @@ class _Site2007:
                  ssl_version=None,  # type: Optional[float]
                  huge_tree=False,  # type: bool
                  timeout=None,  # type: Optional[int]
-                 retry=None):
+                 retry=None,
+                 users=None,  # type: Optional[Dict[str, Dict[str, str]]]
+                 resolve_users=True,  # type: bool
+                 site_info=None,  # type: Optional[str]
+                 schema_cache=None,  # type: Optional[SchemaCache]
+                 pool_connections=POOL_CONNECTIONS,  # type: int
+                 pool_maxsize=POOL_MAXSIZE,  # type: int
+                 pool_block=False,  # type: bool
+                 keep_alive=True,  # type: bool
+                 session=None,  # type: Optional[requests.Session]
+                 rate_limiter=default_rate_limiter,  # type: Optional[RateLimiter]
+                 ):
         self.site_url = site_url
         self._verify_ssl = verify_ssl
 
-        if retry is None:
-            retry = Retry(total=5,
-                        read=5,
-                        connect=5,
-                        backoff_factor=0.3,
-                        status_forcelist=[500, 502, 503, 504])
+        if session is None:
+            self._session = new_session(auth, authcookie, ssl_version, retry, pool_connections, pool_maxsize,
+                                        pool_block, keep_alive, rate_limiter)
+        elif auth is not None or authcookie is not None:
+            # Setting them would change the credentials of every Site sharing the session
+            raise ValueError("auth and authcookie can't be used with a shared session")
+        else:
+            self._session = session
 
-        http_adaptor = requests.adapters.HTTPAdapter(max_retries=retry)
-        https_adaptor = http_adaptor
+        self.huge_tree = huge_tree
 
-        self._session = requests.Session()
-        if ssl_version is not None:
-            https_adaptor = SSLAdapter(ssl_version, max_retries=retry)
+        self.timeout = timeout
 
-        self._session.mount("https://", https_adaptor)
-        self._session.mount("http://", http_adaptor)
+        self._last_request = None  # type: Optional[Soap]
 
-        self._session.headers.update({"user-agent": "shareplum/%s" % __version__})
+        self._services_url = dict(SERVICES_URL)  # type: Dict[str, str]
 
-        if authcookie is not None:
-            self._session.cookies = authcookie
-        else:
-            self._session.auth = auth
+        # Fetched on first access unless provided (e.g. from a cache)
+        # Optional[str] once loaded
+        self._site_info = site_info if site_info is not None else _NOT_LOADED  # type: Any
+        self._users = users
+        self._resolve_users = resolve_users
+        self._schema_cache = schema_cache
+        self.version = "2007"  # For Debugging
 
-        self.huge_tree = huge_tree
+    @property
+    def last_request(self):
+        # type: () -> Optional[str]
+        """The last SOAP request sent, pretty printed on access"""
+        return None if self._last_request is None else str(self._last_request)
 
-        self.timeout = timeout
+    @property
+    def session(self):
+        # type: () -> requests.Session
+        """The requests Session of this Site, pass it to Site(session=...) to share its connections"""
+        return self._session
 
-        self.last_request = None  # type: Optional[str]
-
-        self._services_url = {
-            "Alerts": "/_vti_bin/Alerts.asmx",
-            "Authentication": "/_vti_bin/Authentication.asmx",
-            "Copy": "/_vti_bin/Copy.asmx",
-            "Dws": "/_vti_bin/Dws.asmx",
-            "Forms": "/_vti_bin/Forms.asmx",
-            "Imaging": "/_vti_bin/Imaging.asmx",
-            "DspSts": "/_vti_bin/DspSts.asmx",
-            "Lists": "/_vti_bin/lists.asmx",
-            "Meetings": "/_vti_bin/Meetings.asmx",
-            "People": "/_vti_bin/People.asmx",
-            "Permissions": "/_vti_bin/Permissions.asmx",
-            "SiteData": "/_vti_bin/SiteData.asmx",
-            "Sites": "/_vti_bin/Sites.asmx",
-            "Search": "/_vti_bin/Search.asmx",
-            "UserGroup": "/_vti_bin/usergroup.asmx",
-            "Versions": "/_vti_bin/Versions.asmx",
-            "Views": "/_vti_bin/Views.asmx",
-            "WebPartPages": "/_vti_bin/WebPartPages.asmx",
-            "Webs": "/_vti_bin/Webs.asmx",
-        }  # type: Dict[str, str]
-
-        self.site_info = self.get_site()
-        self.users = self.get_users()
-        self.version = "2007"  # For Debugging
+    @property
+    def transfer(self):
+        # type: () -> TransferStats
+        """Bytes received on this Site's session, compressed and uncompressed"""
+        return transfer_stats(self._session)
+
+    @property
+    def site_info(self):
+        # type: () -> Optional[str]
+        if self._site_info is _NOT_LOADED:
+            self._site_info = self.get_site()
+        return self._site_info
+
+    @property
+    def users(self):
+        # type: () -> Optional[Dict[str, Dict[str, str]]]
+        """UserInfo lookups used to convert User columns
+           Downloaded on first access, None when resolve_users is False
+        """
+        if self._users is None and self._resolve_users:
+            self._users = self.get_users()
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        # type: (Optional[Dict[str, Dict[str, str]]]) -> None
+        self._users = users
 
     def _url(self, service):
         # type: (str) -> str
@@ -105,11 +154,7 @@ class _Site2007:
 
     def _headers(self, soap_action):
         # type: (str) -> Dict[str, str]
-        headers = {
-            "Content-Type": "text/xml; charset=UTF-8",
-            "SOAPAction": "http://schemas.microsoft.com/sharepoint/soap/" + soap_action,
-        }
-        return headers
+        return soap_headers(soap_action)
 
     # This is part of List but seems awkward under the List Method
     def add_list(self, list_name, description, template_id):
@@ -164,13 +209,13 @@ class _Site2007:
         soap_request.add_parameter("listName", list_name)
         soap_request.add_parameter("description", description)
         soap_request.add_parameter("templateID", template_id)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("AddList"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -183,13 +228,13 @@ class _Site2007:
         # Build Request
         soap_request = Soap("DeleteList")
         soap_request.add_parameter("listName", list_name)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         post(self._session,
              url=self._url("Lists"),
              headers=self._headers("DeleteList"),
-             data=str(soap_request).encode("utf-8"),
+             data=soap_request.data,
              verify=self._verify_ssl,
              timeout=self.timeout)
 
@@ -198,13 +243,13 @@ class _Site2007:
         # Build Request
         soap_request = Soap("GetFormCollection")
         soap_request.add_parameter("listName", list_name)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Forms"),
                         headers=self._headers("GetFormCollection"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -223,13 +268,13 @@ class _Site2007:
         # Build Request
         soap_request = Soap("GetSite")
         soap_request.add_parameter("SiteUrl", self.site_url)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Sites"),
                         headers=self._headers("GetSite"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -246,13 +291,13 @@ class _Site2007:
         # Build Request
         soap_request = Soap("GetListTemplates")
         soap_request.add_parameter("GetListTemplates")
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Webs"),
                         headers=self._headers("GetListTemplates"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -271,13 +316,13 @@ class _Site2007:
         # Build Request
         soap_request = Soap("GetSiteTemplates")
         soap_request.add_parameter("LCID", lcid)
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Sites"),
                         headers=self._headers("GetSiteTemplates"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -297,13 +342,13 @@ class _Site2007:
         """Returns List information for current Site"""
         # Build Request
         soap_request = Soap("GetListCollection")
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("SiteData"),
                         headers=self._headers("GetListCollection"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -335,13 +380,13 @@ class _Site2007:
 
         # Set Row Limit
         soap_request.add_parameter("rowLimit", str(rowlimit))
-        self.last_request = str(soap_request)
+        self._last_request = soap_request
 
         # Send Request
         response = post(self._session,
                         url=self._url("Lists"),
                         headers=self._headers("GetListItems"),
-                        data=str(soap_request).encode("utf-8"),
+                        data=soap_request.data,
                         verify=self._verify_ssl,
                         timeout=self.timeout)
 
@@ -352,6 +397,11 @@ class _Site2007:
                                         recover=True))
         except Exception as e:
             raise requests.ConnectionError("GetUsers GetListItems response failed to parse correctly: " + str(e))
+        return self.parse_users_envelope(envelope)
+
+    @staticmethod
+    def parse_users_envelope(envelope):
+        # type: (etree.ElementTree) -> Dict[str, Dict[str, str]]
         # TODO: Verify if this works on Sharepoint lists with validation
         listitems = envelope[0][0][0][0][0]
         data = []
@@ -366,25 +416,32 @@ class _Site2007:
 
     # SharePoint Method Objects
     # Not the best name as it could clash with the built-in list()
-    def list(self, list_name, exclude_hidden_fields=False):
-        # type: (str, bool) -> _List2007
+    def list(self, list_name, exclude_hidden_fields=False, prefetch=False):
+        # type: (str, bool, bool) -> _List2007
         """Sharepoint Lists Web Service
            Microsoft Developer Network:
            The Lists Web service provides methods for working
            with SharePoint lists, content types, list items, and files.
+
+           The list schema is loaded on first use, or straight away
+           (with the requests sent concurrently) when prefetch is True.
         """
 
-        return _List2007(
+        sp_list = _List2007(
             self._session,
             list_name,
             self._url,
             self._verify_ssl,
-            self.users,
+            lambda: self.users,
             self.huge_tree,
             self.timeout,
             exclude_hidden_fields=exclude_hidden_fields,
             site_url=self.site_url,
+            schema_cache=self._schema_cache,
         )
+        if prefetch:
+            sp_list.prefetch()
+        return sp_list
 
     # Legacy API
     List = list
@@ -402,11 +459,28 @@ class _Site365(_Site2007):
                  verify_ssl=True,  # type: bool
                  ssl_version=None,  # type: Optional[float]
                  huge_tree=False,  # type: bool
-                 timeout=None):  # type: Optional[int]
-        super().__init__(site_url, auth, authcookie, verify_ssl, ssl_version, huge_tree, timeout)
-
-        self._session.headers.update({'Accept': 'application/json',
-                                      'Content-Type': 'application/json;odata=nometadata'})
+                 timeout=None,  # type: Optional[int]
+                 retry=None,
+                 users=None,  # type: Optional[Dict[str, Dict[str, str]]]
+                 resolve_users=True,  # type: bool
+                 site_info=None,  # type: Optional[str]
+                 schema_cache=None,  # type: Optional[SchemaCache]
+                 pool_connections=POOL_CONNECTIONS,  # type: int
+                 pool_maxsize=POOL_MAXSIZE,  # type: int
+                 pool_block=False,  # type: bool
+                 keep_alive=True,  # type: bool
+                 session=None,  # type: Optional[requests.Session]
+                 rate_limiter=default_rate_limiter,  # type: Optional[RateLimiter]
+                 ):
+        super().__init__(site_url, auth, authcookie, verify_ssl, ssl_version, huge_tree, timeout, retry,
+                         users=users, resolve_users=resolve_users, site_info=site_info, schema_cache=schema_cache,
+                         pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block,
+                         keep_alive=keep_alive, session=session, rate_limiter=rate_limiter)
+
+        # A shared session is left as it is
+        if session is None:
+            self._session.headers.update({'Accept': 'application/json',
+                                          'Content-Type': 'application/json;odata=nometadata'})
         self.version = "v365"
 
     @property
@@ -420,8 +494,7 @@ class _Site365(_Site2007):
         return _Folder(self._session, folder_name, self.site_url, timeout=self.timeout)
 
     def _get_form_digest_value(self):
-        response = post(self._session, self.site_url + "/_api/contextinfo")
-        return response.json()['FormDigestValue']
+        return form_digest(self._session, self.site_url, self.timeout)
 
     @property
     def contextinfo(self):
@@ -483,25 +556,32 @@ class _Site365(_Site2007):
 
     # SharePoint Method Objects
     # Not the best name as it could clash with the built-in list()
-    def list(self, list_name, exclude_hidden_fields=False):
-        # type: (str, bool) -> _List365
+    def list(self, list_name, exclude_hidden_fields=False, prefetch=False):
+        # type: (str, bool, bool) -> _List365
         """Sharepoint Lists Web Service
            Microsoft Developer Network:
            The Lists Web service provides methods for working
            with SharePoint lists, content types, list items, and files.
+
+           The list schema is loaded on first use, or straight away
+           (with the requests sent concurrently) when prefetch is True.
         """
 
-        return _List365(
+        sp_list = _List365(
             self._session,
             list_name,
             self._url,
             self._verify_ssl,
-            self.users,
+            lambda: self.users,
             self.huge_tree,
             self.timeout,
             exclude_hidden_fields=exclude_hidden_fields,
             site_url=self.site_url,
+            schema_cache=self._schema_cache,
         )
+        if prefetch:
+            sp_list.prefetch()
+        return sp_list
 
     # Legacy API
     List = list
@@ -514,60 +594,59 @@ def Site(site_url,  # type: str
          verify_ssl=True,  # type: bool
          ssl_version=None,  # type: Optional[float]
          huge_tree=False,  # type: bool
-         timeout=None):  # type: Optional[int]
+         timeout=None,  # type: Optional[int]
+         users=None,  # type: Optional[Dict[str, Dict[str, str]]]
+         resolve_users=True,  # type: bool
+         site_info=None,  # type: Optional[str]
+         schema_cache=None,  # type: Optional[SchemaCache]
+         pool_connections=POOL_CONNECTIONS,  # type: int
+         pool_maxsize=POOL_MAXSIZE,  # type: int
+         pool_block=False,  # type: bool
+         keep_alive=True,  # type: bool
+         session=None,  # type: Optional[requests.Session]
+         rate_limiter=default_rate_limiter,  # type: Optional[RateLimiter]
+         ):
+    """Nothing is requested from SharePoint until it is needed.
+       site_info and users are downloaded on first access, pass them
+       in to reuse cached copies, or set resolve_users=False to never
+       look up User columns.
+       schema_cache (a SchemaCache) keeps list schemas between runs.
+
+       pool_connections, pool_maxsize, pool_block and keep_alive set up
+       the connection pools, see request_helper.new_session. Pass the
+       session of another Site (site.session) to share its connections
+       and credentials, the pool settings are then ignored and auth or
+       authcookie raise ValueError. The session is not changed, so share
+       it between Sites of the same version. A Site, its Lists and
+       Folders can be used from several threads at once.
+       rate_limiter (a RateLimiter) paces requests per host and honours
+       Retry-After, one is shared by every Site unless you pass your own
+       or None.
+    """
 
     # We ask for the various versions of SharePoint with 2010 as default
     # Multiple Version are allowed, but only 2010, 2013, and 365 are implemented
-    if version == Version.v2007:
-        return _Site2007(site_url,
-                         auth,
-                         authcookie,
-                         verify_ssl,
-                         ssl_version,
-                         huge_tree,
-                         timeout)
-
-    elif version == Version.v2010:
-        return _Site2007(site_url,
-                         auth,
-                         authcookie,
-                         verify_ssl,
-                         ssl_version,
-                         huge_tree,
-                         timeout)
-
-    elif version == Version.v2013:
-        return _Site365(site_url,
-                        auth,
-                        authcookie,
-                        verify_ssl,
-                        ssl_version,
-                        huge_tree,
-                        timeout)
-
-    elif version == Version.v2016:
-        return _Site365(site_url,
-                        auth,
-                        authcookie,
-                        verify_ssl,
-                        ssl_version,
-                        huge_tree,
-                        timeout)
-
-    elif version == Version.v2019:
-        return _Site365(site_url,
-                        auth,
-                        authcookie,
-                        verify_ssl,
-                        ssl_version,
-                        huge_tree,
-                        timeout)
-
-    elif version == Version.v365:
-        return _Site365(site_url,
-                        auth,
-                        authcookie,
-                        verify_ssl,
-                        ssl_version,
-                        huge_tree,
-                        timeout)
+    if version in (Version.v2007, Version.v2010):
+        site_class = _Site2007
+    elif version in (Version.v2013, Version.v2016, Version.v2019, Version.v365):
+        site_class = _Site365
+    else:
+        return None
+
+    return site_class(site_url,
+                      auth,
+                      authcookie,
+                      verify_ssl,
+                      ssl_version,
+                      huge_tree,
+                      timeout,
+                      users=users,
+                      resolve_users=resolve_users,
+                      site_info=site_info,
+                      schema_cache=schema_cache,
+                      pool_connections=pool_connections,
+                      pool_maxsize=pool_maxsize,
+                      pool_block=pool_block,
+                      keep_alive=keep_alive,
+                      session=session,
+                      rate_limiter=rate_limiter)
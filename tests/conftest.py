@@ -0,0 +1,112 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+import requests
+
+
+class FakeResponse:
+    """Enough of requests.Response for the code under test"""
+
+    def __init__(self, status_code=200, content=b"", data=None, headers=None, text=None):
+        self.status_code = status_code
+        self.content = content
+        self._data = data
+        self.headers = headers if headers is not None else {"Content-Length": str(len(content))}
+        self.text = text if text is not None else content.decode("utf-8", "replace")
+        self.raw = BytesIO(content)
+        self.closed = False
+
+    def json(self):
+        return self._data
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError("%d Error" % self.status_code, response=self)
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeSession:
+    """Stands in for requests.Session
+       /_api/contextinfo hands out digest-1, digest-2, ...
+       everything else goes to respond(), which subclasses implement.
+    """
+
+    digest_lifetime = 1800
+
+    def __init__(self):
+        self.digests = 0
+
+    def post(self, url, headers=None, data=None, **kwargs):
+        if url.endswith("/_api/contextinfo"):
+            self.digests += 1
+            return FakeResponse(data={"d": {"GetContextWebInformation": {
+                "FormDigestValue": "digest-%d" % self.digests,
+                "FormDigestTimeoutSeconds": self.digest_lifetime}}})
+        return self.respond("POST", url, headers or {}, data, **kwargs)
+
+    def get(self, url, headers=None, **kwargs):
+        return self.respond("GET", url, headers or {}, None, **kwargs)
+
+    def respond(self, method, url, headers, data, **kwargs):
+        raise AssertionError("Unexpected %s %s" % (method, url))
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Base of the request handlers served by local_server"""
+
+    protocol_version = "HTTP/1.1"
+    # Otherwise each response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_body(self, body, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    """local_server(handler, **attributes) serves handler on 127.0.0.1 until the test ends
+       The attributes are set on the server, server.url is a site on it.
+    """
+    servers = []
+
+    def start(handler, **attributes):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        server.url = "http://127.0.0.1:%d/sites/test" % server.server_address[1]
+        for name, value in attributes.items():
+            setattr(server, name, value)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
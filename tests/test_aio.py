@@ -0,0 +1,164 @@
+import asyncio
+import os
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from lxml import etree  # noqa: E402
+
+from shareplum.aio import AsyncList365, AsyncSite  # noqa: E402
+from shareplum.site import Version  # noqa: E402
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+
+def _read(name):
+    with open(os.path.join(__location__, "data", name), "rb") as f:
+        return f.read()
+
+
+UPDATE_RESULT = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>
+<UpdateListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><UpdateListItemsResult>
+<Results>%s</Results></UpdateListItemsResult></UpdateListItemsResponse></soap:Body></soap:Envelope>"""
+
+
+def _update_result(body):
+    methods = etree.fromstring(body).iter("{http://schemas.microsoft.com/sharepoint/soap/}Method", "Method")
+    results = "".join('<Result ID="%s,%s"><ErrorCode>0x00000000</ErrorCode></Result>'
+                      % (method.get("ID"), method.get("Cmd")) for method in methods)
+    return (UPDATE_RESULT % results).encode("utf-8")
+
+
+def _soap_handler(calls):
+    async def handler(request):
+        action = request.headers["SOAPAction"].rsplit("/", 1)[-1]
+        body = await request.read()
+        calls.append(action)
+        if action == "UpdateListItems":
+            return web.Response(body=_update_result(body), content_type="text/xml")
+        if action == "GetList":
+            return web.Response(body=_read("2010xml.xml"), content_type="text/xml")
+        if action == "GetViewCollection":
+            return web.Response(body=_read("viewcollection.xml"), content_type="text/xml")
+        if action == "GetListItems":
+            page = "listitems_page2.xml" if b"ListItemCollectionPositionNext" in body else "listitems_page1.xml"
+            return web.Response(body=_read(page), content_type="text/xml")
+        return web.Response(status=500)
+    return handler
+
+
+def _rest_handler(calls):
+    """Just enough of the REST API for folders, the first write gets its digest rejected"""
+    digests = []
+
+    async def handler(request):
+        path = request.path
+        if path == "/_api/contextinfo":
+            digests.append("digest%d" % len(digests))
+            calls.append("contextinfo")
+            return web.json_response({"FormDigestValue": digests[-1], "FormDigestTimeoutSeconds": 1800})
+        calls.append(path.rsplit("/", 1)[-1])
+        if request.headers.get("X-RequestDigest") != digests[-1] or len(digests) == 1:
+            return web.Response(status=403, text="-2130575251 The security validation for this page is invalid")
+        if path == "/_api/web/folders":
+            return web.json_response({"d": {"ServerRelativeUrl": "/Shared Documents/Test"}})
+        return web.json_response({})
+    return handler
+
+
+async def _run_with_server(test, version=Version.v2007):
+    calls = []
+    app = web.Application()
+    app.router.add_post("/_vti_bin/lists.asmx", _soap_handler(calls))
+    app.router.add_post("/_vti_bin/Views.asmx", _soap_handler(calls))
+    app.router.add_post("/_api/{tail:.*}", _rest_handler(calls))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with AsyncSite("http://127.0.0.1:%d" % port, version=version) as sp_site:
+            await test(sp_site, calls)
+    finally:
+        await runner.cleanup()
+
+
+def test_async_list_items():
+    async def test(sp_site, calls):
+        sp_list = await sp_site.list("Test List")
+        assert sorted(calls) == ["GetList", "GetViewCollection"]
+
+        rows = [row async for row in sp_list.iter_list_items(fields=["Title"], page_size=2)]
+        assert rows == [{"Title": "First Row!"}, {"Title": "Another One!"}, {"Title": "Third Row"}]
+
+        rows = await sp_list.get_list_items(fields=["Title"])
+        assert len(rows) == 2
+
+    asyncio.run(_run_with_server(test))
+
+
+def test_async_list_is_async_only():
+    async def test(sp_site, calls):
+        sp_list = await sp_site.list("Test List")
+        assert sp_list.site_url == sp_site.site_url
+        assert sp_list.fields and sp_list.views
+        for name in ("sync", "mirror", "get_list_item_changes", "iter_list_items_parallel", "prefetch"):
+            assert not hasattr(sp_list, name)
+        assert not hasattr(sp_site, "folder")
+
+    asyncio.run(_run_with_server(test))
+
+
+def test_async_update_list_items():
+    async def test(sp_site, calls):
+        sp_list = await sp_site.list("Test List")
+        results = await sp_list.update_list_items([{"Title": "One"}, {"Title": "Two"}, {"Title": "Three"}],
+                                                  kind="New", batch_size=2)
+        assert calls.count("UpdateListItems") == 2
+        assert results == {"1,New": "0x00000000", "2,New": "0x00000000", "3,New": "0x00000000"}
+        assert "UpdateListItems" in sp_list.last_request
+
+    asyncio.run(_run_with_server(test))
+
+
+def test_async_folder_caches_digest():
+    async def test(sp_site, calls):
+        assert sp_site.version == "v365"
+        folder = await sp_site.folder("Shared Documents/Test")
+        assert folder.info == {"d": {"ServerRelativeUrl": "/Shared Documents/Test"}}
+        await folder.upload_file(b"Hello", "new.txt")
+        await folder.check_out("new.txt")
+        await folder.check_in("new.txt", "done")
+        # Rejected once, then one digest for every write
+        assert calls == ["contextinfo", "folders", "contextinfo", "folders",
+                         "add(url='new.txt',overwrite=true)", "CheckOut()", "CheckIn(comment='done',checkintype=0)"]
+
+        with pytest.raises(ValueError):
+            await folder.delete_folder("Shared Documents/Other")
+
+    asyncio.run(_run_with_server(test, version=Version.v365))
+
+
+def test_async_site_365_list():
+    async def test(sp_site, calls):
+        sp_list = await sp_site.list("Test List")
+        assert isinstance(sp_list, AsyncList365)
+        assert sp_list.version == "v365"
+        assert sp_list.schema == {}
+
+    asyncio.run(_run_with_server(test, version=Version.v365))
+
+
+def test_async_session_timeout():
+    async def test(sp_site, calls):
+        sp_site.timeout = 5
+        session = sp_site._session
+        # No limit on the whole request, big lists can take longer than any timeout
+        assert session.timeout.total is None
+        assert (session.timeout.sock_connect, session.timeout.sock_read) == (5, 5)
+
+    asyncio.run(_run_with_server(test))
@@ -0,0 +1,62 @@
+import gzip
+import os
+
+import pytest
+
+from shareplum import Site
+
+from .conftest import Handler
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+
+def _read(name):
+    with open(os.path.join(__location__, "data", name), "rb") as f:
+        return f.read()
+
+
+class GzipHandler(Handler):
+    def do_POST(self):
+        self.read_body()
+        self.server.accept_encoding = self.headers["Accept-Encoding"]
+        action = self.headers["SOAPAction"].rsplit("/", 1)[-1]
+        body = gzip.compress(_read("2010xml.xml" if action == "GetList" else "listitems_page1.xml"))
+        if action == "GetList":
+            self.send_body(body, headers={"Content-Encoding": "gzip"})
+            return
+        # The big responses come chunked
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(body), 1000):
+            piece = body[start:start + 1000]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def server(local_server):
+    return local_server(GzipHandler)
+
+
+def test_compressed_responses_are_counted(server):
+    site = Site(server.url, resolve_users=False)
+    sp_list = site.list("Test List")
+
+    rows = sp_list.get_list_items(fields=["Title"])
+    assert rows == [{"Title": "First Row!"}, {"Title": "Another One!"}]
+    assert "gzip" in server.accept_encoding
+
+    page = _read("listitems_page1.xml")
+    assert sp_list.transfer.last == {"url": sp_list._url("Lists"), "encoding": "gzip",
+                                     "compressed": len(gzip.compress(page)), "uncompressed": len(page)}
+
+    # GetList and GetListItems, on the session the Site and List share
+    stats = site.transfer
+    assert stats is sp_list.transfer
+    assert stats.calls == 2
+    assert stats.uncompressed == len(page) + len(_read("2010xml.xml"))
+    assert stats.compressed < stats.uncompressed
+    assert stats.ratio > 1
@@ -0,0 +1,78 @@
+import io
+import re
+
+from shareplum.folder import _Folder
+
+from .conftest import FakeResponse
+from .conftest import FakeSession
+
+SITE = "http://sp/sites/test"
+CONTENT = bytes(range(256)) * 100
+
+
+class RangeSession(FakeSession):
+    def __init__(self, honour_range=True):
+        super().__init__()
+        self.honour_range = honour_range
+        self.ranges = []
+
+    def respond(self, method, url, headers, data, **kwargs):
+        if method == "POST":
+            return FakeResponse(data={"d": {"ServerRelativeUrl": "/sites/test/Shared Documents"}})
+        if url.endswith("?$select=Length"):
+            return FakeResponse(data={"d": {"Length": str(len(CONTENT))}})
+        assert kwargs["stream"]
+        byte_range = headers.get("Range")
+        self.ranges.append(byte_range)
+        if byte_range is None or not self.honour_range:
+            return FakeResponse(content=CONTENT)
+        start, end = re.match(r"bytes=(\d+)-(\d*)", byte_range).groups()
+        start, end = int(start), int(end) if end else len(CONTENT) - 1
+        if start >= len(CONTENT):
+            return FakeResponse(416)
+        return FakeResponse(206, CONTENT[start:end + 1],
+                            headers={"Content-Range": "bytes %d-%d/%d" % (start, end, len(CONTENT))})
+
+
+def test_download_to_file_object():
+    session = RangeSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+    out = io.BytesIO()
+    progress = []
+    folder.download_file("big.bin", out, chunk_size=10000, progress=lambda done, total: progress.append(done))
+    assert out.getvalue() == CONTENT
+    assert progress == [10000, 20000, 25600]
+    assert session.ranges == [None]
+
+
+def test_download_resume(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(CONTENT[:1000])
+    session = RangeSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+
+    folder.download_file("big.bin", str(path), resume=True)
+    assert path.read_bytes() == CONTENT
+    assert session.ranges == ["bytes=1000-"]
+
+    # Already complete
+    folder.download_file("big.bin", str(path), resume=True)
+    assert path.read_bytes() == CONTENT
+
+
+def test_download_resume_without_range_support(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(b"stale")
+    folder = _Folder(RangeSession(honour_range=False), "Shared Documents", SITE)
+    folder.download_file("big.bin", str(path), resume=True)
+    assert path.read_bytes() == CONTENT
+
+
+def test_parallel_download(tmp_path):
+    path = tmp_path / "big.bin"
+    session = RangeSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+    folder.download_file("big.bin", str(path), chunk_size=4096, max_workers=4)
+    assert path.read_bytes() == CONTENT
+    assert sorted(session.ranges) == sorted(["bytes=0-6399", "bytes=6400-12799",
+                                             "bytes=12800-19199", "bytes=19200-25599"])
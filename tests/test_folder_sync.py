@@ -0,0 +1,85 @@
+import json
+import os
+import re
+
+from shareplum.folder import _Folder
+
+from .conftest import FakeResponse
+from .conftest import FakeSession
+
+SITE = "http://sp/sites/test"
+
+
+class FakeLibrary(FakeSession):
+    """A folder tree served through the REST urls _Folder uses"""
+
+    def __init__(self):
+        super().__init__()
+        self.folders = {"Docs", "Docs/Forms"}
+        self.files = {}
+        self.uploads = []
+
+    def respond(self, method, url, headers, data, **kwargs):
+        if method == "GET":
+            return self._get(url)
+        if url.endswith("/_api/web/folders"):
+            name = json.loads(data)["ServerRelativeUrl"]
+            self.folders.add(name)
+            return FakeResponse(data={"d": {"ServerRelativeUrl": "/sites/test/" + name}})
+        folder, name = re.search(r"Url\('(.*)'\)/Files/add\(url='(.*)',", url).groups()
+        self.uploads.append(folder + "/" + name)
+        self.files[folder + "/" + name] = (bytes(data), "2030-01-01T00:00:00Z")
+        return FakeResponse(data={})
+
+    def _get(self, url):
+        match = re.search(r"GetFileByServerRelativeUrl\('/sites/test/(.*)'\)/\$value", url)
+        if match:
+            return FakeResponse(content=self.files[match.group(1)][0])
+        folder, kind = re.search(r"GetFolderByServerRelativeUrl\('(.*)'\)/(files|folders)$", url).groups()
+        if kind == "files":
+            value = [{"Name": path.rsplit("/", 1)[1], "Length": str(len(content)), "TimeLastModified": modified}
+                     for path, (content, modified) in self.files.items() if path.rsplit("/", 1)[0] == folder]
+        else:
+            value = [{"Name": path.rsplit("/", 1)[1]} for path in self.folders if "/" in path and path.rsplit("/", 1)[0] == folder]
+        return FakeResponse(data={"value": value})
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_sync_up_only_sends_changes(tmp_path):
+    _write(str(tmp_path / "a.txt"), b"a")
+    _write(str(tmp_path / "sub" / "deep" / "b.txt"), b"bb")
+    library = FakeLibrary()
+    folder = _Folder(library, "Docs", SITE)
+
+    assert folder.sync_up(str(tmp_path)) == ["a.txt", "sub/deep/b.txt"]
+    assert {"Docs/sub", "Docs/sub/deep"} <= library.folders
+    assert library.files["Docs/sub/deep/b.txt"][0] == b"bb"
+
+    assert folder.sync_up(str(tmp_path)) == []
+
+    _write(str(tmp_path / "a.txt"), b"changed")
+    assert folder.sync_up(str(tmp_path)) == ["a.txt"]
+    assert library.uploads == ["Docs/a.txt", "Docs/sub/deep/b.txt", "Docs/a.txt"]
+
+
+def test_sync_down_only_fetches_changes(tmp_path):
+    library = FakeLibrary()
+    library.folders.update({"Docs/sub"})
+    library.files["Docs/a.txt"] = (b"a", "2020-01-01T00:00:00Z")
+    library.files["Docs/sub/b.txt"] = (b"bb", "2020-01-01T00:00:00Z")
+    folder = _Folder(library, "Docs", SITE)
+
+    assert folder.sync_down(str(tmp_path)) == ["a.txt", "sub/b.txt"]
+    assert (tmp_path / "sub" / "b.txt").read_bytes() == b"bb"
+    assert not (tmp_path / "Forms").exists()
+
+    assert folder.sync_down(str(tmp_path)) == []
+
+    library.files["Docs/sub/b.txt"] = (b"new", "2021-01-01T00:00:00Z")
+    assert folder.sync_down(str(tmp_path)) == ["sub/b.txt"]
+    assert (tmp_path / "sub" / "b.txt").read_bytes() == b"new"
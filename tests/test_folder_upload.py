@@ -0,0 +1,154 @@
+import io
+import re
+
+import pytest
+
+from shareplum import folder as folder_module
+from shareplum.errors import ShareplumUploadError
+from shareplum.folder import _Folder
+
+from .conftest import FakeResponse
+from .conftest import FakeSession
+
+SITE = "http://sp/sites/test"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(folder_module, "CHUNK_RETRY_BACKOFF", 0)
+
+
+class Pipe(io.RawIOBase):
+    """Stream that can't seek or tell its size"""
+
+    def __init__(self, content):
+        self._content = io.BytesIO(content)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._content.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class UploadSession(FakeSession):
+    """Just enough of the SharePoint REST API for chunked uploads"""
+
+    def __init__(self, fail_at=(), status=503):
+        super().__init__()
+        self.fail_at = list(fail_at)
+        self.status = status
+        self.calls = []
+        self.file = b""
+
+    def respond(self, method, url, headers, data, **kwargs):
+        if url.endswith("/_api/web/folders"):
+            return FakeResponse(data={"d": {"ServerRelativeUrl": "/sites/test/Shared Documents"}})
+
+        action = re.search(r"/(\w+)\([^/]*$", url).group(1)
+        self.calls.append(action)
+        if action in self.fail_at:
+            self.fail_at.remove(action)
+            return FakeResponse(self.status)
+        if action == "add":
+            self.file = bytes(data)
+            return FakeResponse(data={})
+        offset = int(re.search(r"fileOffset=(\d+)", url).group(1)) if "fileOffset" in url else 0
+        assert offset == len(self.file)
+        self.file += bytes(data)
+        return FakeResponse(data={"d": {action: str(len(self.file))}})
+
+
+def test_chunked_upload_from_path(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(bytes(range(256)) * 40)
+    session = UploadSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+
+    progress = []
+    folder.upload_file_chunked(str(path), "big.bin", chunk_size=4096,
+                               progress=lambda done, total: progress.append((done, total)))
+    assert session.calls == ["add", "StartUpload", "ContinueUpload", "FinishUpload"]
+    assert session.file == path.read_bytes()
+    assert progress == [(4096, 10240), (8192, 10240), (10240, 10240)]
+
+
+def test_chunked_upload_retries_failed_chunk():
+    content = b"x" * 10000
+    session = UploadSession(fail_at=["ContinueUpload"])
+    folder = _Folder(session, "Shared Documents", SITE)
+
+    folder.upload_file_chunked(io.BytesIO(content), "big.bin", chunk_size=4000)
+    assert session.calls == ["add", "StartUpload", "ContinueUpload", "ContinueUpload", "FinishUpload"]
+    assert session.file == content
+
+
+def test_chunked_upload_resume():
+    content = b"y" * 10000
+    session = UploadSession(fail_at=["ContinueUpload"] * 2)
+    folder = _Folder(session, "Shared Documents", SITE)
+
+    with pytest.raises(ShareplumUploadError) as err:
+        folder.upload_file_chunked(io.BytesIO(content), "big.bin", chunk_size=4000, retries=1)
+    assert err.value.offset == 4000
+
+    folder.upload_file_chunked(io.BytesIO(content), "big.bin", chunk_size=4000,
+                               upload_id=err.value.upload_id, offset=err.value.offset)
+    assert session.file == content
+
+
+def test_small_file_is_one_request():
+    session = UploadSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+    folder.upload_file_chunked(io.BytesIO(b"small"), "small.txt", chunk_size=4000)
+    assert session.calls == ["add"]
+    assert session.file == b"small"
+
+
+@pytest.mark.parametrize("content", [b"abc", b""])
+def test_small_stream_of_unknown_size_is_one_request(content):
+    session = UploadSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+    folder.upload_file_chunked(Pipe(content), "small.txt", chunk_size=4000)
+    assert session.calls == ["add"]
+    assert session.file == content
+
+
+def test_stream_of_unknown_size():
+    content = bytes(range(256)) * 40
+    session = UploadSession()
+    folder = _Folder(session, "Shared Documents", SITE)
+    folder.upload_file_chunked(Pipe(content), "big.bin", chunk_size=4096)
+    assert session.calls == ["add", "StartUpload", "ContinueUpload", "FinishUpload"]
+    assert session.file == content
+
+
+def test_resume_with_one_chunk_left_starts_first():
+    session = UploadSession(fail_at=["StartUpload"] * 2)
+    folder = _Folder(session, "Shared Documents", SITE)
+    with pytest.raises(ShareplumUploadError) as err:
+        folder.upload_file_chunked(io.BytesIO(b"z" * 5000), "big.bin", chunk_size=4000, retries=1)
+    assert err.value.offset == 0
+
+    folder.upload_file_chunked(Pipe(b"abc"), "big.bin", chunk_size=4000,
+                               upload_id=err.value.upload_id, offset=0)
+    assert session.calls[-2:] == ["StartUpload", "FinishUpload"]
+    assert session.file == b"abc"
+
+
+def test_client_error_is_not_retried():
+    session = UploadSession(fail_at=["ContinueUpload"], status=400)
+    folder = _Folder(session, "Shared Documents", SITE)
+    with pytest.raises(ShareplumUploadError) as err:
+        folder.upload_file_chunked(io.BytesIO(b"x" * 10000), "big.bin", chunk_size=4000)
+    assert err.value.offset == 4000
+    assert session.calls == ["add", "StartUpload", "ContinueUpload"]
+
+
+def test_throttled_chunk_is_retried():
+    session = UploadSession(fail_at=["ContinueUpload"], status=429)
+    folder = _Folder(session, "Shared Documents", SITE)
+    folder.upload_file_chunked(io.BytesIO(b"x" * 10000), "big.bin", chunk_size=4000)
+    assert session.calls == ["add", "StartUpload", "ContinueUpload", "ContinueUpload", "FinishUpload"]
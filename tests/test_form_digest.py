@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from shareplum import request_helper
+from shareplum.errors import ShareplumRequestError
+
+from .conftest import FakeResponse
+from .conftest import FakeSession
+
+
+class DigestSession(FakeSession):
+    def __init__(self, lifetime=1800, reject=0):
+        super().__init__()
+        self.digest_lifetime = lifetime
+        self.reject = reject
+        self.writes = []
+
+    def respond(self, method, url, headers, data, **kwargs):
+        self.writes.append(headers["X-RequestDigest"])
+        if self.reject:
+            self.reject -= 1
+            return FakeResponse(403, text="The security validation for this page is invalid.")
+        return FakeResponse()
+
+
+def test_digest_is_reused():
+    session = DigestSession()
+    for _ in range(3):
+        request_helper.post_with_digest(session, "http://sp/sites/test", "http://sp/sites/test/_api/x")
+    assert session.digests == 1
+    assert session.writes == ["digest-1"] * 3
+
+
+def test_digest_refreshed_before_expiry(monkeypatch):
+    session = DigestSession(lifetime=1800)
+    now = [1000.0]
+    monkeypatch.setattr(request_helper.time, "monotonic", lambda: now[0])
+
+    assert request_helper.form_digest(session, "http://sp/sites/test") == "digest-1"
+    now[0] += 1800 - request_helper.DIGEST_EXPIRY_MARGIN - 1
+    assert request_helper.form_digest(session, "http://sp/sites/test") == "digest-1"
+    now[0] += 1
+    assert request_helper.form_digest(session, "http://sp/sites/test") == "digest-2"
+
+
+def test_rejected_digest_is_retried_once():
+    session = DigestSession(reject=1)
+    request_helper.post_with_digest(session, "http://sp/sites/test", "http://sp/sites/test/_api/x")
+    assert session.digests == 2
+    assert session.writes == ["digest-1", "digest-2"]
+
+
+def test_rejected_digest_with_stream_is_not_resent():
+    session = DigestSession(reject=1)
+    with pytest.raises(ShareplumRequestError):
+        request_helper.post_with_digest(session, "http://sp/sites/test", "http://sp/sites/test/_api/x",
+                                        data=io.BytesIO(b"content"))
+    assert session.writes == ["digest-1"]
+    # The next request gets a new digest
+    request_helper.post_with_digest(session, "http://sp/sites/test", "http://sp/sites/test/_api/x")
+    assert session.writes == ["digest-1", "digest-2"]
@@ -0,0 +1,42 @@
+import pytest
+
+from shareplum import list_dict
+
+OLD = [{"ID": 1, "A": "a-b", "B": "c", "Value": 1, "Note": "x"},
+       {"ID": 2, "A": "a", "B": "b-c", "Value": 2, "Note": "y"},
+       {"ID": 3, "A": "d", "B": "e", "Value": 3, "Note": ["multi", "value"]}]
+
+
+def test_digest_index_tuple_keys():
+    assert len(list_dict.full_dict(OLD, ["A", "B"])) == 2
+    index = list_dict.digest_index(OLD, ["A", "B"], ["Value"])
+    assert sorted(index) == [("a", "b-c"), ("a-b", "c"), ("d", "e")]
+    assert index[("a", "b-c")][1] is OLD[1]
+
+
+def test_digest_changes():
+    new = [{"A": "a-b", "B": "c", "Value": 1, "Note": "x"},
+           {"A": "a", "B": "b-c", "Value": 5},
+           {"A": "d", "B": "e", "Value": 3, "Note": ["multi", "value"]},
+           {"A": "f", "B": "g", "Value": 4}]
+    columns = ["Value", "Note"]
+    fast = list_dict.digest_changes(list_dict.digest_index(new, ["A", "B"], columns),
+                                    list_dict.digest_index(OLD, ["A", "B"], columns), "ID", columns)
+    assert fast == [{"Value": 5, "ID": 2}]
+
+
+def test_digest_changes_needs_id_column():
+    new = list_dict.digest_index([{"K": 1, "Value": 2}], "K", ["Value"])
+    old = list_dict.digest_index([{"K": 1, "Value": 1}], "K", ["Value"])
+    with pytest.raises(KeyError):
+        list_dict.digest_changes(new, old, "ID", ["Value"])
+
+
+def test_digest_tells_minus_one_from_minus_two():
+    # hash(-1) == hash(-2) in CPython
+    assert list_dict.row_digest({"Amount": -1.0}, ["Amount"]) != list_dict.row_digest({"Amount": -2}, ["Amount"])
+    assert list_dict.row_digest({"Amount": 1}, ["Amount"]) == list_dict.row_digest({"Amount": 1.0}, ["Amount"])
+
+    new = list_dict.digest_index([{"K": "a", "Amount": -2}], "K", ["Amount"])
+    old = list_dict.digest_index([{"ID": 7, "K": "a", "Amount": -1.0}], "K", ["Amount"])
+    assert list_dict.digest_changes(new, old, "ID", ["Amount"]) == [{"Amount": -2, "ID": 7}]
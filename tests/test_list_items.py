@@ -0,0 +1,416 @@
+import os
+from datetime import datetime
+
+import pytest
+from lxml import etree
+
+from shareplum import list as sp_list
+from shareplum.list import _List2007
+from shareplum.schema_cache import SchemaCache
+
+from .conftest import FakeResponse
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+
+def _read(name):
+    with open(os.path.join(__location__, "data", name), "rb") as f:
+        return f.read()
+
+
+LIST_COLLECTION = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>
+<GetListCollectionResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><GetListCollectionResult><Lists>
+<List Title="Other List" Name="{00000000-0000-0000-0000-000000000000}" Version="1" />
+<List Title="Test List" Name="{CA91A1EF-6352-4C3A-A96E-12729ABDF48F}" Version="%s" />
+</Lists></GetListCollectionResult></GetListCollectionResponse></soap:Body></soap:Envelope>"""
+
+
+UPDATE_RESULT = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>
+<UpdateListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><UpdateListItemsResult>
+<Results>%s</Results></UpdateListItemsResult></UpdateListItemsResponse></soap:Body></soap:Envelope>"""
+
+
+def _update_result(data):
+    methods = etree.fromstring(data).iter("Method")
+    results = "".join('<Result ID="%s,%s"><ErrorCode>0x00000000</ErrorCode></Result>'
+                      % (method.get("ID"), method.get("Cmd")) for method in methods)
+    return (UPDATE_RESULT % results).encode("utf-8")
+
+
+class FakeServer:
+    """Answers SOAP calls with canned responses from tests/data"""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.requests = []
+        self.list_version = b"58"
+
+    def post(self, session, url, headers=None, data=None, **kwargs):
+        action = headers["SOAPAction"].rsplit("/", 1)[-1]
+        if not isinstance(data, bytes):
+            # A chunked body
+            data = b"".join(data)
+        self.requests.append((action, data))
+        if action == "GetList":
+            return FakeResponse(content=_read("2010xml.xml"))
+        if action == "GetViewCollection":
+            return FakeResponse(content=_read("viewcollection.xml"))
+        if action == "GetListItems":
+            return FakeResponse(content=_read(self.pages.pop(0)))
+        if action == "GetListCollection":
+            return FakeResponse(content=LIST_COLLECTION % self.list_version)
+        if action == "UpdateListItems":
+            return FakeResponse(content=_update_result(data))
+        if action == "GetListItemChangesSinceToken":
+            return FakeResponse(content=_read(self.pages.pop(0)))
+        raise AssertionError("Unexpected SOAP call " + action)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer(["listitems_page1.xml", "listitems_page2.xml"])
+    monkeypatch.setattr(sp_list, "post", server.post)
+    return server
+
+
+def _make_list(schema_cache=None, exclude_hidden_fields=False):
+    return _List2007(None, "Test List", lambda service: "http://sp/_vti_bin/lists.asmx", True, None, False, None,
+                     exclude_hidden_fields, site_url="http://sp", schema_cache=schema_cache)
+
+
+def _actions(server):
+    return [action for (action, data) in server.requests]
+
+
+def test_list_schema_is_lazy(server):
+    sp = _make_list()
+    assert server.requests == []
+
+    assert "Title" in sp._disp_cols
+    assert [action for (action, data) in server.requests] == ["GetList"]
+
+    assert "All Items" in sp.views
+    assert [action for (action, data) in server.requests] == ["GetList", "GetViewCollection"]
+
+
+def test_list_prefetch(server):
+    sp = _make_list()
+    sp.prefetch()
+    assert sorted(action for (action, data) in server.requests) == ["GetList", "GetViewCollection"]
+
+    sp.prefetch()
+    assert len(server.requests) == 2
+
+
+def test_iter_list_items_follows_paging_token(server):
+    sp = _make_list()
+    rows = list(sp.iter_list_items(fields=["Title", "ID"], page_size=2))
+
+    assert [row["Title"] for row in rows] == ["First Row!", "Another One!", "Third Row"]
+    assert rows[2] == {"Title": "Third Row", "ID": "3"}
+
+    item_requests = [data for (action, data) in server.requests if action == "GetListItems"]
+    assert len(item_requests) == 2
+    assert b"ListItemCollectionPositionNext" not in item_requests[0]
+    assert b'ListItemCollectionPositionNext="Paged=TRUE&amp;p_ID=2"' in item_requests[1]
+    assert b"<ns1:rowLimit>2</ns1:rowLimit>" in item_requests[1]
+
+
+def test_get_list_items_does_not_modify_fields(server):
+    sp = _make_list()
+    fields = ["Title"]
+    rows = sp.get_list_items(fields=fields)
+
+    assert fields == ["Title"]
+    assert rows == [{"Title": "First Row!"}, {"Title": "Another One!"}]
+
+
+def test_iter_list_items_yields_before_next_page(server):
+    sp = _make_list()
+    rows = sp.iter_list_items(fields=["Title"], page_size=2)
+
+    assert next(rows) == {"Title": "First Row!"}
+    assert [action for (action, data) in server.requests].count("GetListItems") == 1
+
+
+def _rows_response(ids):
+    rows = "".join('<z:row ows_Title="Row %d" ows_ID="%d" />' % (i, i) for i in ids)
+    return FakeResponse(content=(
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+        '<GetListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><GetListItemsResult>'
+        '<listitems xmlns:rs="urn:schemas-microsoft-com:rowset" xmlns:z="#RowsetSchema">'
+        '<rs:data ItemCount="%d">%s</rs:data>'
+        '</listitems></GetListItemsResult></GetListItemsResponse></soap:Body></soap:Envelope>' % (len(ids), rows)
+    ).encode("utf-8"))
+
+
+def test_iter_list_items_parallel_returns_rows_in_id_order(server, monkeypatch):
+    sp = _make_list()
+    sp.prefetch()
+
+    def post(session, url, headers=None, data=None, **kwargs):
+        envelope = etree.fromstring(data)
+        if envelope.find(".//Geq") is None:
+            # Highest ID lookup
+            assert envelope.find(".//OrderBy/FieldRef").get("Ascending") == "FALSE"
+            return _rows_response([23])
+        start = int(envelope.find(".//Geq/Value").text)
+        end = int(envelope.find(".//Lt/Value").text)
+        assert envelope.find(".//Where/And/Eq/Value").text == "Row"
+        return _rows_response(range(start, min(end, 24)))
+
+    monkeypatch.setattr(sp_list, "post", post)
+    query = {"Where": [("Eq", "Title", "Row")]}
+    rows = list(sp.iter_list_items_parallel(fields=["Title", "ID"], query=query, id_range=5, max_workers=3))
+
+    assert [row["ID"] for row in rows] == [str(i) for i in range(1, 24)]
+
+
+def test_schema_cache(server, tmp_path):
+    cache = SchemaCache(str(tmp_path))
+    sp = _make_list(cache)
+    sp.prefetch()
+    fields = sp.fields
+    assert sorted(_actions(server)) == ["GetList", "GetViewCollection"]
+
+    # Unchanged Version, the schema comes from the cache
+    del server.requests[:]
+    sp = _make_list(cache)
+    assert sp.fields == fields
+    assert "All Items" in sp.views
+    assert _actions(server) == ["GetListCollection"]
+
+    # The list changed, the cache is ignored
+    del server.requests[:]
+    server.list_version = b"59"
+    sp = _make_list(cache)
+    assert sp.fields == fields
+    assert _actions(server) == ["GetListCollection", "GetList"]
+
+
+def test_schema_cache_max_age(server, tmp_path):
+    _make_list(SchemaCache(str(tmp_path))).prefetch()
+
+    del server.requests[:]
+    sp = _make_list(SchemaCache(str(tmp_path), max_age=3600))
+    sp.prefetch()
+    assert "Title" in sp._disp_cols
+    assert _actions(server) == []
+
+
+def test_update_list_items_batches(server):
+    sp = _make_list()
+    rows = [{"Title": "Row %d" % i} for i in range(25)]
+    results = sp.update_list_items(rows, "New", batch_size=10)
+
+    batches = [data for (action, data) in server.requests if action == "UpdateListItems"]
+    assert [data.count(b"<Method ") for data in batches] == [10, 10, 5]
+    assert sorted(results) == sorted("%d,New" % i for i in range(1, 26))
+    assert rows[0] == {"Title": "Row 0"}
+
+
+def test_update_list_items_batches_by_size(server):
+    sp = _make_list()
+    results = sp.update_list_items(list(range(1, 101)), "Delete", max_batch_bytes=1000, max_workers=4)
+
+    batches = [data for (action, data) in server.requests if action == "UpdateListItems"]
+    smallest = len(b'<Method ID="1" Cmd="Delete"><Field Name="ID">1</Field></Method>')
+    counts = [data.count(b"<Method ") for data in batches]
+    assert len(counts) > 1 and sum(counts) == 100
+    assert max(counts) <= 1000 // smallest
+    assert sorted(results, key=lambda key: int(key.split(",")[0])) == ["%d,Delete" % i for i in range(1, 101)]
+
+
+def test_update_list_items_stream(server):
+    sp = _make_list()
+    results = sp.update_list_items([{"Title": "Row %d" % i} for i in range(5)], "New", batch_size=2, stream=True)
+
+    assert sorted(results) == ["%d,New" % i for i in range(1, 6)]
+    sent = [data for (action, data) in server.requests if action == "UpdateListItems"]
+    assert len(sent) == 3
+    assert sent[-1] == sp._last_request.data
+    assert "<Method" in sp.last_request
+
+
+def test_apply_list_items_mixed_batch(server):
+    sp = _make_list()
+    results = sp.apply_list_items([("New", {"Title": "Added"}),
+                                   ("Update", {"ID": 2, "Title": "Changed"}),
+                                   ("Delete", 3)])
+
+    batches = [data for (action, data) in server.requests if action == "UpdateListItems"]
+    assert len(batches) == 1
+    methods = [(method.get("ID"), method.get("Cmd")) for method in etree.fromstring(batches[0]).iter("Method")]
+    assert methods == [("1", "New"), ("2", "Update"), ("3", "Delete")]
+    assert results == {"1,New": "0x00000000", "2,Update": "0x00000000", "3,Delete": "0x00000000"}
+
+
+def test_sync(server):
+    server.pages = ["listitems_sync.xml"]
+    sp = _make_list()
+    records = [{"Title": "Keep", "Test": 1, "Comments": "x"},
+               {"Title": "Change", "Test": 5},
+               {"Title": "Added", "Test": 7}]
+    report = sp.sync(records, key="Title")
+
+    assert report["new"] == [{"Title": "Added", "Test": 7}]
+    assert report["updated"] == [{"Test": 5, "ID": "2"}]
+    assert report["deleted"] == ["3"]
+    assert report["unchanged"] == 1
+
+    read = [data for (action, data) in server.requests if action == "GetListItems"][0]
+    fields = [ref.get("Name") for ref in next(etree.fromstring(read).iter("ViewFields"))]
+    assert sorted(fields) == ["Comments", "ID", "Test", "Title"]
+
+    batches = [data for (action, data) in server.requests if action == "UpdateListItems"]
+    assert len(batches) == 1
+    assert sorted(report["results"]) == ["1,Update", "2,New", "3,Delete"]
+
+
+def test_sync_dry_run(server):
+    server.pages = ["listitems_sync.xml"]
+    sp = _make_list()
+    report = sp.sync([{"Title": "Keep", "Test": 1}], key="Title", delete=False, dry_run=True)
+    assert report["unchanged"] == 1
+    assert report["deleted"] == []
+    assert "UpdateListItems" not in _actions(server)
+
+
+def test_sync_compares_values(server):
+    # hash(-1) == hash(-2), the values still differ
+    server.pages = ["listitems_sync_duplicates.xml"]
+    report = _make_list().sync([{"Title": "Keep", "Test": -2}], key="Title", delete=False, dry_run=True)
+    assert report["updated"] == [{"Test": -2, "ID": "1"}]
+    assert report["unchanged"] == 0
+
+
+def test_sync_leaves_duplicate_rows_alone(server):
+    server.pages = ["listitems_sync_duplicates.xml"]
+    report = _make_list().sync([{"Title": "Keep", "Test": -1}, {"Title": "Other", "Test": 4}], key="Title")
+    assert report["duplicates"] == ["2"]
+    assert report["deleted"] == ["4"]
+    batch = [data for (action, data) in server.requests if action == "UpdateListItems"][0]
+    assert [field.text for field in etree.fromstring(batch).iter("Field")] == ["4"]
+
+
+def test_sync_rejects_duplicate_records(server):
+    server.pages = ["listitems_sync_duplicates.xml"]
+    with pytest.raises(ValueError):
+        _make_list().sync([{"Title": "New", "Test": 1}, {"Title": "New", "Test": 2}], key="Title")
+    assert "UpdateListItems" not in _actions(server)
+
+
+def test_sync_none_clears_a_column(server):
+    server.pages = ["listitems_sync_duplicates.xml"]
+    report = _make_list().sync([{"Title": "Other", "Test": 4, "Comments": None}], key="Title", delete=False)
+    assert report["updated"] == [{"Comments": None, "ID": "3"}]
+
+    batch = [data for (action, data) in server.requests if action == "UpdateListItems"][0]
+    assert b'<Field Name="Comments"></Field>' in batch
+    assert b"None" not in batch
+
+
+def test_get_list_items_columns(server):
+    server.pages = ["listitems_types.xml"]
+    sp = _make_list()
+    columns = sp.get_list_items(output="columns")
+
+    assert columns["Title"] == ["First", "Second", None]
+    assert columns["Test"] == [1.5, None, 3.0]
+    assert columns["Test9"] == ["Yes", "No", None]
+    assert columns["Created"] == [datetime(2020, 1, 2, 3, 4, 5), datetime(2021, 5, 6, 7, 8, 9),
+                                  datetime(2022, 12, 31, 23, 59, 59)]
+    assert len(columns["ID"]) == 3
+
+
+def test_get_list_items_pandas(server):
+    pd = pytest.importorskip("pandas")
+    server.pages = ["listitems_types.xml"]
+    frame = _make_list().get_list_items(output="pandas")
+
+    assert frame["Test"].dtype == "float64"
+    assert frame["Test"].isna().tolist() == [False, True, False]
+    assert frame["Created"].tolist() == [pd.Timestamp(2020, 1, 2, 3, 4, 5), pd.Timestamp(2021, 5, 6, 7, 8, 9),
+                                         pd.Timestamp(2022, 12, 31, 23, 59, 59)]
+    assert frame["Test9"].tolist()[:2] == ["Yes", "No"]
+
+
+def test_get_list_items_arrow(server):
+    pa = pytest.importorskip("pyarrow")
+    server.pages = ["listitems_types.xml"]
+    table = _make_list().get_list_items(output="arrow")
+
+    assert table.column("Test").type == pa.float64()
+    assert table.column("Test").to_pylist() == [1.5, None, 3.0]
+    assert table.column("Created").to_pylist()[1] == datetime(2021, 5, 6, 7, 8, 9)
+    assert table.column("Title").to_pylist() == ["First", "Second", None]
+
+
+def test_converters_follow_fields(server):
+    sp = _make_list()
+    assert sp._python_type("Created", "2;#2021-05-06 07:08:09") == datetime(2021, 5, 6, 7, 8, 9)
+    assert sp._python_type("Test10", "1") == "Yes"
+    assert sp._python_type("Test10", "") == ""
+
+    sp.fields = [dict(field, Type="Text") if field["Name"] == "Created" else field for field in sp.fields]
+    assert sp._python_type("Created", "2021-05-06 07:08:09") == "2021-05-06 07:08:09"
+
+
+def test_list_items_without_fields_send_no_view_fields(server):
+    server.pages = ["listitems_page2.xml", "listitems_page2.xml"]
+    for exclude_hidden_fields in (False, True):
+        sp = _make_list(exclude_hidden_fields=exclude_hidden_fields)
+        rows = sp.get_list_items()
+
+        read = [data for (action, data) in server.requests if action == "GetListItems"][-1]
+        assert next(etree.fromstring(read).iter("ViewFields"), None) is None
+        assert rows[0]["Title"] == "Third Row"
+        # The server sends hidden columns too, they are only kept when not excluded
+        assert ("owshiddenversion" in sp._sp_cols) is not exclude_hidden_fields
+        assert (sp._sp_cols.get("owshiddenversion", {}).get("name") in rows[0]) is not exclude_hidden_fields
+
+
+def test_list_item_changes(server, tmp_path):
+    server.pages = ["listitems_page2.xml", "listitemchanges.xml"]
+    cache = SchemaCache(str(tmp_path))
+    sp = _make_list(schema_cache=cache)
+
+    # Without a token every item comes back
+    first = sp.get_list_item_changes(fields=["Title"])
+    assert first["full"] is True
+    assert first["added"] == [{"Title": "Third Row", "ID": "3"}]
+    assert first["token"] is None
+
+    sp.change_token = "1;3;ca91a1ef;636000000000000000;1000"
+    changes = _make_list(schema_cache=cache).get_list_item_changes(fields=["Title"])
+    assert changes["full"] is False
+    assert changes["added"] == [{"Title": "New Row", "ID": "4"}]
+    assert changes["updated"] == [{"Title": "Changed Row", "ID": "2"}]
+    assert changes["deleted"] == ["3"]
+    assert changes["token"] == "1;3;ca91a1ef-6352-4c3a-a96e-12729abdf48f;637000000000000000;1002"
+
+    sent = [data for (action, data) in server.requests if action == "GetListItemChangesSinceToken"][1]
+    assert b"<ns1:changeToken>1;3;ca91a1ef;636000000000000000;1000</ns1:changeToken>" in sent
+    assert _make_list(schema_cache=cache).change_token == changes["token"]
+
+
+def test_list_item_changes_without_hidden_fields(server):
+    server.pages = ["listitemchanges.xml", "listitemchanges.xml"]
+    sp = _make_list(exclude_hidden_fields=True)
+    assert "owshiddenversion" not in sp._disp_cols
+
+    changes = sp.get_list_item_changes(fields=["Title"], change_token="1;3;ca91a1ef;636000000000000000;1000")
+    assert changes["added"] == [{"Title": "New Row", "ID": "4"}]
+    assert changes["updated"] == [{"Title": "Changed Row", "ID": "2"}]
+
+    # Without fields no ViewFields are sent and the server returns the version anyway
+    changes = sp.get_list_item_changes(change_token="1;3;ca91a1ef;636000000000000000;1000")
+    assert [row["ID"] for row in changes["added"]] == ["4"]
+    assert [row["ID"] for row in changes["updated"]] == ["2"]
+
+    first, second = [data for (action, data) in server.requests if action == "GetListItemChangesSinceToken"]
+    assert "owshiddenversion" in [ref.get("Name") for ref in next(etree.fromstring(first).iter("ViewFields"))]
+    assert next(etree.fromstring(second).iter("ViewFields"), None) is None
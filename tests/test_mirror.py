@@ -0,0 +1,89 @@
+import pytest
+
+from shareplum import list as sp_list
+
+from .test_list_items import FakeServer
+from .test_list_items import _actions
+from .test_list_items import _make_list
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer(["listitemchanges_full.xml", "listitemchanges.xml"])
+    monkeypatch.setattr(sp_list, "post", server.post)
+    return server
+
+
+def test_mirror_refresh(server, tmp_path):
+    path = str(tmp_path / "mirror.db")
+    mirror = _make_list().mirror(path, fields=["Title", "Test"])
+
+    rows = mirror.query()
+    assert rows == [{"ID": "1", "Title": "First Row", "Test": 10.0},
+                    {"ID": "2", "Title": "Second Row", "Test": 2.0},
+                    {"ID": "3", "Title": "100%_done"}]
+    assert mirror.change_token == "1;3;ca91a1ef-6352-4c3a-a96e-12729abdf48f;636000000000000000;1000"
+
+    # Served from SQLite until the mirror is refreshed
+    mirror.query()
+    assert _actions(server).count("GetListItemChangesSinceToken") == 1
+
+    mirror.refresh()
+    assert [row["Title"] for row in mirror.query(fields=["Title"])] == ["First Row", "Changed Row", "New Row"]
+    sent = [data for (action, data) in server.requests if action == "GetListItemChangesSinceToken"][1]
+    assert b"636000000000000000;1000</ns1:changeToken>" in sent
+    mirror.close()
+
+    # The items and token survive a restart
+    mirror = _make_list().mirror(path, fields=["Title", "Test"], max_age=3600)
+    mirror._refreshed = 1e18
+    assert mirror.change_token.endswith("637000000000000000;1002")
+    assert len(mirror.query()) == 3
+
+
+def test_mirror_query_pushdown(server, tmp_path):
+    mirror = _make_list().mirror(str(tmp_path / "mirror.db"), fields=["Title", "Test"])
+
+    rows = mirror.query({"Where": ["Or", ("Gt", "Test", "5"), ("IsNull", "Test")],
+                         "OrderBy": [("Title", "DESCENDING")]}, fields=["Title"])
+    assert rows == [{"Title": "First Row"}, {"Title": "100%_done"}]
+
+    assert mirror.query({"Where": [("BeginsWith", "Title", "100%")]}, fields=["ID"]) == [{"ID": "3"}]
+    assert mirror.query({"Where": [("Contains", "Title", "%_d")]}, fields=["ID"]) == [{"ID": "3"}]
+    assert mirror.query({"Where": [("Contains", "Title", "%xd")]}, fields=["ID"]) == []
+    assert mirror.query({"OrderBy": ["Test"]}, fields=["ID"], row_limit=2) == [{"ID": "3"}, {"ID": "2"}]
+
+    indexes = {row[0] for row in mirror._db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"ix_Test", "ix_Title"} <= indexes
+    assert "GetListItems" not in _actions(server)
+
+
+def test_mirror_falls_back_to_sharepoint(server, tmp_path):
+    mirror = _make_list().mirror(str(tmp_path / "mirror.db"), fields=["Title", "Test"])
+    mirror.refresh()
+    server.pages = ["listitems_page2.xml"]
+
+    # Comments isn't mirrored
+    rows = mirror.query({"Where": [("IsNotNull", "Comments")]}, fields=["Title"])
+    assert rows == [{"Title": "Third Row"}]
+    assert _actions(server)[-1] == "GetListItems"
+
+    # Users are stored as '1;#Name', only SharePoint can compare them
+    server.pages = ["listitemchanges_full.xml"]
+    mirror = _make_list().mirror(str(tmp_path / "users.db"), fields=["Title", "Created By"])
+    mirror.refresh()
+    for operator in ("Eq", "Neq", "Contains", "BeginsWith"):
+        server.pages = ["listitems_page2.xml"]
+        rows = mirror.query({"Where": [(operator, "Created By", "Jane")]}, fields=["Title"])
+        assert rows == [{"Title": "Third Row"}]
+        assert _actions(server)[-1] == "GetListItems"
+
+
+def test_mirror_without_hidden_fields(server, tmp_path):
+    mirror = _make_list(exclude_hidden_fields=True).mirror(str(tmp_path / "mirror.db"), fields=["Title", "Test"])
+
+    assert [row["Title"] for row in mirror.query(fields=["Title"])] == ["First Row", "Second Row", "100%_done"]
+    changes = mirror.refresh()
+    assert [row["ID"] for row in changes["added"]] == ["4"]
+    assert [row["ID"] for row in changes["updated"]] == ["2"]
+    assert [row["Title"] for row in mirror.query(fields=["Title"])] == ["First Row", "Changed Row", "New Row"]
@@ -0,0 +1,141 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from shareplum import RateLimiter
+from shareplum import Site
+from shareplum.rate_limit import default_rate_limiter
+from shareplum.rate_limit import retry_after
+from shareplum.request_helper import new_session
+
+from .conftest import FakeResponse
+from .conftest import Handler
+
+
+class Clock:
+    """Time that only moves when the limiter sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRequest:
+    url = "https://tenant.sharepoint.com/sites/test/_vti_bin/lists.asmx"
+    body = b"<xml/>"
+
+
+def _limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket():
+    clock = Clock()
+    limiter = _limiter(clock, rate=2)
+    for _ in range(5):
+        limiter.acquire("tenant.sharepoint.com")
+    # The first request uses the burst, the others wait 1 / rate
+    assert clock.sleeps == [0.5] * 4
+
+    # Hosts have their own buckets
+    limiter.acquire("other.sharepoint.com")
+    assert len(clock.sleeps) == 4
+
+
+def test_unlimited_until_throttled():
+    clock = Clock()
+    limiter = _limiter(clock)
+    responses = [FakeResponse(429, headers={"Retry-After": "3"}), FakeResponse(200)]
+    for _ in range(20):
+        limiter.acquire("tenant.sharepoint.com")
+    assert clock.sleeps == []
+    assert limiter.rate_of("tenant.sharepoint.com") is None
+
+    response = limiter.send(lambda request: responses.pop(0), FakeRequest())
+    assert response.status_code == 200
+    # Retry-After is honoured and the rate halves from the 2.1 requests/s sent
+    assert clock.sleeps == [3.0]
+    assert limiter.rate_of("tenant.sharepoint.com") == pytest.approx(1.05 + 1 / 1.05)
+
+
+def test_throttles_adapt_the_rate():
+    clock = Clock()
+    limiter = _limiter(clock, rate=8, max_rate=10)
+    limiter.throttled("tenant.sharepoint.com", 1)
+    assert limiter.rate_of("tenant.sharepoint.com") == 4
+    # Responses to requests sent before the block don't lower it again
+    limiter.throttled("tenant.sharepoint.com", 1)
+    assert limiter.rate_of("tenant.sharepoint.com") == 4
+
+    for _ in range(100):
+        limiter.succeeded("tenant.sharepoint.com")
+    assert limiter.rate_of("tenant.sharepoint.com") == 10
+
+    clock.now += 1
+    limiter.throttled("tenant.sharepoint.com", 1)
+    assert limiter.rate_of("tenant.sharepoint.com") == 5
+    clock.now += 1
+    limiter.throttled("tenant.sharepoint.com", 1)
+    clock.now += 1
+    limiter.throttled("tenant.sharepoint.com", 1)
+    clock.now += 1
+    limiter.throttled("tenant.sharepoint.com", 1)
+    assert limiter.rate_of("tenant.sharepoint.com") == 0.625
+
+
+def test_gives_up_after_retries():
+    clock = Clock()
+    limiter = _limiter(clock, retries=2, backoff=1)
+    sent = []
+
+    def send(request):
+        sent.append(request)
+        return FakeResponse(503)
+
+    response = limiter.send(send, FakeRequest())
+    assert response.status_code == 503 and not response.closed
+    assert len(sent) == 3
+    # Without Retry-After the wait doubles
+    assert clock.sleeps == [1, 2]
+
+
+def test_retry_after_header():
+    assert retry_after(FakeResponse(429, headers={"Retry-After": "120"})) == 120
+    assert 8 < retry_after(FakeResponse(429, headers={"Retry-After": formatdate(time.time() + 10, usegmt=True)})) <= 10
+    assert retry_after(FakeResponse(429, headers={"Retry-After": "soon"})) is None
+    assert retry_after(FakeResponse(429)) is None
+
+
+def test_sessions_share_the_default_limiter():
+    assert new_session().rate_limiter is default_rate_limiter
+    assert new_session().rate_limiter is default_rate_limiter
+    assert not hasattr(new_session(rate_limiter=None), "rate_limiter")
+
+
+class ThrottleOnceHandler(Handler):
+    def do_POST(self):
+        self.read_body()
+        self.server.requests += 1
+        if self.server.requests == 1:
+            self.send_body(b"", status=429, headers={"Retry-After": "0"})
+            return
+        self.send_body(b'<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/'
+                       b'envelope/"><soap:Body><GetSiteResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/">'
+                       b'<GetSiteResult>site</GetSiteResult></GetSiteResponse></soap:Body></soap:Envelope>')
+
+
+def test_site_retries_throttled_requests(local_server):
+    server = local_server(ThrottleOnceHandler, requests=0)
+    limiter = RateLimiter()
+    site = Site(server.url, resolve_users=False, rate_limiter=limiter)
+    assert site.get_site() == "site"
+    assert server.requests == 2
+    assert limiter.rate_of("127.0.0.1:%d" % server.server_address[1]) is not None
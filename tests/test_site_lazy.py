@@ -0,0 +1,47 @@
+import pytest
+
+from shareplum import Site
+from shareplum import site as sp_site
+
+from .conftest import FakeResponse
+
+USERS = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>
+<GetListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><GetListItemsResult>
+<listitems xmlns:rs="urn:schemas-microsoft-com:rowset" xmlns:z="#RowsetSchema"><rs:data ItemCount="1">
+<z:row ows_ID="7" ows_ImnName="Jane Doe" />
+</rs:data></listitems></GetListItemsResult></GetListItemsResponse></soap:Body></soap:Envelope>"""
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def post(session, url, headers=None, data=None, **kwargs):
+        calls.append(headers["SOAPAction"].rsplit("/", 1)[-1])
+        return FakeResponse(content=USERS)
+
+    monkeypatch.setattr(sp_site, "post", post)
+    return calls
+
+
+def test_site_is_lazy(calls):
+    site = Site("http://sp/sites/test")
+    assert calls == []
+
+    assert site.users["py"] == {"Jane Doe": "7;#Jane Doe"}
+    assert site.users["sp"] == {"7;#Jane Doe": "Jane Doe"}
+    assert calls == ["GetListItems"]
+
+
+def test_site_users_from_cache(calls):
+    users = {"py": {}, "sp": {}}
+    site = Site("http://sp/sites/test", users=users)
+    assert site.users is users
+    assert calls == []
+
+
+def test_site_without_user_resolution(calls):
+    site = Site("http://sp/sites/test", resolve_users=False)
+    assert site.users is None
+    assert calls == []
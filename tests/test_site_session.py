@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from shareplum import Site
+from shareplum.site import Version
+
+from .conftest import Handler
+
+USERS = b"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>
+<GetListItemsResponse xmlns="http://schemas.microsoft.com/sharepoint/soap/"><GetListItemsResult>
+<listitems xmlns:rs="urn:schemas-microsoft-com:rowset" xmlns:z="#RowsetSchema"><rs:data ItemCount="1">
+<z:row ows_ID="7" ows_ImnName="Jane Doe" />
+</rs:data></listitems></GetListItemsResult></GetListItemsResponse></soap:Body></soap:Envelope>"""
+
+
+class UsersHandler(Handler):
+    def do_POST(self):
+        self.read_body()
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+        self.send_body(USERS)
+
+
+@pytest.fixture
+def server(local_server):
+    return local_server(UsersHandler, lock=threading.Lock(), connections=set())
+
+
+def test_pool_is_shared_by_threads(server):
+    site = Site(server.url, resolve_users=False, pool_maxsize=4, pool_block=True)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(lambda i: site.get_users(), range(200)))
+
+    assert all(users["py"] == {"Jane Doe": "7;#Jane Doe"} for users in results)
+    # Connections are reused instead of opened per request
+    assert len(server.connections) <= 4
+
+
+def test_sites_share_a_session(server):
+    first = Site(server.url, resolve_users=False, pool_maxsize=2, pool_block=True)
+    second = Site(server.url + "/other", session=first.session, resolve_users=False)
+    assert second.session is first.session
+
+    sites = [first, second] * 50
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda site: site.get_users(), sites))
+
+    assert len(results) == 100
+    assert len(server.connections) <= 2
+
+
+def test_keep_alive_off(server):
+    site = Site(server.url, resolve_users=False, keep_alive=False)
+    for _ in range(3):
+        site.get_users()
+    assert site.session.headers["Connection"] == "close"
+    assert len(server.connections) == 3
+
+
+def test_shared_session_keeps_its_credentials(server):
+    first = Site(server.url, auth=("first", "secret"), resolve_users=False)
+    with pytest.raises(ValueError):
+        Site(server.url + "/other", auth=("second", "secret"), session=first.session, resolve_users=False)
+    assert first.session.auth == ("first", "secret")
+
+
+def test_shared_session_headers_unchanged(server):
+    first = Site(server.url, resolve_users=False)
+    headers = dict(first.session.headers)
+    second = Site(server.url + "/other", version=Version.v365, session=first.session, resolve_users=False)
+    assert second.session is first.session
+    assert dict(first.session.headers) == headers
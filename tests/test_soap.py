@@ -0,0 +1,77 @@
+import pytest
+from lxml import etree
+
+from shareplum.soap import Soap
+
+
+def _update_request():
+    soap_request = Soap("UpdateListItems")
+    soap_request.add_parameter("listName", "Test List")
+    soap_request.add_actions([{"Title": "Café & <bar>"}, {"Title": "Second"}, {"Title": "Third"}], "New")
+    return soap_request
+
+
+def test_data_is_compact_and_cached():
+    soap_request = _update_request()
+    data = soap_request.data
+
+    assert data.startswith(b'<?xml version="1.0" encoding="utf-8"?><SOAP-ENV:Envelope')
+    assert b"\n" not in data
+    assert "Café &amp; &lt;bar&gt;".encode("utf-8") in data
+    assert soap_request.data is data
+    assert etree.fromstring(data).find(".//Batch") is not None
+
+    # Changes are picked up
+    soap_request.add_parameter("rowLimit", "1")
+    assert b"<ns1:rowLimit>1</ns1:rowLimit>" in soap_request.data
+
+
+def test_chunks_match_data():
+    expected = _update_request().data
+    soap_request = _update_request()
+
+    chunks = list(soap_request.chunks(chunk_size=50))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == expected
+
+    # The tree is left as it was
+    assert len(soap_request.batch) == 3
+    assert soap_request.data == expected
+    assert b"".join(Soap("GetList").chunks()) == Soap("GetList").data
+
+
+ROWS = [{"Title": 'Tab\there "quoted" & <tagged>\r\n', "Amount": 1.5, 'Odd "name"\n': "é€𝄞 ]]>"},
+        {"Title": "", "Empty": None}]
+
+
+def _batch(writer):
+    soap_request = Soap("UpdateListItems", writer=writer)
+    soap_request.add_parameter("listName", "Test List")
+    soap_request.add_actions(ROWS, "New")
+    soap_request.add_actions(["3", "4"], "Delete", start=3)
+    soap_request.add_method(Soap.method(5, "Update", {"ID": "1", "Title": "x"}))
+    soap_request.add_method(Soap.method_bytes(6, "Update", {"ID": "2", "Title": "y"}))
+    return soap_request
+
+
+def test_bytes_writer_matches_tree():
+    tree = _batch("tree")
+    fast = _batch("bytes")
+
+    assert fast.batch is not None and len(fast.batch) == 0
+    assert fast.data == tree.data
+    assert b"".join(_batch("bytes").chunks(chunk_size=100)) == tree.data
+    assert str(fast).count("<Method ") == 6
+
+    for kind, row in [("New", row) for row in ROWS] + [("Delete", "7")]:
+        assert Soap.method_bytes(1, kind, row) == etree.tostring(Soap.method(1, kind, row), encoding="utf-8")
+
+
+def test_bytes_writer_rejects_what_lxml_rejects():
+    for value in ["\x00", "bell\x07", "￾"]:
+        with pytest.raises(ValueError):
+            Soap.method(1, "New", {"Title": value})
+        with pytest.raises(ValueError):
+            Soap.method_bytes(1, "New", {"Title": value})
+    with pytest.raises(ValueError):
+        Soap("UpdateListItems", writer="string")